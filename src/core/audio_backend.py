@@ -0,0 +1,288 @@
+from collections import namedtuple
+import threading
+import time
+import numpy as np
+
+StreamStats = namedtuple("StreamStats", ["blocks", "frames", "underruns", "mean_callback", "max_callback", "load"])
+
+
+class CallbackStop(Exception):
+	"""
+	Raised by a stream callback to stop the stream once the block it just
+	wrote has played.
+	"""
+
+
+class CallbackFlags:
+	__slots__ = ("output_underflow",)
+
+	def __init__(self, output_underflow=False):
+		"""
+		Stream status passed to callbacks by backends other than sounddevice,
+		with the same attribute sounddevice.CallbackFlags has.
+		"""
+		self.output_underflow = output_underflow
+
+	def __bool__(self):
+		return self.output_underflow
+
+
+class AudioBackend:
+	"""
+	Interface to an audio output device. Playback code opens streams
+	through the current backend (see get_backend()) rather than calling a
+	sound library directly, so it can run against a NullBackend.
+	"""
+
+	def open_stream(self, sample_rate, channels, block_size, callback, finished_callback=None):
+		"""
+		Open a float32 output stream, stopped until its start() is called.
+
+		Args:
+			sample_rate (int): Frames per second.
+			channels (int): Output channels.
+			block_size (int): Frames per callback.
+			callback (callable): callback(outdata, frames, time, status),
+				filling the (frames, channels) array `outdata`. It may raise
+				CallbackStop to end the stream.
+			finished_callback (callable or None): Called without arguments
+				once the stream has stopped, for any reason.
+
+		Returns:
+			Stream with start(), stop(), abort() and close() methods and an
+			`active` attribute.
+		"""
+		raise NotImplementedError("Subclasses must implement `open_stream`.")
+
+	def play(self, data, sample_rate, block_size=1024):
+		"""
+		Play a (frames,) or (frames, channels) array, returning once it has
+		played.
+		"""
+		frames = np.asarray(data, dtype=np.float32)
+		frames = frames.reshape(len(frames), -1)
+		position = 0
+		finished = threading.Event()
+
+		def callback(outdata, count, time_info, status):
+			nonlocal position
+			chunk = frames[position:position + count]
+			outdata[:len(chunk)] = chunk
+			outdata[len(chunk):] = 0
+			position += count
+			if position >= len(frames):
+				raise CallbackStop
+
+		stream = self.open_stream(sample_rate, frames.shape[1], block_size, callback, finished.set)
+		try:
+			stream.start()
+			finished.wait()
+		finally:
+			stream.close()
+
+
+class SoundDeviceBackend(AudioBackend):
+	def __init__(self, device=None, latency="low"):
+		"""
+		Backend playing through sounddevice (PortAudio). sounddevice is only
+		imported here, so modules that play audio still import on machines
+		without PortAudio.
+
+		Args:
+			device (int, str or None): Output device; None for the default.
+			latency (str or float): Suggested latency, as sounddevice takes it.
+		"""
+		import sounddevice
+		self._sd = sounddevice
+		self.device = device
+		self.latency = latency
+
+	def open_stream(self, sample_rate, channels, block_size, callback, finished_callback=None):
+		sd = self._sd
+
+		def device_callback(outdata, frames, time_info, status):
+			try:
+				callback(outdata, frames, time_info, status)
+			except CallbackStop:
+				raise sd.CallbackStop
+
+		return sd.OutputStream(samplerate=sample_rate, channels=channels, dtype="float32",
+			blocksize=block_size, device=self.device, latency=self.latency,
+			callback=device_callback, finished_callback=finished_callback)
+
+	def play(self, data, sample_rate, block_size=1024):
+		self._sd.play(data, samplerate=sample_rate, device=self.device)
+		self._sd.wait()
+
+
+class NullBackend(AudioBackend):
+	def __init__(self, realtime=False, record=True, duration=None):
+		"""
+		Virtual output device for machines without a sound card, tests and
+		benchmarks. Its streams run their callback on a thread against a
+		simulated clock, either as fast as possible or paced to real time,
+		and keep what they received along with callback timings. Unpaced
+		streams measure throughput; they call back faster than a feeder
+		thread can keep up, so pace them to test playback itself.
+
+		Args:
+			realtime (bool): Pace callbacks to the sample rate like a device.
+			record (bool): Keep every block the streams receive.
+			duration (float or None): Stop streams after this many seconds
+				of simulated time, for endless sources.
+		"""
+		self.realtime = realtime
+		self.record = record
+		self.duration = duration
+		self.streams = []  # Every stream opened, oldest first
+
+	def open_stream(self, sample_rate, channels, block_size, callback, finished_callback=None):
+		stream = NullStream(sample_rate, channels, block_size, callback, finished_callback,
+			realtime=self.realtime, record=self.record, duration=self.duration)
+		self.streams.append(stream)
+		return stream
+
+
+class NullStream:
+	def __init__(self, sample_rate, channels, block_size, callback, finished_callback=None,
+			realtime=False, record=True, duration=None):
+		"""
+		Output stream of a NullBackend. A callback that takes longer than
+		the audio it produced counts as an underrun, and is reported to the
+		next callback through `status.output_underflow` like a device would.
+		"""
+		self.sample_rate = sample_rate
+		self.channels = channels
+		self.block_size = block_size or 1024  # 0 lets sounddevice pick one
+		self.callback = callback
+		self.finished_callback = finished_callback
+		self.realtime = realtime
+		self.record = record
+		self.max_frames = None if duration is None else int(duration * sample_rate)
+		self.frames = 0  # Simulated clock, in frames played
+		self.active = False
+		self._blocks = []
+		self._timings = []
+		self._underruns = 0
+		self._stopping = threading.Event()
+		self._thread = None
+
+	@property
+	def time(self):
+		"""
+		Simulated stream time in seconds.
+		"""
+		return self.frames / self.sample_rate
+
+	def start(self):
+		if self._thread is not None:
+			return
+		self._stopping.clear()
+		self.active = True
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+
+	def _run(self):
+		outdata = np.zeros((self.block_size, self.channels), dtype=np.float32)
+		period = self.block_size / self.sample_rate
+		status = CallbackFlags()
+		origin = time.perf_counter()
+		try:
+			while not self._stopping.is_set():
+				began = time.perf_counter()
+				stopping = False
+				try:
+					self.callback(outdata, self.block_size, self.time, status)
+				except CallbackStop:
+					stopping = True
+				elapsed = time.perf_counter() - began
+				self._timings.append(elapsed)
+				status = CallbackFlags(elapsed > period)
+				self._underruns += status.output_underflow
+				if self.record:
+					self._blocks.append(outdata.copy())
+				self.frames += self.block_size
+				if stopping or (self.max_frames is not None and self.frames >= self.max_frames):
+					break
+				if self.realtime:
+					delay = origin + self.time - time.perf_counter()
+					if delay > 0:
+						self._stopping.wait(delay)
+		except Exception as e:
+			print(f"Error in audio callback: {e}!")
+		finally:
+			self.active = False
+			if self.finished_callback is not None:
+				self.finished_callback()
+
+	def stop(self):
+		"""
+		Stop the stream after the callback in progress.
+		"""
+		self._stopping.set()
+		if self._thread is not None and self._thread is not threading.current_thread():
+			self._thread.join()
+
+	abort = stop
+
+	def close(self):
+		self.stop()
+
+	def recording(self):
+		"""
+		Returns:
+			np.ndarray: (frames, channels) float32 copy of everything played.
+		"""
+		if not self._blocks:
+			return np.zeros((0, self.channels), dtype=np.float32)
+		return np.concatenate(self._blocks)
+
+	def timings(self):
+		"""
+		Returns:
+			np.ndarray: Wall-clock seconds each callback took.
+		"""
+		return np.array(self._timings)
+
+	def stats(self):
+		"""
+		Returns:
+			StreamStats: Blocks and frames played, underruns, mean and
+			maximum callback time in seconds, and load: callback time as a
+			fraction of the audio time it produced.
+		"""
+		timings = self.timings()
+		busy = timings.sum()
+		return StreamStats(len(timings), self.frames, self._underruns,
+			busy / len(timings) if len(timings) else 0.0,
+			timings.max() if len(timings) else 0.0,
+			busy / self.time if self.frames else 0.0)
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+_current_backend = None
+
+
+def set_backend(backend):
+	"""
+	Make `backend` the AudioBackend all playback goes through.
+	"""
+	global _current_backend
+	_current_backend = backend
+
+
+def get_backend():
+	"""
+	The current AudioBackend, a SoundDeviceBackend unless set_backend() was
+	called.
+	"""
+	global _current_backend
+	if _current_backend is None:
+		_current_backend = SoundDeviceBackend()
+	return _current_backend
@@ -0,0 +1,164 @@
+import numpy as np
+import soundfile as sf
+
+LAYOUTS = {1: "mono", 2: "stereo"}  # Channel count -> layout name; others are "multi"
+
+
+class AudioBuffer:
+	__slots__ = ("_data", "sample_rate", "offset", "_owned")
+
+	def __init__(self, data, sample_rate, offset=0, owned=False):
+		"""
+		Samples with the metadata needed to interpret them, handed between
+		loading, processing and playback without copying. The samples stay
+		in their own dtype and memory; slicing and channel selection return
+		views, and a mono buffer presented as stereo is a broadcast view of
+		one channel rather than a duplicate.
+
+		Buffers never write to memory they might share. writable() returns
+		an array that is safe to modify, copying on the first call unless
+		the buffer already owns its samples, and copy() makes an owned
+		buffer explicitly.
+
+		Args:
+			data (np.ndarray): (frames,) or (frames, channels) samples. Mono
+				input is viewed as one channel, never copied.
+			sample_rate (int): Frames per second.
+			offset (int): Frame index of the first frame within the signal
+				the samples were taken from.
+			owned (bool): True if nothing else refers to `data`, so it may be
+				modified in place.
+		"""
+		data = np.asarray(data)
+		if data.ndim == 1:
+			data = data[:, np.newaxis]
+		elif data.ndim != 2:
+			raise ValueError(f"Audio data must have 1 or 2 dimensions, not {data.ndim}")
+		self._data = data
+		self.sample_rate = sample_rate
+		self.offset = offset
+		self._owned = owned
+
+	@classmethod
+	def read(cls, filepath, dtype="float32", start=0, stop=None):
+		"""
+		Read frames [start, stop) of an audio file into an owned buffer.
+		"""
+		data, rate = sf.read(filepath, dtype=dtype, start=start, stop=stop, always_2d=True)
+		return cls(data, rate, offset=start, owned=True)
+
+	@property
+	def data(self):
+		"""
+		(frames, channels) samples. Read-only unless the buffer owns them;
+		use writable() to modify them.
+		"""
+		if self._owned:
+			return self._data
+		view = self._data.view()
+		view.flags.writeable = False
+		return view
+
+	@property
+	def dtype(self):
+		return self._data.dtype
+
+	@property
+	def shape(self):
+		return self._data.shape
+
+	@property
+	def frames(self):
+		return len(self._data)
+
+	@property
+	def channels(self):
+		return self._data.shape[1]
+
+	@property
+	def layout(self):
+		return LAYOUTS.get(self.channels, "multi")
+
+	@property
+	def duration(self):
+		return self.frames / self.sample_rate
+
+	@property
+	def start_time(self):
+		return self.offset / self.sample_rate
+
+	def __len__(self):
+		return len(self._data)
+
+	def __array__(self, dtype=None, copy=None):
+		if copy:
+			return np.array(self._data, dtype=dtype)
+		return self.data if dtype is None else self.data.astype(dtype, copy=False)
+
+	def __getitem__(self, key):
+		"""
+		Frame slices, optionally with a channel index or slice, as views:
+		buffer[100:200], buffer[:, 0], buffer[100:200, ::-1].
+		"""
+		frames, channels = key if isinstance(key, tuple) else (key, slice(None))
+		if not isinstance(frames, slice):
+			raise TypeError("AudioBuffers are indexed by frame slices")
+		start, stop, step = frames.indices(len(self._data))
+		if step != 1:
+			raise ValueError("Frame slices must be contiguous")
+		if isinstance(channels, (int, np.integer)):
+			index = range(self.channels)[channels]  # Raises IndexError when out of range
+			channels = slice(index, index + 1)
+		return AudioBuffer(self._data[start:max(start, stop), channels], self.sample_rate,
+			self.offset + start)
+
+	def channel(self, index):
+		"""
+		One channel as a mono buffer view.
+		"""
+		return self[:, index]
+
+	def with_channels(self, channels):
+		"""
+		The buffer with `channels` channels: itself if it has them already,
+		or a broadcast view repeating a mono buffer's only channel.
+		"""
+		if channels == self.channels:
+			return self
+		if self.channels != 1:
+			raise ValueError(f"Can't present {self.channels} channels as {channels}")
+		return AudioBuffer(np.broadcast_to(self._data, (len(self._data), channels)),
+			self.sample_rate, self.offset)
+
+	def as_float(self, dtype=np.float32):
+		"""
+		The buffer with floating-point samples in [-1, 1). Integer PCM is
+		scaled by its full range; samples already of `dtype` are not copied.
+		"""
+		if self._data.dtype == dtype:
+			return self
+		data = self._data.astype(dtype)
+		if np.issubdtype(self._data.dtype, np.integer):
+			data /= np.iinfo(self._data.dtype).max + 1
+		return AudioBuffer(data, self.sample_rate, self.offset, owned=True)
+
+	def copy(self):
+		"""
+		A buffer owning a contiguous copy of the samples.
+		"""
+		return AudioBuffer(np.array(self._data), self.sample_rate, self.offset, owned=True)
+
+	def writable(self):
+		"""
+		The samples as an array that may be modified in place. The first
+		call on a buffer that doesn't own its samples copies them; the
+		buffer uses the copy from then on.
+		"""
+		if not self._owned:
+			self._data = np.array(self._data)
+			self._owned = True
+		return self._data
+
+	def __repr__(self):
+		return (f"AudioBuffer({self.frames} frames, {self.layout}, {self.dtype}, "
+			f"{self.sample_rate} Hz, offset {self.offset})")
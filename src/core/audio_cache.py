@@ -0,0 +1,258 @@
+from collections import OrderedDict
+import hashlib
+import os
+import struct
+import threading
+import numpy as np
+import soundfile as sf
+from src.core.audio_info import file_identity, get_audio_info
+from src.core.resample import resample
+
+class PCMCache:
+	MAGIC = b"PMPCM001"
+	HEADER = struct.Struct("<8sqqIIq")  # magic, mtime_ns, size, rate, channels, frames
+	HEADER_SIZE = 64  # Header is zero-padded so the samples stay aligned
+	COMPRESSED_FORMATS = ("MP3", "OGG", "FLAC")
+	DECODE_BLOCK_SIZE = 1 << 16
+
+	def __init__(self, directory=None):
+		"""
+		On-disk cache of compressed audio files decoded to raw float32 PCM.
+		Each entry is a small header followed by (frames, channels) samples,
+		opened with np.memmap so the OS page cache shares it between processes
+		and across restarts. An entry is rebuilt whenever its source file's
+		mtime or size change.
+
+		Args:
+			directory (str or None): Where entries are stored. Defaults to
+				$PYMUSE_PCM_CACHE or ~/.cache/pymuse/pcm.
+		"""
+		self._directory = directory
+
+	@property
+	def directory(self):
+		# The default is looked up on use, so $PYMUSE_PCM_CACHE can be set after import
+		if self._directory is not None:
+			return self._directory
+		return os.environ.get("PYMUSE_PCM_CACHE",
+			os.path.join(os.path.expanduser("~"), ".cache", "pymuse", "pcm"))
+
+	def is_compressed(self, path):
+		try:
+			return sf.info(path).format in self.COMPRESSED_FORMATS
+		except (RuntimeError, sf.LibsndfileError):
+			return False
+
+	def entry_path(self, path):
+		digest = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+		return os.path.join(self.directory, f"{digest}.pcm")
+
+	def load(self, filename):
+		"""
+		Return the decoded samples of `filename` as a read-only memmap,
+		decoding the file into the cache first if needed.
+
+		Returns:
+			Tuple[np.memmap, int]: (frames, channels) float32 data and its
+			sample rate.
+		"""
+		path, mtime, size = file_identity(filename)
+		entry = self.entry_path(path)
+		header = self._read_header(entry)
+		if header is None or header[:2] != (mtime, size):
+			self._decode(path, entry, mtime, size)
+			header = self._read_header(entry)
+		_, _, sample_rate, channels, frames = header
+		if frames == 0:
+			return np.zeros((0, channels), dtype=np.float32), sample_rate
+		data = np.memmap(entry, dtype="<f4", mode="r", offset=self.HEADER_SIZE,
+			shape=(frames, channels))
+		return data, sample_rate
+
+	def _read_header(self, entry):
+		"""
+		Returns:
+			Tuple or None: (mtime_ns, size, rate, channels, frames), or None if
+			the entry is missing or not a valid cache file.
+		"""
+		try:
+			with open(entry, "rb") as file:
+				raw = file.read(self.HEADER.size)
+		except FileNotFoundError:
+			return None
+		if len(raw) < self.HEADER.size:
+			return None
+		magic, *fields = self.HEADER.unpack(raw)
+		if magic != self.MAGIC:
+			return None
+		return tuple(fields)
+
+	def _decode(self, path, entry, mtime, size):
+		"""
+		Decode `path` block by block into a temporary file, then move it into
+		place so readers never see a partial entry.
+		"""
+		os.makedirs(self.directory, exist_ok=True)
+		temp_path = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+		try:
+			with sf.SoundFile(path) as source:
+				rate, channels = source.samplerate, source.channels
+				with open(temp_path, "wb") as file:
+					file.write(self.HEADER.pack(self.MAGIC, mtime, size, rate, channels, 0)
+						.ljust(self.HEADER_SIZE, b"\0"))
+					written = 0
+					for block in source.blocks(self.DECODE_BLOCK_SIZE, dtype="float32",
+							always_2d=True):
+						file.write(block.astype("<f4", copy=False).tobytes())
+						written += len(block)
+					# Record how many frames were actually decoded
+					file.seek(0)
+					file.write(self.HEADER.pack(self.MAGIC, mtime, size, rate, channels, written))
+			os.replace(temp_path, entry)
+		finally:
+			if os.path.exists(temp_path):
+				os.remove(temp_path)
+
+
+_pcm_cache = PCMCache()
+
+def get_pcm_cache():
+	"""
+	Return the on-disk PCM cache, or None if it has been disabled.
+	"""
+	return _pcm_cache
+
+def set_pcm_cache(cache):
+	"""
+	Replace the on-disk PCM cache; pass None to always decode in memory.
+	"""
+	global _pcm_cache
+	_pcm_cache = cache
+
+class DecodedAudioCache:
+	DEFAULT_MAX_BYTES = 1 << 30  # 1 GiB
+
+	def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+		"""
+		Process-wide cache of decoded audio files, keyed by file identity
+		(path, mtime, size) and sample type, with least-recently-used
+		eviction once the decoded data exceeds `max_bytes`. Compressed files
+		are decoded through the on-disk PCM cache and memory-mapped; mapped
+		pages belong to the OS page cache and don't count against the budget.
+
+		Cached arrays are read-only; callers slice views out of them instead
+		of copying. An evicted array stays alive for as long as some view
+		still refers to it, it just stops counting against the budget.
+		"""
+		self.max_bytes = max_bytes
+		self._entries = OrderedDict()  # key -> (data, sample_rate)
+		self._keys_by_path = {}
+		self._nbytes = 0
+		self._lock = threading.Lock()
+
+	def get(self, filename, dtype="float32", sample_rate=None):
+		"""
+		Return the decoded contents of `filename`, decoding it on a miss.
+
+		Args:
+			filename (str): Path to the audio file.
+			dtype (str): Sample type to decode to.
+			sample_rate (int or None): Rate to resample to; resampled data is
+				cached alongside the file's native data.
+
+		Returns:
+			Tuple[np.ndarray, int]: Read-only (frames, channels) data and its
+			sample rate.
+		"""
+		path, mtime, size = file_identity(filename)
+		if sample_rate == get_audio_info(path).sample_rate:
+			sample_rate = None
+		key = (path, mtime, size, np.dtype(dtype).str, sample_rate)
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None:
+				self._entries.move_to_end(key)
+				return entry
+		if sample_rate is None:
+			data, sample_rate = self._decode(path, dtype)
+		else:
+			native, native_rate = self.get(path, dtype)
+			data = resample(native, native_rate, sample_rate)
+		data.flags.writeable = False
+		with self._lock:
+			# Another thread may have decoded it meanwhile; keep the first copy
+			if key in self._entries:
+				return self._entries[key]
+			self._insert(key, (data, sample_rate))
+		return data, sample_rate
+
+	def _decode(self, path, dtype):
+		pcm_cache = get_pcm_cache()
+		if (pcm_cache is not None and np.dtype(dtype) == np.float32
+				and pcm_cache.is_compressed(path)):
+			return pcm_cache.load(path)
+		return sf.read(path, dtype=dtype, always_2d=True)
+
+	@staticmethod
+	def _cost(data):
+		return 0 if isinstance(data, np.memmap) else data.nbytes
+
+	def _insert(self, key, entry):
+		"""
+		Add an entry, replacing stale versions of the same file and evicting
+		the least recently used entries; the caller must hold _lock.
+		"""
+		path = key[0]
+		keys = self._keys_by_path.setdefault(path, set())
+		for stale in [other for other in keys if other[1:3] != key[1:3]]:
+			self._remove(stale)
+			keys.discard(stale)
+		keys.add(key)
+		self._entries[key] = entry
+		self._nbytes += self._cost(entry[0])
+		# Never evict the entry that was just added, even if it alone is too big
+		self._evict(keep=1)
+
+	def _evict(self, keep=0):
+		"""
+		Drop least recently used entries until the cache fits its budget or
+		only `keep` entries remain; the caller must hold _lock.
+		"""
+		while self._nbytes > self.max_bytes and len(self._entries) > keep:
+			oldest = next(iter(self._entries))
+			self._remove(oldest)
+			self._keys_by_path.get(oldest[0], set()).discard(oldest)
+
+	def _remove(self, key):
+		data, _ = self._entries.pop(key)
+		self._nbytes -= self._cost(data)
+
+	@property
+	def nbytes(self):
+		return self._nbytes
+
+	def __len__(self):
+		return len(self._entries)
+
+	def set_max_bytes(self, max_bytes):
+		"""
+		Change the memory budget, evicting entries if it shrank.
+		"""
+		with self._lock:
+			self.max_bytes = max_bytes
+			self._evict()
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self._keys_by_path.clear()
+			self._nbytes = 0
+
+
+_decoded_audio_cache = DecodedAudioCache()
+
+def get_decoded_audio_cache():
+	"""
+	Return the cache shared by every AudioSource in this process.
+	"""
+	return _decoded_audio_cache
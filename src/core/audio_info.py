@@ -0,0 +1,147 @@
+import atexit
+from collections import namedtuple
+import json
+import os
+import tempfile
+import threading
+import time
+import soundfile as sf
+from pydub.utils import mediainfo
+
+AudioInfo = namedtuple("AudioInfo", ["duration", "frames", "channels", "sample_rate"])
+
+_cache = {}  # Absolute path -> (mtime_ns, size, AudioInfo)
+_cache_lock = threading.Lock()
+_index_path = None
+_index_dirty = False  # The cache holds entries the index doesn't
+_index_saved = 0.0  # time.monotonic() of the last index write
+INDEX_SAVE_INTERVAL = 5.0  # Minimum seconds between index writes while probing
+
+
+def file_identity(filename):
+	"""
+	Identify a file's current contents by absolute path, mtime and size.
+
+	Returns:
+		Tuple[str, int, int]: (path, mtime in ns, size in bytes).
+	"""
+	path = os.path.abspath(filename)
+	stat = os.stat(path)
+	return path, stat.st_mtime_ns, stat.st_size
+
+
+def get_audio_info(filename):
+	"""
+	Return the duration, frame count, channel count and sample rate of an
+	audio file. Results are cached by path, mtime and size, so a file is
+	only inspected again after it changes.
+
+	Args:
+		filename (str): Path to the audio file.
+
+	Returns:
+		AudioInfo: The file's metadata.
+	"""
+	path, mtime, size = file_identity(filename)
+	with _cache_lock:
+		entry = _cache.get(path)
+	if entry is not None and entry[:2] == (mtime, size):
+		return entry[2]
+	info = _read_audio_info(path)
+	global _index_dirty
+	with _cache_lock:
+		_cache[path] = (mtime, size, info)
+		_index_dirty = True
+		# Indexing many files writes the index now and then, not per file
+		if _index_path is not None and time.monotonic() - _index_saved >= INDEX_SAVE_INTERVAL:
+			_save_index(_index_path)
+	return info
+
+
+def _read_audio_info(path):
+	"""
+	Read metadata with soundfile, falling back to an ffprobe subprocess
+	for formats libsndfile cannot open.
+	"""
+	try:
+		info = sf.info(path)
+		return AudioInfo(info.duration, info.frames, info.channels, info.samplerate)
+	except (RuntimeError, sf.LibsndfileError):
+		metadata = mediainfo(path)
+		duration = float(metadata["duration"])
+		sample_rate = int(metadata["sample_rate"])
+		channels = int(metadata["channels"])
+		return AudioInfo(duration, round(duration * sample_rate), channels, sample_rate)
+
+
+def set_metadata_index(path):
+	"""
+	Persist the metadata cache in a JSON index at `path`, loading any entries
+	it already holds. Stale entries are ignored when their file's mtime or
+	size no longer match. Pass None to stop persisting.
+
+	New entries are written at most every INDEX_SAVE_INTERVAL seconds,
+	by save_metadata_index(), when switching index and at exit.
+	"""
+	global _index_path, _index_dirty
+	with _cache_lock:
+		if _index_path is not None and _index_path != path:
+			_save_index(_index_path)
+		_index_path = path
+		if path is None:
+			return
+		entries = {}
+		if os.path.exists(path):
+			with open(path, "r") as file:
+				entries = json.load(file)
+		for filename, (mtime, size, info) in entries.items():
+			_cache.setdefault(filename, (mtime, size, AudioInfo(*info)))
+		_index_dirty = len(_cache) > len(entries)
+
+
+def save_metadata_index():
+	"""
+	Write entries probed since the last write to the index set with
+	set_metadata_index(). Also runs at exit.
+	"""
+	with _cache_lock:
+		if _index_path is not None:
+			_save_index(_index_path)
+
+
+def _save_index(path):
+	"""
+	Write the metadata cache to `path` if it changed; the caller must hold
+	_cache_lock. The index is written to a unique temporary file and moved
+	into place, so concurrent writers never mix their output.
+	"""
+	global _index_dirty, _index_saved
+	if not _index_dirty:
+		return
+	entries = {
+		filename: [mtime, size, list(info)]
+		for filename, (mtime, size, info) in _cache.items()
+	}
+	directory, name = os.path.split(os.path.abspath(path))
+	file = tempfile.NamedTemporaryFile("w", dir=directory, prefix=name + ".", suffix=".tmp",
+		delete=False)
+	try:
+		with file:
+			json.dump(entries, file)
+		os.replace(file.name, path)
+	except BaseException:
+		os.remove(file.name)
+		raise
+	_index_dirty = False
+	_index_saved = time.monotonic()
+
+
+def clear_metadata_cache():
+	"""
+	Forget every cached entry (the on-disk index is left as is).
+	"""
+	with _cache_lock:
+		_cache.clear()
+
+
+atexit.register(save_metadata_index)
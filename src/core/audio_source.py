@@ -1,32 +1,43 @@
+import itertools
+import os
+import threading
 import numpy as np
 import soundfile as sf
-import sounddevice as sd
-from pydub.utils import mediainfo
 from src.core.math_expr import *
+from src.core.audio_backend import get_backend
+from src.core.audio_buffer import AudioBuffer
+from src.core.audio_info import get_audio_info
+from src.core.audio_cache import get_decoded_audio_cache
+from src.core.convolution import SpectrumCache, convolve_same
+from src.core.audio_stream import AudioStreamReader
+from src.core.resample import resampled_length
 
 def get_file_duration(filename):
-    metadata = mediainfo(filename)
-    return float(metadata['duration'])
+	return get_audio_info(filename).duration
 
 def play_buffer(buffer, sample_rate=None, time_range=None):
 	"""
-	Plays a numpy buffer using sounddevice, optionally clipped by a TimeRange.
+	Plays a numpy buffer on the current audio backend, optionally clipped by a TimeRange.
 	
 	Args:
-		buffer (np.ndarray): The audio buffer to play. Can be mono or stereo.
+		buffer (np.ndarray or AudioBuffer): The audio buffer to play. Can be mono or stereo.
 		sample_rate (int or None): The sample rate of the audio. If None,
-			defaults to AudioConfig.get_sample_rate().
+			defaults to the AudioBuffer's rate or AudioConfig.get_sample_rate().
 		time_range (TimeRange or None): The range of time to play. If None, plays the full buffer.
 	"""
+	if isinstance(buffer, AudioBuffer):
+		sample_rate = sample_rate or buffer.sample_rate
+		buffer = buffer.data
+
 	# Get the default sample rate if none is provided
 	if sample_rate is None:
 		sample_rate = AudioConfig.get_sample_rate()
 
 	if not isinstance(buffer, np.ndarray):
-		raise TypeError("Buffer must be a numpy array.")
+		raise TypeError("Buffer must be a numpy array or AudioBuffer.")
 
 	# Normalize buffer to fit within [-1, 1] range if necessary
-	max_val = np.max(np.abs(buffer))
+	max_val = np.max(np.abs(buffer), initial=0)
 	if max_val > 1.0:
 		buffer = buffer / max_val
 
@@ -37,8 +48,47 @@ def play_buffer(buffer, sample_rate=None, time_range=None):
 		buffer = buffer[start_idx:end_idx]
 
 	# Play the audio buffer
-	sd.play(buffer, samplerate=sample_rate)
-	sd.wait()  # Wait until the buffer finishes playing
+	get_backend().play(buffer, sample_rate)  # Returns once the buffer finishes playing
+
+
+# Attributes that hold a node's operands; assigning one changes the graph
+_OPERAND_ATTRIBUTES = frozenset(("nodes", "left", "right", "source", "modulator", "value"))
+_graph_versions = itertools.count(1)
+_graph_version = 0
+
+
+def graph_version():
+	"""
+	Counter that changes whenever any node's operands change, so compiled
+	plans only re-check their graph after some graph was edited.
+	"""
+	return _graph_version
+
+
+def _graph_changed():
+	global _graph_version
+	_graph_version = next(_graph_versions)
+
+
+class NodeList(list):
+	"""
+	Operand list that reports in-place edits as graph changes.
+	"""
+
+
+def _reporting_change(method):
+	def mutate(self, *args, **kwargs):
+		result = method(self, *args, **kwargs)
+		_graph_changed()
+		return result
+	mutate.__name__ = method.__name__
+	return mutate
+
+
+for _name in ("append", "extend", "insert", "pop", "remove", "clear", "sort", "reverse",
+		"__setitem__", "__delitem__", "__iadd__", "__imul__"):
+	setattr(NodeList, _name, _reporting_change(getattr(list, _name)))
+del _name
 
 
 class BaseNode:
@@ -47,10 +97,19 @@ class BaseNode:
 		self.finite = finite
 		super().__init__(**kwargs)
 
+	def __setattr__(self, name, value):
+		if name in _OPERAND_ATTRIBUTES:
+			if name == "nodes" and not isinstance(value, NodeList):
+				value = NodeList(value)
+			object.__setattr__(self, name, value)
+			_graph_changed()
+		else:
+			object.__setattr__(self, name, value)
+
 	def eval(self, t):
 		if isinstance(t, TimeRange):
-			return np.array([self.eval(time) for time in t])
-		elif isinstance(t, (int, float, np.float32, np.float64)):
+			return self.eval(t.times())
+		elif isinstance(t, (int, float, np.float32, np.float64, np.ndarray)):
 			raise NotImplementedError("Subclasses must implement eval().")
 		else:
 			raise TypeError("Unsupported type: {type(t)}")
@@ -61,6 +120,51 @@ class BaseNode:
 		"""
 		return self
 
+	def compile(self):
+		"""
+		Return the flat evaluation plan for the tree rooted at this node. The
+		plan is cached on the node, one per thread, and rebuilt when the tree
+		has changed.
+		"""
+		from src.core.node_compiler import EvalPlan
+		plans = self.__dict__.get("_plans") or self.__dict__.setdefault("_plans", threading.local())
+		plan = getattr(plans, "plan", None)
+		if plan is None or not plan.is_current():
+			plan = plans.plan = EvalPlan(self)
+		return plan
+
+	def eval_compiled(self, t, out=None):
+		"""
+		Evaluate the tree through its compiled plan, optionally writing the
+		result into `out`. Gives the same result as eval(t).
+		"""
+		return self.compile()(t, out=out)
+
+	@property
+	def seekable(self):
+		"""
+		True if evaluating a TimeRange gives the same result whatever was
+		evaluated before, so a render can be split into segments. Only this
+		node's own state counts; render.segmentable() checks its operands.
+		"""
+		return True
+
+	def operands(self):
+		"""
+		Operand nodes of a node type that isn't one of the built-in
+		operators. Such nodes also implement eval_operands(t, values), which
+		computes the node from its operands' values at `t`, so compiled plans
+		evaluate each operand once.
+		"""
+		return []
+
+	def set_operands(self, operands):
+		"""
+		Replace the nodes operands() returns, given in the same order.
+		"""
+		if operands:
+			raise NotImplementedError("Subclasses with operands must implement set_operands().")
+
 	def __add__(self, other):
 		return AddNode(self, other)
 
@@ -77,10 +181,27 @@ class BaseNode:
 	def _wrap(value):
 		if isinstance(value, BaseNode):
 			return value
+		elif isinstance(value, MathExpr):
+			return MathExprNode(value)
 		elif isinstance(value, (int, float, np.ndarray)):
 			return ConstantNode(value)
 		raise TypeError(f"Unsupported type for operation: {type(value)}")
 
+	def local_key(self):
+		"""
+		Key for this node's own operation and parameters, excluding its
+		operands. Nodes of unknown kinds are only identical to themselves.
+		"""
+		return ("node", id(self))
+
+	def structural_key(self):
+		"""
+		Key for the whole tree; structurally identical trees have equal keys.
+		"""
+		from src.core.node_compiler import node_children
+		return (self.local_key(), tuple(
+			operand.structural_key() for operand in node_children(self)))
+
 
 class ConstantNode(BaseNode):
 	def __init__(self, value):
@@ -94,6 +215,9 @@ class ConstantNode(BaseNode):
 	def reduce(self):
 		return self  # Already reduced
 
+	def local_key(self):
+		return ("ConstantNode", param_key(self.value))
+
 
 class AddNode(BaseNode):
 	def __init__(self, *nodes):
@@ -127,6 +251,9 @@ class AddNode(BaseNode):
 	def eval(self, t):
 		return sum(node.eval(t) for node in self.nodes)
 
+	def local_key(self):
+		return ("AddNode",)
+
 	def reduce(self):
 		if self.is_constant:
 			return ConstantNode(sum(node.eval(0) for node in self.nodes))  # Use any valid t
@@ -163,11 +290,15 @@ class MulNode(BaseNode):
 			self.value = reduced.value
 
 	def eval(self, t):
+		# Not in place: operands may be read-only views of source data
 		result = self.nodes[0].eval(t)
 		for node in self.nodes[1:]:
-			result *= node.eval(t)
+			result = result * node.eval(t)
 		return result
 
+	def local_key(self):
+		return ("MulNode",)
+
 	def reduce(self):
 		if self.is_constant:
 			product = np.prod([node.eval(0) for node in self.nodes])  # Use any valid t
@@ -178,6 +309,7 @@ class MulNode(BaseNode):
 class ConvNode(BaseNode):
 	def __init__(self, *nodes):
 		super().__init__()
+		self._spectra = SpectrumCache()  # Spectra of constant operands
 		# Flatten nested ConvNodes
 		flat_nodes = []
 		for node in nodes:
@@ -198,18 +330,30 @@ class ConvNode(BaseNode):
 			self.value = reduced.value
 
 	def eval(self, t):
-		result = self.nodes[0].eval(t)
-		for node in self.nodes[1:]:
-			result = np.convolve(result, node.eval(t), mode='same')
+		return self._convolve([node.eval(t) for node in self.nodes])
+
+	def local_key(self):
+		return ("ConvNode",)
+
+	def _convolve(self, arrays):
+		"""
+		Convolve the operands' values left to right, each step trimmed like
+		np.convolve(..., mode='same'). The direct, FFT or overlap-add method
+		is picked per step from the operand lengths, and the spectra of
+		constant operands are kept between calls.
+		"""
+		result = arrays[0]
+		result_constant = self.nodes[0].is_constant
+		for node, array in zip(self.nodes[1:], arrays[1:]):
+			result = convolve_same(result, array,
+				signal_cache=self._spectra if result_constant else None,
+				kernel_cache=self._spectra if node.is_constant else None)
+			result_constant = False  # Intermediate results are new arrays every call
 		return result
 
 	def reduce(self):
 		if self.is_constant:
-			arrays = [node.eval(0) for node in self.nodes]
-			result = arrays[0]
-			for array in arrays[1:]:
-				result = np.convolve(result, array, mode='same')
-			return ConstantNode(result)
+			return ConstantNode(self._convolve([node.eval(0) for node in self.nodes]))
 		return self
 
 
@@ -229,6 +373,9 @@ class ModNode(BaseNode):
 	def eval(self, t):
 		return self.left.eval(t) % self.right.eval(t)
 
+	def local_key(self):
+		return ("ModNode",)
+
 	def reduce(self):
 		if self.is_constant:
 			mod_value = self.left.eval(0) % self.right.eval(0)  # Use any valid t
@@ -236,7 +383,11 @@ class ModNode(BaseNode):
 		return self
 
 class AudioSource(BaseNode):
-	def __init__(self, filename: str, time_range: TimeRange = None, **kwargs):
+	INTERPOLATIONS = (None, "linear", "cubic")
+
+	def __init__(self, filename: str, time_range: TimeRange = None,
+			interpolation=None, streaming=False,
+			block_size=AudioStreamReader.DEFAULT_BLOCK_SIZE, **kwargs):
 		"""
 		Initialize the AudioSource node.
 
@@ -244,31 +395,50 @@ class AudioSource(BaseNode):
 			filename (str): Path to the audio file.
 			time_range (TimeRange): Optional time range to clip the audio.
 									If time_range.start > time_range.end, audio is reversed.
+			interpolation (str or None): How to evaluate times that fall between
+									samples: None (hold the previous sample),
+									"linear" or "cubic".
+			streaming (bool): If True, decode only the clipped window, in blocks
+									of `block_size` frames on a read-ahead thread,
+									instead of loading the whole file up front.
+			block_size (int): Frames per decoded block in streaming mode.
 		"""
+		if interpolation not in self.INTERPOLATIONS:
+			raise ValueError(f"Unsupported interpolation: {interpolation}")
 		self.finite = True
 		self.filename = filename
+		self.interpolation = interpolation
 		self.time_range = self._adjust_time_range(time_range)
 
-		# Load audio file metadata
-		self.data, self.sample_rate = self._load_audio_metadata()
-
-		# Validate sample rate against AudioConfig
+		# Load audio file metadata, resampled to the AudioConfig rate
 		audio_config_rate = AudioConfig.get_sample_rate()
-		if self.sample_rate != audio_config_rate:
-			raise ValueError(
-				f"Sample rate mismatch: file {self.sample_rate}Hz, "
-				f"expected {audio_config_rate}Hz. "
-				f"Resampling not implemented."
-			)
+		if streaming:
+			self.data, self.sample_rate = None, audio_config_rate
+		else:
+			self.data, self.sample_rate = self._load_audio_metadata()
+		self.stream = None
 
 		# Clip audio data to match time_range
-		self.data = self._process_time_range(self.data, self.time_range)
+		if streaming:
+			info = get_audio_info(self.filename)
+			start_sample, end_sample = self._time_range_samples(
+				resampled_length(info.frames, info.sample_rate, audio_config_rate),
+				self.time_range)
+			self.stream = AudioStreamReader(self.filename, start_sample,
+				end_sample, block_size=block_size, dtype="float32",
+				sample_rate=audio_config_rate)
+		else:
+			self.data = self._process_time_range(self.data, self.time_range)
 
 		# Check if this node is constant (it never is, as it depends on external input)
 		self.finite = True
 		super().__init__(is_constant=False, finite=True, **kwargs)
 	def _adjust_time_range(self, time_range: TimeRange):
-		time_range = time_range or TimeRange(0, float('inf'))
+		# Clamp a copy; the caller's TimeRange may be shared with other nodes
+		if time_range is None:
+			time_range = TimeRange(0, float('inf'))
+		else:
+			time_range = TimeRange(time_range.start, time_range.end, time_range.step)
 		true_end = get_file_duration(self.filename)
 		if time_range.end == float('inf') or time_range.end > true_end:
 			time_range.end = true_end
@@ -278,12 +448,15 @@ class AudioSource(BaseNode):
 
 	def _load_audio_metadata(self):
 		"""
-		Load audio data and metadata from the file.
+		Load audio data and metadata from the file, resampled to the
+		AudioConfig rate. The data is shared with every other source reading
+		the same file through the decoded-audio cache, so it is read-only.
 
 		Returns:
 			Tuple[np.ndarray, int]: Audio data and its sample rate.
 		"""
-		data, sample_rate = sf.read(self.filename, always_2d=True)  # Ensure multi-channel
+		data, sample_rate = get_decoded_audio_cache().get(self.filename,
+			sample_rate=AudioConfig.get_sample_rate())  # Always multi-channel
 		return data, sample_rate
 
 	def _process_time_range(self, data, time_range: TimeRange):
@@ -297,8 +470,19 @@ class AudioSource(BaseNode):
 		Returns:
 			np.ndarray: Processed audio data.
 		"""
-		sample_rate = AudioConfig.get_sample_rate()
 		num_samples = data.shape[0] if data is not None else 0
+		start_sample, end_sample = self._time_range_samples(num_samples, time_range)
+		if start_sample == 0 and end_sample == len(data):
+			return data
+		return data[start_sample:end_sample]
+
+	@staticmethod
+	def _time_range_samples(num_samples, time_range: TimeRange):
+		"""
+		Convert a time range into [start, end) sample indices clamped to
+		`num_samples` samples.
+		"""
+		sample_rate = AudioConfig.get_sample_rate()
 		end_time = num_samples/sample_rate if num_samples > 0 else 0
 		start, end = time_range.start, time_range.end
 		def clamp_positive_time(value):
@@ -308,51 +492,141 @@ class AudioSource(BaseNode):
 		start_sample = int(clamp_positive_time(start)*sample_rate)
 		end_sample = int(clamp_positive_time(end)*sample_rate)
 		assert(start_sample != float("inf") and end_sample != float("inf"))
-		if start_sample == 0 and end_sample == len(data):
-			return data
-		return data[start_sample:end_sample]
+		return start_sample, end_sample
+
+	@property
+	def num_frames(self):
+		return len(self.data) if self.stream is None else self.stream.num_frames
+
+	@property
+	def channels(self):
+		return self.data.shape[1] if self.stream is None else self.stream.channels
+
+	@property
+	def buffer(self):
+		"""
+		The clipped audio as an AudioBuffer view, offset by the clip's first
+		frame in the file. None when streaming.
+		"""
+		if self.stream is not None:
+			return None
+		return AudioBuffer(self.data, self.sample_rate, offset=int(self.time_range.start * self.sample_rate))
+
+	def duration(self):
+		return self.num_frames / self.sample_rate
+
+	@property
+	def seekable(self):
+		# The streaming reader's decoding thread doesn't survive a fork
+		return self.stream is None
+
+	def local_key(self):
+		return ("AudioSource", os.path.abspath(self.filename), self.time_range.start,
+			self.time_range.end, self.sample_rate, self.interpolation, self.stream is not None)
+
+	def close(self):
+		"""
+		Stop decoding ahead if this source is streaming.
+		"""
+		if self.stream is not None:
+			self.stream.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
 
 	def eval(self, t):
 		if isinstance(t, TimeRange):
-			t = self._adjust_time_range(t)
-			return np.array([self.eval(time) for time in t])
+			return self._eval_range(t)
+		elif isinstance(t, np.ndarray):
+			return self._eval_positions(t*self.sample_rate)
 		elif isinstance(t, (int, float, np.float32, np.float64)):
-			sample_idx = int(t*self.sample_rate)
-			return self.data[min(sample_idx, len(self.data)-1)]
+			return self._eval_positions(np.array([t*self.sample_rate]))[0]
 		else:
 			return super().eval(t)
 
+	def _eval_range(self, time_range: TimeRange):
+		"""
+		Evaluate a TimeRange clipped to the loaded audio. When the range lies
+		on this source's sample grid the result is a read-only view of the
+		data; otherwise the samples are gathered (and interpolated).
+		"""
+		end = min(time_range.end, self.duration())
+		time_range = TimeRange(time_range.start, end, time_range.step)
+		num_samples = len(time_range)
+		start = time_range.start * self.sample_rate
+		stride = time_range.step * self.sample_rate
+		first = round(start)
+		if (abs(stride - 1) < 1e-9 and abs(start - first) < 1e-6
+				and first + num_samples <= self.num_frames):
+			if self.stream is not None:
+				return self.stream.read(first, num_samples)
+			view = self.data[first:first + num_samples]
+			view.flags.writeable = False
+			return view
+		return self._eval_positions(start + np.arange(num_samples) * stride)
+
+	def _eval_positions(self, positions):
+		"""
+		Gather the samples at fractional sample positions, clamped to the
+		loaded audio, using this source's interpolation mode.
+		"""
+		last = self.num_frames - 1
+		# Positions within rounding error of a sample index land on that sample
+		index = np.floor(positions + 1e-6)
+		index = index.astype(np.int64)
+		data, offset = self._window(np.clip(index, 0, last))
+		frac = np.clip(positions - index, 0, 1)[:, np.newaxis].astype(data.dtype)
+		def sample(shift):
+			return data[np.clip(index + shift, 0, last) - offset]
+		if self.interpolation is None:
+			return sample(0)
+		x1 = sample(0)
+		x2 = sample(1)
+		if self.interpolation == "linear":
+			return x1 + frac * (x2 - x1)
+		# Catmull-Rom cubic through the four surrounding samples
+		x0 = sample(-1)
+		x3 = sample(2)
+		return x1 + 0.5 * frac * (x2 - x0 + frac * (2*x0 - 5*x1 + 4*x2 - x3
+			+ frac * (3*(x1 - x2) + x3 - x0)))
+
+	def _window(self, index):
+		"""
+		Return the data covering sample indices `index` plus the neighbours
+		used for interpolation, and the sample index of its first row.
+		"""
+		if self.stream is None:
+			return self.data, 0
+		if len(index) == 0:
+			return np.zeros((1, self.channels), dtype=self.stream.dtype), 0
+		first = max(0, int(index.min()) - 1)
+		end = min(self.num_frames, int(index.max()) + 3)
+		return self.stream.read(first, end - first), first
+
 
 
 class MathExprNode(BaseNode):
 	def __init__(self, func, args=(), params=(), dtype=np.float32):
-		self.func = func
-		self.args = args
-		self.params = list(params)
-		self.dtype = np.result_type(dtype, *(arg.dtype
-				if isinstance(arg, AudioSource) else arg for arg in args),
-			*(param for param in params))
+		"""
+		Wrap a MathExpr (or a func with args and params to build one) as a
+		node. Block results are a single (frames, 1) channel, which numpy
+		broadcasts against multi-channel sources.
+		"""
+		self.expr = func if isinstance(func, MathExpr) else MathExpr(func, args, params)
+		self.dtype = np.dtype(dtype)
 		super().__init__(is_constant=False, finite=False)
 	def __call__(self, t):
-		evaluated_args = [
-			arg(t) if isinstance(arg, MathExpr) else arg for arg in self.args
-		]
-		return self.func(t, *evaluated_args, *self.params)
+		return self.expr(t)
+	def eval(self, t):
+		if isinstance(t, (TimeRange, np.ndarray)):
+			return self.expr(t).astype(self.dtype, copy=False)[:, np.newaxis]
+		return self.expr(t)
 	def render(self, time_range: TimeRange):
-		sample_rate = AudioConfig.get_sample_rate()
-		duration = int(time_range.duration()*sample_rate)
-		t = np.linspace(time_range.start, time_range.end, duration)
-		return self(t).astype(self.dtype)
-	def __add__(self, other):
-		return AddNode(self, self._wrap(other))
-	def __mul__(self, other):
-		return MulNode(self, self._wrap(other))
+		return self(time_range.times()).astype(self.dtype)
 	def conv(self, other):
-		return ConvolveNode(self, self._wrap(other))
-	@staticmethod
-	def _wrap(value):
-		if isinstance(value, AudioSource):
-			return value
-		return ConstantSource(value)
-
-
+		return ConvNode(self, self._wrap(other))
+	def local_key(self):
+		return ("MathExprNode", self.dtype.str, self.expr.structural_key())
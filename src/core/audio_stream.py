@@ -0,0 +1,201 @@
+from collections import deque
+from math import ceil
+import threading
+import numpy as np
+import soundfile as sf
+from src.core.resample import StreamingResampler, resampled_length
+
+class _FileDecoder:
+	"""
+	Decodes output frames straight from the file.
+	"""
+	def __init__(self, file, dtype):
+		self.file = file
+		self.dtype = dtype
+
+	def read(self, position, frames):
+		self.file.seek(position)
+		return self.file.read(frames, dtype=self.dtype.name, always_2d=True)
+
+
+class _ResamplingDecoder:
+	"""
+	Decodes the file through a StreamingResampler, so positions and frame
+	counts are at the resampled rate. Sequential reads carry the resampler
+	state; any other read restarts it a few filter lengths early so the
+	first returned frames are already exact.
+	"""
+	def __init__(self, file, dtype, target_rate, source_block_size):
+		self.file = file
+		self.dtype = dtype
+		self.resampler = StreamingResampler(file.samplerate, target_rate)
+		self.source_block_size = source_block_size
+		self._position = None  # Output frame the next read continues from
+
+	def _restart(self, position):
+		up, down = self.resampler.up, self.resampler.down
+		preroll = ceil((self.resampler.taps_per_phase - 1) / down) + 1
+		unit = max(0, position // up - preroll)
+		self.resampler.reset()
+		self.file.seek(unit * down)
+		# Resampler output m is output frame unit * up + m - latency
+		self._skip = position - unit * up + self.resampler.latency
+		self._pending = np.zeros((0, self.file.channels), dtype=self.dtype)
+		self._exhausted = False
+		self._position = position
+
+	def read(self, position, frames):
+		if position != self._position:
+			self._restart(position)
+		while len(self._pending) < frames and not self._exhausted:
+			block = self.file.read(self.source_block_size, dtype=self.dtype.name, always_2d=True)
+			if len(block) == 0:
+				output = self.resampler.flush(self.file.channels)
+				self._exhausted = True
+			else:
+				output = self.resampler.process(block)
+			skipped = min(self._skip, len(output))
+			self._skip -= skipped
+			self._pending = np.concatenate((self._pending, output[skipped:]))
+		result, self._pending = self._pending[:frames], self._pending[frames:]
+		self._position += len(result)
+		return result
+
+
+class AudioStreamReader:
+	DEFAULT_BLOCK_SIZE = 65536
+
+	def __init__(self, filename, start_frame=0, end_frame=None,
+			block_size=DEFAULT_BLOCK_SIZE, prefetch=2, dtype="float64",
+			sample_rate=None):
+		"""
+		Decode a window of an audio file in fixed-size blocks on a read-ahead
+		thread, keeping at most `prefetch` blocks buffered at and ahead of the
+		playhead.
+
+		Args:
+			filename (str): Path to the audio file.
+			start_frame (int): First frame of the file in the window.
+			end_frame (int or None): End of the window (exclusive); defaults
+				to the end of the file.
+			block_size (int): Frames decoded per block.
+			prefetch (int): Maximum number of blocks held in memory.
+			dtype (str): Sample type of the decoded blocks.
+			sample_rate (int or None): Rate to resample the file to while
+				decoding. Frame numbers are at this rate when it is given.
+		"""
+		info = sf.info(filename)
+		self.filename = filename
+		self.sample_rate = sample_rate or info.samplerate
+		self.channels = info.channels
+		self.dtype = np.dtype(dtype)
+		self.block_size = block_size
+		self.prefetch = max(1, prefetch)
+		total_frames = resampled_length(info.frames, info.samplerate, self.sample_rate)
+		self.start_frame = max(0, min(start_frame, total_frames))
+		end_frame = total_frames if end_frame is None else min(end_frame, total_frames)
+		self.num_frames = max(0, end_frame - self.start_frame)
+
+		# Shared with the read-ahead thread, guarded by _cond
+		self._blocks = deque()  # (first frame, data), in window-relative frames
+		self._next_frame = 0  # Next frame the thread will decode
+		self._generation = 0  # Bumped on every seek to discard stale reads
+		self._error = None
+		self._running = True
+		self._cond = threading.Condition()
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+
+	def _run(self):
+		try:
+			with sf.SoundFile(self.filename) as f:
+				if f.samplerate == self.sample_rate:
+					decoder = _FileDecoder(f, self.dtype)
+				else:
+					decoder = _ResamplingDecoder(f, self.dtype, self.sample_rate, self.block_size)
+				while True:
+					with self._cond:
+						while self._running and (len(self._blocks) >= self.prefetch
+								or self._next_frame >= self.num_frames):
+							self._cond.wait()
+						if not self._running:
+							return
+						position, generation = self._next_frame, self._generation
+					frames = min(self.block_size, self.num_frames - position)
+					data = decoder.read(self.start_frame + position, frames)
+					with self._cond:
+						if generation == self._generation:
+							if len(data) == 0:
+								# The file ended before its header said it would
+								self.num_frames = position
+							else:
+								self._blocks.append((position, data))
+								self._next_frame = position + len(data)
+						self._cond.notify_all()
+		except Exception as e:
+			with self._cond:
+				self._error = e
+				self._cond.notify_all()
+
+	def read(self, start, frames):
+		"""
+		Read `frames` frames starting at window-relative frame `start`.
+		Frames past the end of the window are returned as silence.
+
+		Returns:
+			np.ndarray: Array of shape (frames, channels).
+
+		Raises:
+			ValueError: If the reader is closed, or closed while waiting.
+			Exception: Whatever stopped the read-ahead thread, e.g. a decoding
+				error.
+		"""
+		out = np.zeros((frames, self.channels), dtype=self.dtype)
+		position, filled = start, 0
+		with self._cond:
+			while filled < frames and position < self.num_frames:
+				if self._error is not None:
+					raise self._error
+				if not self._running:
+					raise ValueError(f"Read from a closed AudioStreamReader: {self.filename}")
+				# Blocks entirely behind the playhead are no longer needed
+				while self._blocks and self._blocks[0][0] + len(self._blocks[0][1]) <= position:
+					self._blocks.popleft()
+					self._cond.notify_all()
+				if self._blocks and self._blocks[0][0] <= position:
+					first, data = self._blocks[0]
+					count = min(frames - filled, first + len(data) - position)
+					out[filled:filled + count] = data[position - first:position - first + count]
+					filled += count
+					position += count
+					continue
+				ahead = position - self._next_frame
+				if self._blocks or not 0 <= ahead < self.prefetch * self.block_size:
+					self._seek(position)
+				self._cond.wait()
+		return out
+
+	def _seek(self, position):
+		"""
+		Restart decoding at `position`; the caller must hold _cond.
+		"""
+		self._generation += 1
+		self._blocks.clear()
+		self._next_frame = position
+		self._cond.notify_all()
+
+	def close(self):
+		"""
+		Stop the read-ahead thread and release buffered blocks.
+		"""
+		with self._cond:
+			self._running = False
+			self._blocks.clear()
+			self._cond.notify_all()
+		self._thread.join()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
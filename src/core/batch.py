@@ -0,0 +1,339 @@
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+import json
+import os
+import sys
+import time
+import numpy as np
+import soundfile as sf
+from src.core.equalizer import (Equalizer, design_low_pass, design_high_pass, design_band_pass,
+	design_low_shelf, design_high_shelf, design_peaking)
+from src.core.dynamics import Compressor, Limiter
+from src.core.render import FLOAT_SUBTYPES
+
+BatchResult = namedtuple("BatchResult", ["source", "target", "status", "frames", "sample_rate",
+	"bytes", "key", "elapsed", "error"])
+
+MANIFEST = ".pymuse-batch.json"  # Content keys of the outputs in a directory tree
+EXTENSIONS = (".wav", ".flac", ".ogg", ".aif", ".aiff")
+FORMATS = {"aif": "AIFF"}  # Extensions that differ from soundfile's format name
+HASH_BLOCK = 1 << 20
+
+# Stage name -> (EQ design function or None, required arguments, optional argument)
+STAGES = {
+	"gain": (None, 1, None),
+	"low_pass": (design_low_pass, 1, "order"),
+	"high_pass": (design_high_pass, 1, "order"),
+	"band_pass": (design_band_pass, 2, "order"),
+	"low_shelf": (design_low_shelf, 2, "slope"),
+	"high_shelf": (design_high_shelf, 2, "slope"),
+	"peak": (design_peaking, 2, "q"),
+	"compress": (None, 2, "release"),
+	"limit": (None, 1, "release"),
+	"normalize": (None, 1, None),
+}
+
+
+def parse_chain(spec):
+	"""
+	Parse a processing chain: comma-separated stages, each a name and its
+	colon-separated arguments, e.g. "high_pass:40,peak:3000:-2:1.4,normalize:-1".
+	A spec ending in .json is read from that file instead, as a list of
+	[name, arguments...] lists.
+
+	Stages:
+		gain:DB, low_pass:HZ[:ORDER], high_pass:HZ[:ORDER],
+		band_pass:LOW:HIGH[:ORDER], low_shelf:HZ:DB[:SLOPE],
+		high_shelf:HZ:DB[:SLOPE], peak:HZ:DB[:Q],
+		compress:THRESHOLD_DB:RATIO[:RELEASE_MS], limit:CEILING_DB[:RELEASE_MS],
+		and normalize:DBFS, which scales the output to that peak level and
+		must come last.
+
+	Returns:
+		list: (name, arguments) tuples.
+	"""
+	if spec.endswith(".json"):
+		with open(spec) as file:
+			items = [(item[0], *item[1:]) for item in json.load(file)]
+	else:
+		items = [tuple(part.split(":")) for part in spec.split(",") if part.strip()]
+	stages = []
+	for name, *arguments in items:
+		name = name.strip()
+		if name not in STAGES:
+			raise ValueError(f"Unknown stage: {name}")
+		_, required, optional = STAGES[name]
+		if not required <= len(arguments) <= required + (optional is not None):
+			raise ValueError(f"Wrong number of arguments for stage {name}: {len(arguments)}")
+		values = [float(value) for value in arguments]
+		if optional == "order" and len(values) > required:
+			values[-1] = int(values[-1])
+		stages.append((name, tuple(values)))
+	if any(name == "normalize" for name, _ in stages[:-1]):
+		raise ValueError("normalize must be the last stage")
+	return stages
+
+
+def build_chain(stages, sample_rate):
+	"""
+	Build the block processors for `stages` at `sample_rate`. Consecutive
+	filters share one Equalizer, so they run in a single sosfilt() call.
+
+	Returns:
+		tuple: A list of callables taking a (frames, channels) block and
+		returning the processed block, and the chain's latency in frames.
+	"""
+	chain = []
+	bands = []
+	latency = 0
+	for name, arguments in stages:
+		design, required, optional = STAGES[name]
+		options = {optional: arguments[required]} if len(arguments) > required else {}
+		if design is not None:
+			bands.append(design(*arguments[:required], sample_rate=sample_rate, **options))
+			continue
+		if bands:
+			chain.append(Equalizer(*bands).process)
+			bands = []
+		if name == "gain":
+			scale = np.float32(10 ** (arguments[0] / 20))
+			chain.append(lambda block, scale=scale: np.multiply(block, scale, out=block))
+		elif name in ("compress", "limit"):
+			if "release" in options:
+				options["release"] /= 1000
+			if name == "compress":
+				processor = Compressor(*arguments[:required], sample_rate=sample_rate, **options)
+			else:
+				processor = Limiter(*arguments[:required], sample_rate=sample_rate, **options)
+			chain.append(processor.process)
+			latency += processor.lookahead
+	if bands:
+		chain.append(Equalizer(*bands).process)
+	return chain, latency
+
+
+def content_key(path, stages, format, subtype):
+	"""
+	Hash of the input file's content and everything that determines the
+	output, so an output is up to date when its recorded key matches.
+	"""
+	digest = hashlib.sha256()
+	digest.update(json.dumps([stages, format, subtype]).encode())
+	with open(path, "rb") as file:
+		for chunk in iter(lambda: file.read(HASH_BLOCK), b""):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+
+def _run_chain(source, stages, sample_rate, block_size, sink):
+	chain, latency = build_chain(stages, sample_rate)
+	blocks = sf.blocks(source, blocksize=block_size, dtype="float32", always_2d=True)
+	frames = 0
+	skip = latency  # Output frames that precede the delayed input
+	channels = None
+	for block in blocks:
+		channels = block.shape[1]
+		for stage in chain:
+			block = stage(block)
+		sink(block[skip:])
+		frames += max(0, len(block) - skip)
+		skip = max(0, skip - len(block))
+	if latency and channels:
+		# Flush what is still delayed inside the chain
+		block = np.zeros((latency, channels), dtype=np.float32)
+		for stage in chain:
+			block = stage(block)
+		sink(block[skip:])
+		frames += max(0, len(block) - skip)
+	return frames
+
+
+def process_file(source, target, stages, format=None, subtype=None, block_size=65536,
+		previous_key=None, force=False):
+	"""
+	Apply `stages` to one audio file, streaming it in blocks of
+	`block_size` frames. A normalize stage needs the processed peak first,
+	so such chains are run twice.
+
+	Args:
+		source (str): Input file.
+		target (str): Output file, replaced if it exists.
+		stages (list): Chain from parse_chain().
+		format (str or None): Output format; defaults to the target's extension.
+		subtype (str or None): Output subtype; defaults to the format's default.
+		block_size (int): Frames per block.
+		previous_key (str or None): Content key the target was made with; an
+			existing target with a matching key is skipped.
+		force (bool): Process even if the target is up to date.
+
+	Returns:
+		BatchResult: What was done; status is "processed", "skipped" or
+		"failed".
+	"""
+	began = time.perf_counter()
+	key = None
+	partial = target + ".partial"
+	try:
+		key = content_key(source, stages, format, subtype)
+		info = sf.info(source)
+		if not force and key == previous_key and os.path.exists(target):
+			return BatchResult(source, target, "skipped", info.frames, info.samplerate,
+				0, key, time.perf_counter() - began, None)
+
+		scale = None
+		if stages and stages[-1][0] == "normalize":
+			peak = 0.0
+			def measure(block):
+				nonlocal peak
+				peak = max(peak, float(np.max(np.abs(block), initial=0)))
+			_run_chain(source, stages[:-1], info.samplerate, block_size, measure)
+			if peak > 0:
+				scale = np.float32(10 ** (stages[-1][1][0] / 20) / peak)
+
+		os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+		with sf.SoundFile(partial, "w", samplerate=info.samplerate, channels=info.channels,
+				subtype=subtype, format=format or file_format(os.path.splitext(target)[1][1:])) as output:
+			clip = output.subtype not in FLOAT_SUBTYPES
+			def write(block):
+				if scale is not None:
+					np.multiply(block, scale, out=block)
+				if clip:
+					np.clip(block, -1, 1, out=block)
+				output.write(block)
+			frames = _run_chain(source, stages, info.samplerate, block_size, write)
+		os.replace(partial, target)
+		return BatchResult(source, target, "processed", frames, info.samplerate,
+			os.path.getsize(source), key, time.perf_counter() - began, None)
+	except Exception as e:
+		if os.path.exists(partial):
+			os.remove(partial)
+		return BatchResult(source, target, "failed", 0, 0, 0, key, time.perf_counter() - began, str(e))
+
+
+def file_format(extension):
+	"""
+	The soundfile format name for a file extension, e.g. "AIFF" for "aif".
+	"""
+	extension = extension.lower().lstrip(".")
+	return FORMATS.get(extension, extension.upper())
+
+
+def find_inputs(directory, extensions=EXTENSIONS):
+	"""
+	Every audio file under `directory`, as sorted paths relative to it.
+	"""
+	found = []
+	for parent, directories, files in os.walk(directory):
+		directories.sort()
+		for name in files:
+			if name.lower().endswith(extensions):
+				found.append(os.path.relpath(os.path.join(parent, name), directory))
+	return sorted(found)
+
+
+def process_tree(input_dir, output_dir, stages, format="wav", subtype=None, jobs=None,
+		block_size=65536, force=False, report=print):
+	"""
+	Apply `stages` to every audio file under `input_dir` on a process pool,
+	mirroring the tree under `output_dir` with the `format` extension.
+	Outputs whose input and settings are unchanged since the last run, as
+	recorded in the MANIFEST file of `output_dir`, are skipped. Inputs
+	that would share an output, like a.wav and a.flac, all fail.
+
+	Args:
+		report (callable or None): Called with a line of text per file.
+
+	Returns:
+		list: BatchResult of every file.
+	"""
+	manifest_path = os.path.join(output_dir, MANIFEST)
+	try:
+		with open(manifest_path) as file:
+			manifest = json.load(file)
+	except (OSError, ValueError):
+		manifest = {}
+	extension = "." + format.lower()
+	sources = {}  # Output -> inputs mapped to it
+	for relative in find_inputs(input_dir):
+		sources.setdefault(os.path.splitext(relative)[0] + extension, []).append(relative)
+	tasks = []
+	results = []
+	for target, relatives in sources.items():
+		if len(relatives) == 1:
+			tasks.append((relatives[0], (os.path.join(input_dir, relatives[0]),
+				os.path.join(output_dir, target), stages, file_format(format), subtype, block_size,
+				manifest.get(target), force)))
+			continue
+		# Concurrent workers would overwrite each other's output
+		manifest.pop(target, None)
+		for relative in relatives:
+			error = f"Output {target} would also be written from {', '.join(other for other in relatives if other != relative)}"
+			results.append(BatchResult(os.path.join(input_dir, relative), os.path.join(output_dir, target),
+				"failed", 0, 0, 0, None, 0.0, error))
+			if report:
+				report(f"{'failed':>9} {relative}: {error}")
+
+	with ProcessPoolExecutor(jobs) as pool:
+		futures = {pool.submit(process_file, *arguments): relative for relative, arguments in tasks}
+		for future in as_completed(futures):
+			result = future.result()
+			results.append(result)
+			target = os.path.relpath(result.target, output_dir)
+			if result.status == "failed":
+				manifest.pop(target, None)
+			else:
+				manifest[target] = result.key
+			if report:
+				detail = f": {result.error}" if result.error else f" ({result.elapsed:.2f} s)"
+				report(f"{result.status:>9} {futures[future]}{detail}")
+
+	os.makedirs(output_dir, exist_ok=True)
+	with open(manifest_path, "w") as file:
+		json.dump(manifest, file, indent="\t", sort_keys=True)
+	return results
+
+
+def summarize(results, elapsed):
+	"""
+	One-paragraph throughput summary of a batch run.
+	"""
+	processed = [result for result in results if result.status == "processed"]
+	counts = {status: sum(result.status == status for result in results)
+		for status in ("processed", "skipped", "failed")}
+	seconds = sum(result.frames / result.sample_rate for result in processed)
+	megabytes = sum(result.bytes for result in processed) / 1e6
+	speed = seconds / elapsed if elapsed > 0 else float("inf")
+	return (f"{counts['processed']} processed, {counts['skipped']} skipped, {counts['failed']} failed "
+		f"in {elapsed:.2f} s: {seconds:.1f} s of audio ({speed:.1f}x real time), "
+		f"{megabytes / elapsed if elapsed > 0 else 0:.1f} MB/s")
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m src.core.batch",
+		description="Apply a gain/EQ/dynamics chain to every audio file in a directory tree.")
+	parser.add_argument("input_dir")
+	parser.add_argument("output_dir")
+	parser.add_argument("--chain", default="", help=parse_chain.__doc__.split("\n\n")[0].strip())
+	parser.add_argument("--format", default="wav", help="Output format and extension, e.g. wav or flac")
+	parser.add_argument("--subtype", default=None, help="Output subtype, e.g. PCM_16, PCM_24 or FLOAT")
+	parser.add_argument("--jobs", type=int, default=None, help="Worker processes (default: CPU count)")
+	parser.add_argument("--block-size", type=int, default=65536, help="Frames per block")
+	parser.add_argument("--force", action="store_true", help="Reprocess up-to-date outputs")
+	parser.add_argument("--quiet", action="store_true", help="Only print the summary")
+	args = parser.parse_args(argv)
+	try:
+		stages = parse_chain(args.chain)
+	except ValueError as e:
+		parser.error(str(e))
+
+	began = time.perf_counter()
+	results = process_tree(args.input_dir, args.output_dir, stages, args.format, args.subtype,
+		args.jobs, args.block_size, args.force, report=None if args.quiet else print)
+	print(summarize(results, time.perf_counter() - began))
+	return 1 if any(result.status == "failed" for result in results) else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -1,58 +1,241 @@
-from collections import deque
+from collections import namedtuple
 import threading
 import time
-import sounddevice as sd
 import numpy as np
 from queue import Queue
 from threading import Event
+from src.core.math_expr import MathExpr, TimeRange
 
 import threading
 
+ConsumerStats = namedtuple("ConsumerStats", ["lag", "high_water", "dropped", "detached"])
+
+
+class ConsumerDetached(RuntimeError):
+	"""
+	Raised when a consumer detached for falling behind tries to read.
+	"""
+
+
 class MultiBuffer:
-	def __init__(self, num_buffers, buffer_size, num_consumers):
+	BLOCK = "block"  # The producer waits for the consumer, up to its timeout
+	DROP_OLDEST = "drop_oldest"  # The consumer skips its oldest unread chunks
+	DETACH = "detach"  # The consumer is cut off until it calls attach()
+	POLICIES = (BLOCK, DROP_OLDEST, DETACH)
+
+	def __init__(self, num_buffers, buffer_size, num_consumers, channels=1, dtype=np.float32,
+			policy=BLOCK, timeout=None):
+		"""
+		Ring of `num_buffers` chunks of `buffer_size` frames, shared by one
+		producer and `num_consumers` consumers. Samples live in a single
+		preallocated (num_buffers, buffer_size, channels) array: producers
+		render into reserved slots and consumers get read-only views, so no
+		chunk is ever allocated or copied on the way through.
+
+		Read and write positions are plain counters. Each consumer's are
+		guarded by its own lock, so there is no lock shared by everyone, and
+		threads only meet on the condition variable when one has to wait.
+		Each consumer id must be used from a single thread.
+
+		When the ring is full, each consumer that is behind is handled by its
+		backpressure policy (see set_policy()). A chunk a consumer is still
+		holding is never overwritten.
+
+		Args:
+			policy (str): Default policy for every consumer.
+			timeout (float or None): Default BLOCK timeout in seconds.
+		"""
+		self.num_buffers = num_buffers
 		self.buffer_size = buffer_size
 		self.num_consumers = num_consumers
-		self.buffers = deque(maxlen=num_buffers)  # Ring of buffers
-		self.consumer_progress = [0] * num_buffers  # Tracks how many consumers have processed each buffer
-		self.consumer_positions = [0] * num_consumers  # Each consumer's read position
-		self.lock = threading.Lock()  # Protect shared state
-		self.not_empty = threading.Condition(self.lock)  # Notify consumers when data is available
-		self.write_index = 0  # Tracks where to write next
+		self.channels = channels
+		self.data = np.zeros((num_buffers, buffer_size, channels), dtype=dtype)
+		self._views = []  # Read-only view of each slot
+		for slot in self.data:
+			view = slot.view()
+			view.flags.writeable = False
+			self._views.append(view)
+		self._written = 0  # Chunks committed so far
+		self._read = [0] * num_consumers  # Chunks handed to each consumer
+		self._released = [0] * num_consumers  # Chunks each consumer is done with
+		self._locks = [threading.Lock() for _ in range(num_consumers)]
+		self._policies = [None] * num_consumers  # (policy, timeout)
+		self._detached = [False] * num_consumers
+		self._high_water = [0] * num_consumers
+		self._dropped = [0] * num_consumers
+		self._cond = threading.Condition()
+		self._waiting = 0  # Threads blocked in _wait()
+		for consumer_id in range(num_consumers):
+			self.set_policy(consumer_id, policy, timeout)
+
+	def set_policy(self, consumer_id, policy, timeout=None):
+		"""
+		Choose what happens when this consumer falls a whole ring behind:
+		BLOCK makes the producer wait up to `timeout` seconds (forever if
+		None), DROP_OLDEST discards the consumer's oldest unread chunks, and
+		DETACH stops delivering to it until it calls attach(). Give the
+		consumer that must not glitch, e.g. the player, BLOCK.
+
+		If a DROP_OLDEST or DETACH consumer is still holding the chunk whose
+		slot is needed, the producer waits up to `timeout` for it, then
+		detaches it; the chunk it held may then be overwritten. Consumers
+		that do slow work per chunk should copy it and release() first.
+		"""
+		if policy not in self.POLICIES:
+			raise ValueError(f"Unsupported backpressure policy: {policy}")
+		self._policies[consumer_id] = (policy, timeout)
 
-		# Initialize with empty buffers
-		for _ in range(num_buffers):
-			self.buffers.append([None] * buffer_size)
+	def reserve(self, timeout=None):
+		"""
+		Return the writable slot for the next chunk; it becomes visible to
+		consumers on commit().
 
-	def write(self, chunk):
-		with self.lock:
-			# Check if the next write position is available for overwriting
-			if self.consumer_progress[self.write_index] < self.num_consumers:
-				raise RuntimeError("Cannot overwrite; some consumers haven't finished with this buffer.")
+		Args:
+			timeout (float or None): Longest wait for a blocking consumer,
+				capping the consumer's own timeout.
 
-			# Write data to the next buffer
-			self.buffers[self.write_index] = chunk
-			self.consumer_progress[self.write_index] = 0  # Reset progress for this buffer
+		Raises:
+			RuntimeError: If a consumer still held the slot when the timeout
+				expired.
+		"""
+		oldest = self._written - self.num_buffers  # Chunk whose slot is reused
+		for consumer_id in range(self.num_consumers):
+			if self._detached[consumer_id] or self._released[consumer_id] > oldest:
+				continue
+			policy, policy_timeout = self._policies[consumer_id]
+			if policy != self.BLOCK and self._discard(consumer_id, oldest, policy):
+				continue
+			# The producer's own timeout wins if it is shorter
+			capped = timeout is not None and (policy_timeout is None or timeout < policy_timeout)
+			if self._wait(lambda: self._released[consumer_id] > oldest
+					or self._detached[consumer_id], timeout if capped else policy_timeout):
+				continue
+			if policy == self.BLOCK or capped:
+				raise RuntimeError(f"Cannot overwrite; consumer {consumer_id} hasn't finished with this buffer.")
+			self._detach(consumer_id)
+		return self.data[self._written % self.num_buffers]
+
+	def _discard(self, consumer_id, oldest, policy):
+		"""
+		Apply a DROP_OLDEST or DETACH policy to a consumer blocking chunk
+		`oldest`. Returns False if it is still holding that chunk.
+		"""
+		with self._locks[consumer_id]:
+			if self._read[consumer_id] != self._released[consumer_id]:
+				return False
+			if policy == self.DROP_OLDEST:
+				self._dropped[consumer_id] += oldest + 1 - self._read[consumer_id]
+				self._read[consumer_id] = self._released[consumer_id] = oldest + 1
+				return True
+		self._detach(consumer_id)
+		return True
+
+	def _detach(self, consumer_id):
+		with self._locks[consumer_id]:
+			self._dropped[consumer_id] += self._written - self._read[consumer_id]
+			self._detached[consumer_id] = True
+		self._notify()  # Wake the consumer if it is waiting in read()
+
+	def commit(self):
+		"""
+		Publish the slot returned by reserve().
+		"""
+		self._written += 1
+		for consumer_id in range(self.num_consumers):
+			lag = self._written - self._read[consumer_id]
+			if lag > self._high_water[consumer_id] and not self._detached[consumer_id]:
+				self._high_water[consumer_id] = lag
+		self._notify()
+
+	def write(self, chunk, timeout=None):
+		"""
+		Copy `chunk` into the next slots and publish them. Chunks longer
+		than the buffer size fill consecutive slots, the last one padded
+		with silence; mono chunks fill every channel.
+		"""
+		chunk = np.asarray(chunk)
+		for start in range(0, max(len(chunk), 1), self.buffer_size):
+			part = chunk[start:start + self.buffer_size]
+			slot = self.reserve(timeout)
+			slot[:len(part)] = part.reshape(len(part), -1)
+			slot[len(part):] = 0
+			self.commit()
+
+	def read(self, consumer_id, timeout=None):
+		"""
+		Return a read-only view of this consumer's next chunk, waiting for
+		the producer if needed. The previous chunk is released first.
+
+		Returns:
+			np.ndarray or None: (buffer_size, channels) view, or None if
+			`timeout` seconds passed first.
+
+		Raises:
+			ConsumerDetached: If the consumer was detached for falling behind.
+		"""
+		self.release(consumer_id)
+		if self._read[consumer_id] >= self._written and not self._detached[consumer_id]:
+			if not self._wait(lambda: self._read[consumer_id] < self._written
+					or self._detached[consumer_id], timeout):
+				return None
+		with self._locks[consumer_id]:
+			if self._detached[consumer_id]:
+				raise ConsumerDetached(f"Consumer {consumer_id} fell behind and was detached")
+			# The producer may have dropped chunks meanwhile, but only unread ones
+			position = self._read[consumer_id]
+			self._read[consumer_id] = position + 1
+		return self._views[position % self.num_buffers]
+
+	def release(self, consumer_id):
+		"""
+		Let the producer reuse the chunk this consumer read last. Views of it
+		must not be used afterwards.
+		"""
+		with self._locks[consumer_id]:
+			if self._released[consumer_id] == self._read[consumer_id]:
+				return
+			self._released[consumer_id] = self._read[consumer_id]
+		self._notify()
 
-			# Advance write index
-			self.write_index = (self.write_index + 1) % len(self.buffers)
-			self.not_empty.notify_all()  # Notify consumers that data is available
+	def attach(self, consumer_id):
+		"""
+		Reattach a detached consumer; it resumes at the next chunk written.
+		"""
+		with self._locks[consumer_id]:
+			self._read[consumer_id] = self._released[consumer_id] = self._written
+			self._detached[consumer_id] = False
 
-	def read(self, consumer_id):
-		with self.lock:
-			consumer_pos = self.consumer_positions[consumer_id]
-			while self.consumer_progress[consumer_pos] == 0:  # Wait for data to be written
-				self.not_empty.wait()
+	def available(self, consumer_id):
+		"""
+		Number of committed chunks this consumer hasn't read yet.
+		"""
+		return self._written - self._read[consumer_id]
 
-			# Get the chunk for this consumer
-			chunk = self.buffers[consumer_pos]
+	def stats(self, consumer_id):
+		"""
+		Backpressure statistics of a consumer.
 
-			# Mark this consumer as having processed this buffer
-			self.consumer_progress[consumer_pos] += 1
+		Returns:
+			ConsumerStats: Current lag and highest lag seen, both in unread
+			chunks, chunks dropped by its policy and whether it is detached.
+		"""
+		return ConsumerStats(self.available(consumer_id), self._high_water[consumer_id],
+			self._dropped[consumer_id], self._detached[consumer_id])
 
-			# Advance the consumer's position
-			self.consumer_positions[consumer_id] = (consumer_pos + 1) % len(self.buffers)
+	def _wait(self, predicate, timeout=None):
+		with self._cond:
+			self._waiting += 1
+			try:
+				return self._cond.wait_for(predicate, timeout)
+			finally:
+				self._waiting -= 1
 
-			return chunk
+	def _notify(self):
+		# Waiters register before checking their predicate, so skipping the
+		# lock when nobody is registered can't lose a wakeup
+		if self._waiting:
+			with self._cond:
+				self._cond.notify_all()
 
 
 class Consumer(threading.Thread):
@@ -68,12 +251,10 @@ class Consumer(threading.Thread):
 			self.consume()
 
 	def consume(self):
-		item = self.multi_buffer.read(self.buffer_id)
-		if item:
+		item = self.multi_buffer.read(self.consumerId, timeout=0.01)
+		if item is not None:
 			self.process(item)
-			self.multi_buffer.mark_consumed(self.buffer_id, self.consumerId)
-		else:
-			time.sleep(0.01)  # Avoid busy waiting
+			self.multi_buffer.release(self.consumerId)
 
 	def process(self, item):
 		raise NotImplementedError("Subclasses must implement `process`.")
@@ -82,25 +263,34 @@ class Consumer(threading.Thread):
 		self.running = False
 
 class AudioPlayer(Consumer):
-	def __init__(self, consumerId, buffer_id, multi_buffer, wrap_point=None, speed=1.0, scale_factor=1.0):
+	def __init__(self, consumerId, buffer_id, multi_buffer, wrap_point=None, speed=1.0, scale_factor=1.0,
+			sample_rate=44100, block_size=1024, prefetch=4, backend=None):
 		super().__init__(consumerId, buffer_id, multi_buffer)
 		self.wrap_point = wrap_point
 		self.speed = speed
 		self.scale_factor = scale_factor
+		self.sample_rate = sample_rate
+		self.block_size = block_size
+		self.prefetch = prefetch
+		self.backend = backend
+		self.engine = None  # Opened on the first chunk, once its channel count is known
 		self.position = 0.0
 		self.total_played = 0.0
 
 	def process(self, item):
-		audio_chunk = item["data"]
-
-		# Apply scaling
-		scaled_chunk = audio_chunk * self.scale_factor
+		if self.engine is None:
+			from src.core.output_engine import OutputEngine
+			self.engine = OutputEngine(sample_rate=int(self.sample_rate * self.speed),
+				channels=item.shape[1] if item.ndim > 1 else 1, block_size=self.block_size,
+				prefetch=self.prefetch, gain=self.scale_factor, backend=self.backend)
+			self.engine.start()
 
-		# Play audio with sounddevice
-		playback_duration = len(scaled_chunk) / 44100 / self.speed
-		sd.play(scaled_chunk, samplerate=int(44100 * self.speed))
+		# Queue the chunk on the persistent stream; this waits for free
+		# blocks, so the player keeps pace with the device
+		self.engine.write(item)
 
 		# Update position and handle wrapping
+		playback_duration = len(item) / self.sample_rate / self.speed
 		self.position += playback_duration
 		if self.wrap_point and self.position >= self.wrap_point:
 			wrapped_position = self.position - self.wrap_point
@@ -109,17 +299,34 @@ class AudioPlayer(Consumer):
 		else:
 			self.total_played += playback_duration
 
-		# Wait until playback is complete
-		sd.wait()
+	def stop(self, drain=True):
+		"""
+		Stop consuming and close the output stream, after playing what is
+		already queued if `drain`.
+		"""
+		self.running = False
+		if self.is_alive() and self is not threading.current_thread():
+			self.join()
+		if self.engine is not None:
+			if drain:
+				self.engine.end()
+				self.engine.wait()
+			self.engine.stop()
 
 	def set_scale(self, scale_factor):
 		"""Set the scale factor for audio playback."""
 		self.scale_factor = scale_factor
+		if self.engine is not None:
+			self.engine.gain = scale_factor
 
 	def get_total_played(self):
 		"""Get the total duration of audio played, including wraps."""
 		return self.total_played
 
+	def get_stats(self):
+		"""Get the OutputStats of the output stream, or None before playback."""
+		return None if self.engine is None else self.engine.stats()
+
 class ThreadedProducer:
 	def __init__(self, buffer, buffer_id, generator):
 		self.buffer = buffer
@@ -140,45 +347,85 @@ class ThreadedProducer:
 		for chunk in self.generator:
 			if not self.running:
 				break
-			self.buffer.write(self.buffer_id, {"data": chunk, "timestamp": time.time()})
+			self.buffer.write(chunk)
 
 class MathExprProducer:
-	def __init__(self, math_expr, multi_buffer, samplerate=44100):
+	BLOCK_TIMEOUT = 0.5  # Seconds between checks for stop() while blocked
+	def __init__(self, math_expr, multi_buffer, samplerate=44100, effects=()):
 		"""
 		Initialize a producer for MathExpr.
+
+		Args:
+			effects (iterable): Stateful effects, e.g. a PartitionedConvolver,
+				applied in order to each chunk through their process() method.
+				Their block size must divide the buffer size.
 		"""
 		self.math_expr = math_expr
 		self.multi_buffer = multi_buffer
 		self.samplerate = samplerate
+		self.effects = list(effects)
 		self.time_step = 1 / samplerate
-		self.t = 0  # Start time
+		self.sample_index = 0  # Index of the next sample to produce
+		self.blocked = 0  # BLOCK_TIMEOUT waits on a blocking consumer
 		self.running_event = Event()
 		self.thread = None
 
-	def produce(self):
+	@property
+	def t(self):
+		"""
+		Time of the next sample to produce.
+		"""
+		return self.sample_index / self.samplerate
+
+	def render_into(self, out):
+		"""
+		Render the next len(out) samples into `out` and apply the effects.
+		"""
+		time_range = TimeRange.from_samples(self.sample_index, len(out), self.samplerate)
+		if isinstance(self.math_expr, MathExpr):
+			# Render the first channel and copy it to the others
+			self.math_expr.render(time_range, out if out.ndim == 1 else out[:, 0])
+			if out.ndim > 1:
+				out[:, 1:] = out[:, :1]
+		else:
+			# A node, e.g. an Oscillator; mono output takes its first channel
+			result = self.math_expr.eval(time_range)
+			out[...] = result.reshape(len(out), -1)[:, 0] if out.ndim == 1 else result
+		self.sample_index += len(out)
+		for effect in self.effects:
+			out[...] = effect.process(out)
+		return out
+
+	def produce(self, out=None):
 		"""
 		Generator function for producing chunks.
+
+		Args:
+			out (np.ndarray or None): Buffer that every chunk is rendered into
+				and yielded as; consume each chunk before requesting the next.
+				New float32 arrays of the MultiBuffer's buffer size are yielded
+				by default.
 		"""
 		while self.running_event.is_set():
-			# Generate a buffer chunk using MathExpr's __call__
-			chunk = np.array(
-				[self.math_expr(self.t + n * self.time_step) for n in range(self.multi_buffer.buffer_size)],
-				dtype=np.float32,
-			)
-			self.t += self.multi_buffer.buffer_size * self.time_step  # Increment time
-
+			chunk = out if out is not None else np.empty(self.multi_buffer.buffer_size, dtype=np.float32)
 			# Yield the chunk for external processing
-			yield chunk
+			yield self.render_into(chunk)
 
 	def threaded_produce(self):
 		"""
-		Run the producer in a thread, writing to MultiBuffer.
+		Run the producer in a thread, rendering straight into MultiBuffer
+		slots. While a blocking consumer is paused the producer keeps
+		waiting, counting each BLOCK_TIMEOUT that passes in `blocked`.
 		"""
-		for chunk in self.produce():
+		while self.running_event.is_set():
 			try:
-				self.multi_buffer.write(chunk)
-			except RuntimeError as e:
-				print(f"Producer blocked: {e}")
+				# Wake up now and then to notice stop() while a consumer blocks
+				slot = self.multi_buffer.reserve(timeout=self.BLOCK_TIMEOUT)
+			except RuntimeError:
+				self.blocked += 1
+				continue
+			self.render_into(slot)
+			self.multi_buffer.commit()
 
 	def start(self):
 		"""
@@ -0,0 +1,348 @@
+from collections import OrderedDict
+import threading
+import numpy as np
+from scipy import fft
+from src.core.math_expr import TimeRange
+
+DIRECT_MAX_TAPS = 64  # Below this kernel length direct convolution beats the FFT
+OVERLAP_ADD_RATIO = 8  # Overlap-add once the signal is this many times the kernel
+OVERLAP_ADD_FFT_FACTOR = 4  # Overlap-add FFT size relative to the kernel length
+
+
+def choose_method(signal_length, kernel_length):
+	"""
+	Pick the cheapest way to convolve two operands of the given lengths.
+
+	Returns:
+		str: "direct", "fft" or "overlap_add".
+	"""
+	longer, shorter = max(signal_length, kernel_length), min(signal_length, kernel_length)
+	if shorter <= DIRECT_MAX_TAPS:
+		return "direct"
+	if longer >= OVERLAP_ADD_RATIO * shorter:
+		return "overlap_add"
+	return "fft"
+
+
+class SpectrumCache:
+	DEFAULT_MAX_ENTRIES = 16
+
+	def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+		"""
+		Real FFTs of constant operands, keyed by the operand array and the
+		transform size, with least-recently-used eviction. Operands are
+		identified by identity, so cached arrays must not be modified in
+		place.
+		"""
+		self.max_entries = max_entries
+		self._entries = OrderedDict()  # (id(array), size) -> (array, spectrum)
+		self._lock = threading.Lock()
+
+	def get(self, array, size):
+		"""
+		Return the (size // 2 + 1, channels) real FFT of `array` zero-padded
+		to `size` frames, computing it on a miss.
+		"""
+		key = (id(array), size)
+		with self._lock:
+			entry = self._entries.get(key)
+			# The id may have been reused by a different array
+			if entry is not None and entry[0] is array:
+				self._entries.move_to_end(key)
+				return entry[1]
+		spectrum = fft.rfft(_as_frames(array), size, axis=0)
+		spectrum.flags.writeable = False
+		with self._lock:
+			self._entries[key] = (array, spectrum)
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+		return spectrum
+
+	def __len__(self):
+		return len(self._entries)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+
+def _spectrum(operand, frames, size, cache):
+	"""
+	Spectrum of an operand, from the cache if given; `frames` is the
+	operand viewed as (frames, channels).
+	"""
+	return fft.rfft(frames, size, axis=0) if cache is None else cache.get(operand, size)
+
+
+def _as_frames(array):
+	"""
+	View an operand as (frames, channels) with a floating-point dtype.
+	"""
+	array = np.asarray(array)
+	if array.dtype.kind != "f":
+		array = array.astype(np.float64)
+	return array.reshape(len(array), -1)
+
+
+def convolve_full(signal, kernel, method=None, signal_cache=None, kernel_cache=None):
+	"""
+	Full linear convolution of two operands along axis 0.
+
+	Args:
+		signal (np.ndarray): (frames,) or (frames, channels) samples.
+		kernel (np.ndarray): (frames,) or (frames, channels) samples; channel
+			counts broadcast against the signal's.
+		method (str or None): "direct", "fft" or "overlap_add"; chosen from
+			the operand lengths by default.
+		signal_cache, kernel_cache (SpectrumCache or None): Caches to take an
+			operand's spectrum from, for operands that don't change between
+			calls.
+
+	Returns:
+		np.ndarray: len(signal) + len(kernel) - 1 frames, 1-D only if both
+		operands are.
+	"""
+	mono = np.ndim(signal) <= 1 and np.ndim(kernel) <= 1
+	a, b = _as_frames(signal), _as_frames(kernel)
+	if method is None:
+		method = choose_method(len(a), len(b))
+	if method == "overlap_add" and len(a) < len(b):
+		a, b = b, a
+		signal, kernel = kernel, signal
+		signal_cache, kernel_cache = kernel_cache, signal_cache
+
+	if method == "direct":
+		channels = np.broadcast_shapes(a.shape[1:], b.shape[1:])[0]
+		a, b = np.broadcast_to(a, (len(a), channels)), np.broadcast_to(b, (len(b), channels))
+		result = np.stack([np.convolve(a[:, c], b[:, c]) for c in range(channels)], axis=1)
+	elif method == "fft":
+		size = fft.next_fast_len(len(a) + len(b) - 1, real=True)
+		product = _spectrum(signal, a, size, signal_cache) * _spectrum(kernel, b, size, kernel_cache)
+		result = fft.irfft(product, size, axis=0)[:len(a) + len(b) - 1]
+	elif method == "overlap_add":
+		result = _overlap_add(a, b, _spectrum(kernel, b, _overlap_add_size(len(b)), kernel_cache))
+	else:
+		raise ValueError(f"Unknown convolution method: {method}")
+
+	result = result.astype(np.result_type(a, b), copy=False)
+	return result[:, 0] if mono else result
+
+
+def _overlap_add_size(kernel_length):
+	return fft.next_fast_len(OVERLAP_ADD_FFT_FACTOR * kernel_length, real=True)
+
+
+def _overlap_add(signal, kernel, kernel_spectrum):
+	"""
+	Convolve a long signal with a shorter kernel block by block, with one
+	batched FFT over all blocks.
+	"""
+	size = _overlap_add_size(len(kernel))
+	block = size - len(kernel) + 1  # Output of one block spills kernel - 1 frames
+	num_blocks = -(-len(signal) // block)
+	padded = np.zeros((num_blocks * block, signal.shape[1]), dtype=signal.dtype)
+	padded[:len(signal)] = signal
+	blocks = padded.reshape(num_blocks, block, signal.shape[1])
+	spectra = fft.rfft(blocks, size, axis=1) * kernel_spectrum
+	segments = fft.irfft(spectra, size, axis=1)
+
+	# Each segment's tail (kernel - 1 <= block frames) overlaps the next block
+	channels = segments.shape[2]
+	output = np.zeros((num_blocks + 1, block, channels), dtype=segments.dtype)
+	output[:num_blocks] += segments[:, :block]
+	output[1:, :size - block] += segments[:, block:]
+	return output.reshape(-1, channels)[:len(signal) + len(kernel) - 1]
+
+
+def convolve_same(signal, kernel, method=None, signal_cache=None, kernel_cache=None):
+	"""
+	Convolution trimmed like np.convolve(..., mode='same'): the centered
+	max(len(signal), len(kernel)) frames of the full result. Arguments are as
+	for convolve_full(); scalar operands simply scale the other.
+	"""
+	if np.ndim(signal) == 0 or np.ndim(kernel) == 0:
+		return np.multiply(signal, kernel)
+	full = convolve_full(signal, kernel, method, signal_cache, kernel_cache)
+	start = (min(len(signal), len(kernel)) - 1) // 2
+	return full[start:start + max(len(signal), len(kernel))]
+
+
+def partition_layout(ir_length, block_size, head_partitions=4, growth=2, partitions_per_stage=2):
+	"""
+	Non-uniform partitioning of an impulse response: `head_partitions`
+	partitions of `block_size` frames, then stages of `partitions_per_stage`
+	partitions, each stage's partitions `growth` times larger than the last.
+	A stage of size P only starts once at least P - block_size frames of the
+	response precede it, so it never adds latency.
+
+	Returns:
+		List[Tuple[int, int]]: (partition size, partition count) per stage.
+	"""
+	layout = [(block_size, max(1, min(head_partitions, -(-ir_length // block_size))))]
+	covered = layout[0][0] * layout[0][1]
+	size = block_size
+	while covered < ir_length:
+		if (size * growth) - block_size <= covered:
+			size *= growth
+		count = min(partitions_per_stage, -(-(ir_length - covered) // size))
+		layout.append((size, count))
+		covered += size * count
+	return layout
+
+
+class _ConvolutionStage:
+	"""
+	Uniformly partitioned overlap-save convolution of one segment of an
+	impulse response, with a frequency-domain delay line of past input
+	spectra.
+	"""
+	def __init__(self, segment, offset, size, count):
+		self.offset = offset  # First frame of the response this stage covers
+		self.size = size
+		segment = np.pad(segment, ((0, size * count - len(segment)), (0, 0)))
+		# spectra[j] transforms partition j, zero-padded to 2 * size frames
+		self.spectra = fft.rfft(segment.reshape(count, size, -1), 2 * size, axis=1)
+		self.reset()
+
+	def reset(self):
+		self._input = None  # Last 2 * size input frames
+		self._filled = 0  # Frames of the current partition received so far
+		self._delay_line = None  # Input spectra, newest at _head
+		self._head = 0
+
+	def push(self, block):
+		"""
+		Append input frames; once a partition is complete, return the
+		stage's next `size` output frames, else None.
+		"""
+		if self._input is None:
+			channels = np.broadcast_shapes(block.shape[1:], self.spectra.shape[2:])[0]
+			self._input = np.zeros((2 * self.size, channels), dtype=np.float64)
+			self._delay_line = np.zeros((len(self.spectra),) + self.spectra.shape[1:2] + (channels,),
+				dtype=np.complex128)
+		self._input[self.size + self._filled:self.size + self._filled + len(block)] = block
+		self._filled += len(block)
+		if self._filled < self.size:
+			return None
+		self._filled = 0
+		self._head = (self._head - 1) % len(self._delay_line)
+		self._delay_line[self._head] = fft.rfft(self._input, axis=0)
+		self._input[:self.size] = self._input[self.size:]
+		# Partition j pairs with the input spectrum from j partitions ago
+		split = len(self._delay_line) - self._head
+		spectrum = np.einsum("jfc,jfc->fc", self._delay_line[self._head:],
+			np.broadcast_to(self.spectra[:split], (split,) + self._delay_line.shape[1:]))
+		if self._head:
+			spectrum += np.einsum("jfc,jfc->fc", self._delay_line[:self._head],
+				np.broadcast_to(self.spectra[split:], (self._head,) + self._delay_line.shape[1:]))
+		return fft.irfft(spectrum, 2 * self.size, axis=0)[self.size:]
+
+
+class PartitionedConvolver:
+	def __init__(self, impulse_response, block_size=256, partitions=None):
+		"""
+		Stateful block convolution with a long impulse response, for
+		streaming. Each call to process() returns the output for exactly the
+		frames it was given, so the effect adds no delay of its own; played
+		live, input is heard `latency` frames later because a whole block
+		must arrive before it can be processed.
+
+		With uniform partitions (the default) every block costs the same. A
+		non-uniform layout, see partition_layout(), covers long responses
+		with fewer, larger FFTs, at the price of a costlier block each time a
+		large partition completes.
+
+		Args:
+			impulse_response (np.ndarray or AudioSource): (frames,) or
+				(frames, channels) response; a node is read over its whole
+				clipped range.
+			block_size (int): Frames per processed block.
+			partitions (list or None): (partition size, count) stages; every
+				size a multiple of block_size.
+		"""
+		response = _frames_of(impulse_response)
+		self.mono = response.shape[1] == 1 and np.ndim(impulse_response) == 1
+		self.block_size = block_size
+		self.latency = block_size
+		if partitions is None:
+			partitions = [(block_size, max(1, -(-len(response) // block_size)))]
+		self.stages = []
+		offset = 0
+		for size, count in partitions:
+			if size % block_size or offset < size - block_size:
+				raise ValueError(f"Partition of {size} frames cannot start at frame {offset}")
+			segment = response[offset:offset + size * count]
+			if len(segment):
+				self.stages.append(_ConvolutionStage(segment, offset, size, count))
+			offset += size * count
+		# Future output frames, written by stages ahead of the current block
+		self._horizon = max(stage.offset + block_size for stage in self.stages)
+		self.reset()
+
+	def reset(self):
+		"""
+		Forget all input, as if the signal started again from silence.
+		"""
+		for stage in self.stages:
+			stage.reset()
+		self._output = None
+		self._position = 0  # Ring index of the current block's first frame
+
+	def process(self, block):
+		"""
+		Convolve the next block of input.
+
+		Args:
+			block (np.ndarray): (frames,) or (frames, channels) samples,
+				frames a multiple of block_size.
+
+		Returns:
+			np.ndarray: The output for the same frames.
+		"""
+		block = np.asarray(block)
+		if len(block) % self.block_size:
+			raise ValueError(f"Block of {len(block)} frames is not a multiple of {self.block_size}")
+		frames = block.reshape(len(block), -1)
+		results = [self._process_block(frames[start:start + self.block_size])
+			for start in range(0, len(frames), self.block_size)]
+		result = np.concatenate(results) if len(results) != 1 else results[0]
+		result = result.astype(block.dtype if block.dtype.kind == "f" else np.float64, copy=False)
+		return result[:, 0] if block.ndim == 1 and self.mono else result
+
+	def _process_block(self, frames):
+		if self._output is None:
+			channels = np.broadcast_shapes(frames.shape[1:], self.stages[0].spectra.shape[2:])[0]
+			self._output = np.zeros((self._horizon, channels))
+		for stage in self.stages:
+			result = stage.push(frames)
+			if result is not None:
+				# Stage output starts offset frames after its partition began
+				self._accumulate(stage.offset - stage.size + self.block_size, result)
+		return self._take(self.block_size)
+
+	def _accumulate(self, delay, data):
+		"""
+		Add `data` to the output ring, starting `delay` frames after the
+		current block's first frame.
+		"""
+		length = len(self._output)
+		indices = (self._position + delay + np.arange(len(data))) % length
+		self._output[indices] += data
+
+	def _take(self, frames):
+		indices = (self._position + np.arange(frames)) % len(self._output)
+		result = self._output[indices]
+		self._output[indices] = 0
+		self._position = (self._position + frames) % len(self._output)
+		return result
+
+
+def _frames_of(impulse_response):
+	"""
+	Return an impulse response as a (frames, channels) float array; nodes
+	are evaluated over their whole clipped range.
+	"""
+	if hasattr(impulse_response, "num_frames") and hasattr(impulse_response, "eval"):
+		impulse_response = impulse_response.eval(TimeRange.from_samples(
+			0, impulse_response.num_frames, impulse_response.sample_rate))
+	return _as_frames(impulse_response).astype(np.float64, copy=False)
@@ -0,0 +1,77 @@
+from src.core.math_expr import MathExpr, param_key
+from src.core.audio_source import AddNode, BaseNode, ConstantNode, ConvNode, MathExprNode, ModNode, MulNode
+from src.core.node_compiler import node_children
+
+
+def _operands(item):
+	"""
+	Return the sub-expressions and operand nodes of a MathExpr or BaseNode.
+	"""
+	if isinstance(item, MathExpr):
+		return [arg for arg in item.args if isinstance(arg, MathExpr)]
+	if isinstance(item, MathExprNode):
+		return [item.expr]
+	return list(node_children(item))
+
+
+def _replace_operands(item, canonical):
+	"""
+	Point `item` at the canonical instances of its operands.
+	"""
+	if isinstance(item, MathExpr):
+		item.args = tuple(canonical.get(id(arg), arg) for arg in item.args)
+	elif isinstance(item, ConstantNode):
+		return  # Folded nodes may keep operands they no longer use
+	elif isinstance(item, MathExprNode):
+		item.expr = canonical[id(item.expr)]
+	elif isinstance(item, ModNode):
+		item.left, item.right = canonical[id(item.left)], canonical[id(item.right)]
+	elif isinstance(item, (AddNode, MulNode, ConvNode)):
+		item.nodes = [canonical[id(node)] for node in item.nodes]
+	elif isinstance(item, BaseNode) and item.operands():
+		item.set_operands([canonical[id(node)] for node in item.operands()])
+
+
+def _operand_key(item):
+	"""
+	Key for `item`'s operands, once they are canonical instances.
+	"""
+	if isinstance(item, MathExpr):
+		return tuple(
+			("expr", id(arg)) if isinstance(arg, MathExpr) else ("value", param_key(arg))
+			for arg in item.args)
+	return tuple(map(id, _operands(item)))
+
+
+def intern_graph(root, table=None):
+	"""
+	Merge structurally identical sub-expressions of the MathExpr or BaseNode
+	tree rooted at `root`, so each distinct computation exists once and is
+	evaluated once per call. Parents are rewired in place to share the
+	canonical instance.
+
+	Args:
+		root (MathExpr or BaseNode): Tree to intern.
+		table (dict or None): Canonical instances by key. Pass the same dict
+			to several calls to share sub-expressions between trees.
+
+	Returns:
+		MathExpr or BaseNode: The canonical instance of `root`.
+	"""
+	if table is None:
+		table = {}
+	canonical = {}  # id(instance) -> canonical instance
+	stack = [(root, False)]
+	while stack:
+		item, expanded = stack.pop()
+		if id(item) in canonical:
+			continue
+		operands = _operands(item)
+		if not expanded and operands:
+			stack.append((item, True))
+			stack.extend((operand, False) for operand in operands if id(operand) not in canonical)
+			continue
+		_replace_operands(item, canonical)
+		key = (item.local_key(), _operand_key(item))
+		canonical[id(item)] = table.setdefault(key, item)
+	return canonical[id(root)]
@@ -0,0 +1,204 @@
+import numpy as np
+from scipy.signal import lfilter
+from src.core.math_expr import AudioConfig, TimeRange
+from src.core.audio_source import BaseNode
+
+FLOOR_DB = -120.0  # Detector level of silence
+RELEASE_SPAN = 4096  # Frames per release scan, bounding the log-domain offsets
+
+
+def _coefficient(seconds, sample_rate):
+	"""
+	One-pole smoothing coefficient reaching 1 - 1/e of a step in `seconds`.
+	"""
+	return float(np.exp(-1 / (seconds * sample_rate))) if seconds > 0 else 0.0
+
+
+class Compressor:
+	def __init__(self, threshold_db=-20.0, ratio=4.0, knee_db=6.0, attack=0.005, release=0.1,
+			lookahead=0.0, makeup_db=0.0, sample_rate=None):
+		"""
+		Feed-forward compressor for block-by-block processing. The gain
+		computer works on whole blocks at once, and the envelope is a smooth
+		decoupled peak detector on the gain reduction: a release stage that
+		holds peaks and decays exponentially, computed as a running maximum
+		in the log domain, then a one-pole attack filter run by lfilter().
+		Both carry their state between calls to process(), so splitting a
+		signal into blocks doesn't change the result.
+
+		Args:
+			threshold_db (float): Level above which gain is reduced, in dBFS.
+			ratio (float): Input to output level ratio above the knee;
+				float("inf") limits.
+			knee_db (float): Width of the soft knee around the threshold.
+			attack (float): Seconds to react to a rise in level.
+			release (float): Seconds to recover once the level falls.
+			lookahead (float): Seconds the audio is delayed relative to the
+				detector, so gain is already reduced when a peak arrives.
+			makeup_db (float): Gain applied after compression.
+			sample_rate (int or None): Defaults to the AudioConfig rate.
+		"""
+		if ratio < 1:
+			raise ValueError(f"Compression ratio must be at least 1, not {ratio}")
+		self.threshold_db = threshold_db
+		self.ratio = ratio
+		self.knee_db = max(0.0, knee_db)
+		self.makeup_db = makeup_db
+		self.sample_rate = sample_rate or AudioConfig.get_sample_rate()
+		self.attack = _coefficient(attack, self.sample_rate)
+		self.release = _coefficient(release, self.sample_rate)
+		self.lookahead = int(round(lookahead * self.sample_rate))
+		self.reset()
+
+	def reset(self):
+		"""
+		Forget all input, as if the signal started again from silence.
+		"""
+		self._held = 0.0  # Release stage output for the previous frame, in dB
+		self._zi = np.zeros(1)  # Attack filter state
+		self._delay = None  # Last `lookahead` input frames
+
+	def gain_reduction(self, level_db):
+		"""
+		Static gain computer: reduction in dB (>= 0) for detector levels.
+		"""
+		over = np.asarray(level_db, dtype=np.float64) - self.threshold_db
+		slope = 1 - 1 / self.ratio
+		reduction = np.where(over > 0, slope * over, 0.0)
+		if self.knee_db > 0:
+			half = self.knee_db / 2
+			knee = (over > -half) & (over < half)
+			reduction[knee] = slope * (over[knee] + half) ** 2 / (2 * self.knee_db)
+		return reduction
+
+	def _release(self, reduction):
+		"""
+		held[n] = max(reduction[n], release * held[n - 1]), without a loop:
+		dividing out the decay turns it into a running maximum.
+		"""
+		if self.release == 0:
+			self._held = float(reduction[-1]) if len(reduction) else self._held
+			return reduction
+		decay = np.log(self.release)
+		held = np.empty_like(reduction)
+		for start in range(0, len(reduction), RELEASE_SPAN):
+			part = reduction[start:start + RELEASE_SPAN]
+			steps = np.arange(1, len(part) + 1) * decay
+			with np.errstate(divide="ignore"):
+				scaled = np.log(part) - steps
+			running = np.maximum.accumulate(scaled)
+			if self._held > 0:
+				np.maximum(running, np.log(self._held), out=running)
+			np.exp(running + steps, out=held[start:start + len(part)])
+			self._held = float(held[start + len(part) - 1])
+		return held
+
+	def envelope(self, reduction):
+		"""
+		Smoothed gain reduction in dB for the next block of computed
+		reduction, advancing the detector state.
+		"""
+		held = self._release(reduction)
+		smoothed, self._zi = lfilter([1 - self.attack], [1, -self.attack], held, zi=self._zi)
+		return smoothed
+
+	def process(self, block):
+		"""
+		Compress the next block of input. Channels share one detector, so
+		the stereo image doesn't shift.
+
+		Args:
+			block (np.ndarray): (frames,) or (frames, channels) samples.
+
+		Returns:
+			np.ndarray: The compressed samples, in the block's shape,
+			delayed by `lookahead` frames.
+		"""
+		block = np.asarray(block)
+		frames = block.reshape(len(block), -1)
+		if not len(frames):
+			return block.copy()
+		peak = np.max(np.abs(frames), axis=1)
+		with np.errstate(divide="ignore"):
+			level_db = np.maximum(20 * np.log10(peak), FLOOR_DB)
+		reduction = self.envelope(self.gain_reduction(level_db))
+		gain = 10 ** ((self.makeup_db - reduction) / 20)
+		if self.lookahead:
+			if self._delay is None or self._delay.shape[1] != frames.shape[1]:
+				self._delay = np.zeros((self.lookahead, frames.shape[1]), dtype=frames.dtype)
+			delayed = np.concatenate((self._delay, frames))
+			self._delay = delayed[len(frames):].copy()
+			frames = delayed[:len(frames)]
+		dtype = block.dtype if block.dtype.kind == "f" else np.float64
+		result = (frames * gain[:, np.newaxis]).astype(dtype, copy=False)
+		return self._finish(result).reshape(block.shape)
+
+	def _finish(self, result):
+		return result
+
+
+class Limiter(Compressor):
+	def __init__(self, ceiling_db=-1.0, release=0.05, lookahead=0.005, knee_db=0.0, sample_rate=None):
+		"""
+		Compressor with an infinite ratio, an attack that settles within its
+		lookahead and a final clip at the ceiling, so the output never
+		exceeds it even when the envelope hasn't fully caught up.
+
+		Args:
+			ceiling_db (float): Highest output level in dBFS.
+		"""
+		super().__init__(threshold_db=ceiling_db, ratio=float("inf"), knee_db=knee_db,
+			attack=lookahead / 4, release=release, lookahead=lookahead, sample_rate=sample_rate)
+		self.ceiling = 10 ** (ceiling_db / 20)
+
+	def _finish(self, result):
+		return np.clip(result, -self.ceiling, self.ceiling, out=result)
+
+
+class DynamicsNode(BaseNode):
+	def __init__(self, source, processor):
+		"""
+		Node applying a Compressor, Limiter or any other block processor with
+		process() and reset() to another node. Consecutive TimeRanges
+		continue the processor's state; any other range resets it first.
+
+		Args:
+			source (BaseNode or MathExpr): Input node.
+			processor (Compressor): Processor applied to every block.
+		"""
+		self.source = self._wrap(source)
+		self.processor = processor
+		self._next = None  # (start index, step) that continues the state
+		super().__init__(is_constant=False, finite=self.source.finite)
+
+	def operands(self):
+		return [self.source]
+
+	def set_operands(self, operands):
+		self.source, = operands
+
+	def eval(self, t):
+		if not isinstance(t, TimeRange):
+			raise ValueError("A DynamicsNode can only be evaluated over TimeRanges")
+		return self.eval_operands(t, [self.source.eval(t)])
+
+	def eval_operands(self, t, values):
+		if not isinstance(t, TimeRange):
+			raise ValueError("A DynamicsNode can only be evaluated over TimeRanges")
+		index = round(t.start / t.step)
+		if self._next != (index, t.step):
+			self.processor.reset()
+		block = values[0]
+		self._next = (index + len(block), t.step)
+		return self.processor.process(block)
+
+	@property
+	def seekable(self):
+		return False
+
+	def duration(self):
+		from src.core.render import node_duration
+		return node_duration(self.source)
+
+	def local_key(self):
+		return ("DynamicsNode", id(self))
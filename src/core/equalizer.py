@@ -0,0 +1,165 @@
+from functools import lru_cache
+import numpy as np
+from scipy.signal import butter, sosfilt, sosfreqz
+from src.core.math_expr import AudioConfig
+
+DEFAULT_ORDER = 4
+DEFAULT_Q = 1 / np.sqrt(2)  # Butterworth response for a single biquad
+
+
+def _read_only(sos):
+	sos = np.ascontiguousarray(sos, dtype=np.float64)
+	sos.flags.writeable = False
+	return sos
+
+
+def _biquad(b, a):
+	"""
+	One second-order section from RBJ cookbook coefficients.
+	"""
+	return _read_only([[b[0] / a[0], b[1] / a[0], b[2] / a[0], 1.0, a[1] / a[0], a[2] / a[0]]])
+
+
+@lru_cache(maxsize=256)
+def _design_butterworth(btype, frequencies, sample_rate, order):
+	nyquist = 0.5 * sample_rate
+	normal = [frequency / nyquist for frequency in frequencies]
+	return _read_only(butter(order, normal if len(normal) > 1 else normal[0],
+		btype=btype, output="sos"))
+
+
+@lru_cache(maxsize=256)
+def _design_shelf(high, frequency, gain_db, sample_rate, slope):
+	amplitude = 10 ** (gain_db / 40)
+	w0 = 2 * np.pi * frequency / sample_rate
+	cos, sqrt_amplitude = np.cos(w0), np.sqrt(amplitude)
+	alpha = np.sin(w0) / 2 * np.sqrt((amplitude + 1 / amplitude) * (1 / slope - 1) + 2)
+	sign = -1 if high else 1
+	b = (amplitude * ((amplitude + 1) - sign * (amplitude - 1) * cos + 2 * sqrt_amplitude * alpha),
+		sign * 2 * amplitude * ((amplitude - 1) - sign * (amplitude + 1) * cos),
+		amplitude * ((amplitude + 1) - sign * (amplitude - 1) * cos - 2 * sqrt_amplitude * alpha))
+	a = ((amplitude + 1) + sign * (amplitude - 1) * cos + 2 * sqrt_amplitude * alpha,
+		-sign * 2 * ((amplitude - 1) + sign * (amplitude + 1) * cos),
+		(amplitude + 1) + sign * (amplitude - 1) * cos - 2 * sqrt_amplitude * alpha)
+	return _biquad(b, a)
+
+
+@lru_cache(maxsize=256)
+def _design_peaking(frequency, gain_db, sample_rate, q):
+	amplitude = 10 ** (gain_db / 40)
+	w0 = 2 * np.pi * frequency / sample_rate
+	alpha = np.sin(w0) / (2 * q)
+	b = (1 + alpha * amplitude, -2 * np.cos(w0), 1 - alpha * amplitude)
+	a = (1 + alpha / amplitude, -2 * np.cos(w0), 1 - alpha / amplitude)
+	return _biquad(b, a)
+
+
+def design_low_pass(cutoff, sample_rate=None, order=DEFAULT_ORDER):
+	"""
+	Butterworth low-pass filter as read-only second-order sections. Designs
+	are cached, as are those of every design_* function.
+
+	Args:
+		cutoff (float): -3 dB frequency in Hz.
+		sample_rate (int or None): Defaults to the AudioConfig rate.
+		order (int): Filter order.
+	"""
+	sample_rate = sample_rate or AudioConfig.get_sample_rate()
+	return _design_butterworth("lowpass", (float(cutoff),), sample_rate, order)
+
+
+def design_high_pass(cutoff, sample_rate=None, order=DEFAULT_ORDER):
+	"""
+	Butterworth high-pass filter; see design_low_pass().
+	"""
+	sample_rate = sample_rate or AudioConfig.get_sample_rate()
+	return _design_butterworth("highpass", (float(cutoff),), sample_rate, order)
+
+
+def design_band_pass(low, high, sample_rate=None, order=DEFAULT_ORDER // 2):
+	"""
+	Butterworth band-pass filter passing `low` to `high` Hz. Its order is
+	twice `order`.
+	"""
+	sample_rate = sample_rate or AudioConfig.get_sample_rate()
+	return _design_butterworth("bandpass", (float(low), float(high)), sample_rate, order)
+
+
+def design_low_shelf(frequency, gain_db, sample_rate=None, slope=1.0):
+	"""
+	Biquad shelf changing the level below `frequency` by `gain_db`.
+
+	Args:
+		slope (float): Shelf steepness; 1 is the steepest without overshoot.
+	"""
+	sample_rate = sample_rate or AudioConfig.get_sample_rate()
+	return _design_shelf(False, float(frequency), float(gain_db), sample_rate, float(slope))
+
+
+def design_high_shelf(frequency, gain_db, sample_rate=None, slope=1.0):
+	"""
+	Biquad shelf changing the level above `frequency` by `gain_db`; see
+	design_low_shelf().
+	"""
+	sample_rate = sample_rate or AudioConfig.get_sample_rate()
+	return _design_shelf(True, float(frequency), float(gain_db), sample_rate, float(slope))
+
+
+def design_peaking(frequency, gain_db, q=DEFAULT_Q, sample_rate=None):
+	"""
+	Biquad bell changing the level around `frequency` by `gain_db`, with
+	bandwidth set by `q`.
+	"""
+	sample_rate = sample_rate or AudioConfig.get_sample_rate()
+	return _design_peaking(float(frequency), float(gain_db), sample_rate, float(q))
+
+
+class Equalizer:
+	def __init__(self, *bands):
+		"""
+		Cascade of IIR filters for block-by-block processing. The bands'
+		second-order sections are stacked and run in one sosfilt() call per
+		block, across all channels at once. Filter state is carried between
+		calls to process(), so splitting a signal into blocks doesn't change
+		the result.
+
+		Args:
+			*bands (np.ndarray): Second-order sections, e.g. from the
+				design_* functions.
+		"""
+		if not bands:
+			raise ValueError("An Equalizer needs at least one band")
+		self.sos = np.concatenate(bands)  # sosfilt() needs a writable array
+		self.reset()
+
+	def reset(self):
+		"""
+		Forget all input, as if the signal started again from silence.
+		"""
+		self._zi = None  # (sections, 2, channels)
+
+	def process(self, block):
+		"""
+		Filter the next block of input.
+
+		Args:
+			block (np.ndarray): (frames,) or (frames, channels) samples.
+
+		Returns:
+			np.ndarray: The filtered samples, in the block's shape.
+		"""
+		block = np.asarray(block)
+		frames = block.reshape(len(block), -1)
+		if self._zi is None or self._zi.shape[2] != frames.shape[1]:
+			self._zi = np.zeros((len(self.sos), 2, frames.shape[1]))
+		result, self._zi = sosfilt(self.sos, frames, axis=0, zi=self._zi)
+		result = result.astype(block.dtype if block.dtype.kind == "f" else np.float64, copy=False)
+		return result.reshape(block.shape)
+
+	def response(self, frequencies, sample_rate=None):
+		"""
+		Complex frequency response of the cascade at `frequencies` Hz.
+		"""
+		sample_rate = sample_rate or AudioConfig.get_sample_rate()
+		_, response = sosfreqz(self.sos, worN=np.asarray(frequencies, dtype=np.float64), fs=sample_rate)
+		return response
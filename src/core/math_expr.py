@@ -1,3 +1,5 @@
+import hashlib
+import math
 import numpy as np
 from collections.abc import Iterable
 
@@ -12,61 +14,218 @@ class AudioConfig:
 		return AudioConfig._current_sample_rate
 
 class TimeRange(Iterable):
-	def __init__(self, start, end, step=1/AudioConfig.get_sample_rate()):
+	DEFAULT_BLOCK_SIZE = 4096
+
+	def __init__(self, start, end, step=None):
+		"""
+		A half-open range of sample times [start, end) spaced by `step`.
+
+		Time points are computed from integer sample indices as
+		start + index * step, so they never accumulate rounding error
+		however long the range is.
+
+		Args:
+			start (float): First time point, in seconds.
+			end (float): End of the range (exclusive); may be float("inf").
+			step (float or None): Spacing between time points. Defaults to
+				1 / AudioConfig.get_sample_rate().
+		"""
+		if step is None:
+			step = 1 / AudioConfig.get_sample_rate()
 		self.start = max(0, start)
 		self.end = end
 		self.step = max(0, step)
 
+	@classmethod
+	def from_samples(cls, start_index, num_samples, sample_rate=None):
+		"""
+		Build the range covering `num_samples` samples starting at sample
+		`start_index` of a grid with the given sample rate.
+		"""
+		if sample_rate is None:
+			sample_rate = AudioConfig.get_sample_rate()
+		return cls(start_index / sample_rate,
+			(start_index + num_samples) / sample_rate, 1 / sample_rate)
+
 	def duration(self):
 		if self.start != self.end and self.end == float("inf"):
 			return float("inf")
 		return abs(self.end - self.start)
-	def __iter__(self):
+
+	def is_finite(self):
+		return self.end != float("inf")
+
+	def num_samples(self):
+		"""
+		Number of time points in the range, or float("inf") if unbounded.
+		"""
+		if self.step <= 0 or self.end <= self.start:
+			return 0
+		if not self.is_finite():
+			return float("inf")
+		exact = (self.end - self.start) / self.step
+		count = round(exact)
+		# An end lying on the grid (up to division rounding) is excluded
+		if abs(exact - count) <= 1e-9 * max(1.0, exact):
+			return count
+		return math.ceil(exact)
+
+	def __len__(self):
+		count = self.num_samples()
+		if count == float("inf"):
+			raise TypeError("An infinite TimeRange has no length.")
+		return count
+
+	def __bool__(self):
+		# Ranges are always truthy, including empty and infinite ones
+		return True
+
+	def indices(self, start=0, stop=None):
+		"""
+		Return the sample indices [start, stop) of the grid as an int64 array.
 		"""
-		Generate time points within the range [start, end] with the given step size.
-		Handles infinite bounds gracefully.
-		"""
-		t = self.start
-		max_iterations = 1_000_000  # Prevent infinite loops in case of bad input
-		iterations = 0
-
-		#while ((t <= self.end and self.step > 0) or (t >= self.end and self.step < 0)):
-		while (t < self.end and self.step > 0):
-			yield t
-			t += self.step
-			iterations += 1
-
-			# Prevent infinite looping for infinite end
-			#if self.end == float("inf") or self.end == -float("inf"):
-			if iterations >= max_iterations:
-				raise RuntimeError(
-					f"Iteration limit reached for TimeRange: start={self.start}, "
-					f"end={self.end}, step={self.step}. Check for infinite range."
+		if stop is None:
+			stop = self.num_samples()
+			if stop == float("inf"):
+				raise ValueError(
+					"Cannot materialize an infinite TimeRange; use blocks() instead."
 				)
+		return np.arange(start, stop, dtype=np.int64)
+
+	def times(self, start=0, stop=None):
+		"""
+		Return the time points for sample indices [start, stop) as one
+		float64 array. By default the whole (finite) range is materialized.
+		"""
+		return self.start + self.indices(start, stop) * self.step
+
+	def blocks(self, block_size=DEFAULT_BLOCK_SIZE):
+		"""
+		Generate the time points in fixed-size float64 blocks. The last
+		block may be shorter; infinite ranges generate blocks forever.
+		"""
+		total = self.num_samples()
+		index = 0
+		while index < total:
+			stop = min(index + block_size, total)
+			yield self.times(index, stop)
+			index = stop
+
+	def chunks(self, block_size=DEFAULT_BLOCK_SIZE):
+		"""
+		Generate consecutive sub-ranges of at most `block_size` samples
+		each, lying on the same sample grid as this range.
+		"""
+		total = self.num_samples()
+		index = 0
+		while index < total:
+			stop = min(index + block_size, total)
+			yield TimeRange(self[index], self[stop], self.step)
+			index = stop
+
+	def __iter__(self):
+		"""
+		Generate time points within the range [start, end) one at a time.
+		Infinite ranges generate points forever.
+		"""
+		for block in self.blocks():
+			yield from block.tolist()
+
 	def __getitem__(self, num):
 		return self.start + self.step * num
 
+def param_key(value):
+	"""
+	Return a hashable key that identifies a parameter by value, so equal
+	parameters give equal keys. Arrays are keyed by a digest of their bytes;
+	other unhashable values fall back to their identity.
+	"""
+	if isinstance(value, np.ndarray):
+		digest = hashlib.sha1(np.ascontiguousarray(value).tobytes()).hexdigest()
+		return ("ndarray", value.shape, value.dtype.str, digest)
+	if isinstance(value, np.generic):
+		return (value.dtype.str, value.item())
+	try:
+		hash(value)
+		return value
+	except TypeError:
+		return ("id", id(value))
+
+
 class MathExpr:
-	def __init__(self, func, args=(), params=()):
+	def __init__(self, func, args=(), params=(), vectorized=True, name=None):
+		"""
+		Args:
+			func (callable): Called as func(t, *evaluated_args, *params).
+			args (tuple): Sub-expressions (or plain values) evaluated before func.
+			params (iterable): Constant parameters appended after the args.
+			vectorized (bool): True if func accepts a numpy array of times and
+				returns an array of the same length. Set to False for funcs that
+				only handle scalars; they are then evaluated point by point.
+			name (str or None): Stable name of the operation func performs.
+				Expressions with the same name, params and args are treated as
+				identical; unnamed funcs are only identical to themselves.
+		"""
 		self.func = func
 		self.args = args
 		self.params = list(params)
+		self.name = name
+		self.vectorized = vectorized and all(
+			arg.vectorized for arg in args if isinstance(arg, MathExpr))
+
+	def local_key(self):
+		"""
+		Key for this node's own operation and parameters, excluding its args.
+		"""
+		operation = self.name if self.name is not None else ("func", self.func)
+		return ("MathExpr", operation, tuple(map(param_key, self.params)))
+
+	def structural_key(self):
+		"""
+		Key for the whole expression; structurally identical expressions
+		have equal keys.
+		"""
+		return (self.local_key(), tuple(
+			arg.structural_key() if isinstance(arg, MathExpr) else param_key(arg)
+			for arg in self.args))
 
 	def __call__(self, t):
 		"""
 		Evaluate the MathExpr. If `t` is a scalar (float/int), return a scalar.
-		If `t` is an iterable (like TimeRange), return a numpy array.
+		If `t` is a TimeRange or a numpy array of times, return a float32 numpy
+		array evaluated over the whole time vector at once.
 		"""
 		if isinstance(t, (int, float, np.float32, np.float64)):
 			return self._evaluate_single_point(t)
 		elif isinstance(t, TimeRange):
-			return np.array([self._evaluate_single_point(tp) for tp in t], dtype=np.float32)
+			return self._evaluate_block(t.times())
+		elif isinstance(t, np.ndarray):
+			return self._evaluate_block(t)
 		else:
 			raise TypeError(f"Unsupported type: {type(t)}")
 
 	def eval(self, t):
 		return self(t)
 
+	def render(self, time_range, out=None):
+		"""
+		Evaluate the MathExpr over a finite TimeRange in one vectorized call.
+
+		Args:
+			time_range (TimeRange): Sample times to evaluate.
+			out (np.ndarray or None): Array of num_samples() elements to write
+				the float32 result into.
+
+		Returns:
+			np.ndarray: `out` if given, else a new float32 array.
+		"""
+		t = time_range.times()
+		result = self._evaluate_array(t, {})
+		if out is None:
+			return np.broadcast_to(result, t.shape).astype(np.float32)
+		np.copyto(out, np.broadcast_to(result, t.shape), casting="unsafe")
+		return out
+
 	def _evaluate_single_point(self, t):
 		"""
 		Evaluate the MathExpr for a single point in time.
@@ -76,28 +235,55 @@ class MathExpr:
 		]
 		return self.func(t, *evaluated_args, *self.params)
 
+	def _evaluate_block(self, t):
+		"""
+		Evaluate the MathExpr for a whole array of time points and return
+		a float32 array with the same shape as `t`.
+		"""
+		result = self._evaluate_array(np.asarray(t, dtype=np.float64), {})
+		return np.broadcast_to(result, np.shape(t)).astype(np.float32)
+
+	def _evaluate_array(self, t, memo):
+		"""
+		Evaluate the MathExpr tree over a time vector, one call per node.
+		Constant nodes may return scalars; numpy broadcasting handles them.
+		Sub-expressions shared by several parents are evaluated once per
+		call, memoized by identity in `memo`.
+		"""
+		if id(self) in memo:
+			return memo[id(self)]
+		if not self.vectorized:
+			result = np.array([self._evaluate_single_point(tp) for tp in t])
+		else:
+			evaluated_args = [
+				arg._evaluate_array(t, memo) if isinstance(arg, MathExpr) else arg for arg in self.args
+			]
+			result = self.func(t, *evaluated_args, *self.params)
+		memo[id(self)] = result
+		return result
+
 	def __add__(self, other):
 		other = self._wrap(other)  # Ensure compatibility
-		return MathExpr(lambda t, a, b: a + b, args=(self, other))
+		return MathExpr(lambda t, a, b: a + b, args=(self, other), name="add")
 
 	def __sub__(self, other):
 		other = self._wrap(other)  # Ensure compatibility
-		return MathExpr(lambda t, a, b: a - b, args=(self, other))
+		return MathExpr(lambda t, a, b: a - b, args=(self, other), name="sub")
 
 	def __mul__(self, other):
 		other = self._wrap(other)  # Ensure compatibility
-		return MathExpr(lambda t, a, b: a * b, args=(self, other))
+		return MathExpr(lambda t, a, b: a * b, args=(self, other), name="mul")
 
 	def __truediv__(self, other):
 		other = self._wrap(other)  # Ensure compatibility
-		return MathExpr(lambda t, a, b: a / b, args=(self, other))
+		return MathExpr(lambda t, a, b: a / b, args=(self, other), name="truediv")
 
 	def __mod__(self, other):
 		other = self._wrap(other)  # Ensure compatibility
-		return MathExpr(lambda t, a, b: a % b, args=(self, other))
+		return MathExpr(lambda t, a, b: a % b, args=(self, other), name="mod")
 
 	def __neg__(self):
-		return MathExpr(lambda t, a: -a, args=(self,))
+		return MathExpr(lambda t, a: -a, args=(self,), name="neg")
 
 	@staticmethod
 	def _wrap(value):
@@ -112,7 +298,7 @@ class MathExpr:
 
 	@staticmethod
 	def _constant(value):
-		return MathExpr(lambda t, v: v, params=(value,))
+		return MathExpr(lambda t, v: v, params=(value,), name="constant")
 
 
 # Convenience methods
@@ -120,34 +306,43 @@ def constant(value):
 	return MathExpr._constant(value)
 
 
+# Phases are wrapped to one cycle before scaling, so precision doesn't
+# degrade as t grows; see Oscillator for stateful, band-limited versions
 def sine(frequency=440, phase=0):
-	return MathExpr(lambda t, f, p: np.sin(2 * np.pi * f * t + p),
-		params=(frequency, phase))
+	return MathExpr(lambda t, f, p: np.sin(2 * np.pi * ((f * t) % 1) + p),
+		params=(frequency, phase), name="sine")
 
 
 def triangle(frequency=440, phase=0):
 	return MathExpr(lambda t, f, p: 2 * np.abs(2 * ((t * f + p / (2 * np.pi)) % 1) - 1) - 1,
-		params=(frequency, phase))
+		params=(frequency, phase), name="triangle")
 
 
 def square(frequency=440, phase=0):
-	return MathExpr(lambda t, f, p: np.sign(np.sin(2 * np.pi * f * t + p)),
-		params=(frequency, phase))
+	return MathExpr(lambda t, f, p: np.sign(np.sin(2 * np.pi * ((f * t) % 1) + p)),
+		params=(frequency, phase), name="square")
 
 
 def sawtooth(frequency=440, phase=0):
-	return MathExpr(lambda t, f, p: 2 * (t * f + p / (2 * np.pi)) % 1 - 1,
-		params=(frequency, phase))
+	return MathExpr(lambda t, f, p: 2 * ((t * f + p / (2 * np.pi)) % 1) - 1,
+		params=(frequency, phase), name="sawtooth")
 
 def math_expr_producer(buffer, buffer_id, math_expr, duration=1.0,
-		samplerate=44100, chunk_size = 1024):
-	time_step = 1 / samplerate
-	t = 0  # Start time
+		samplerate=44100, chunk_size = 1024, out=None):
+	"""
+	Yield consecutive chunks of `math_expr`, each rendered in one vectorized
+	call. Time comes from an integer sample counter, so it never drifts.
+
+	Args:
+		out (np.ndarray or None): Buffer of chunk_size elements that every
+			chunk is written into and yielded as; consume each chunk before
+			requesting the next. New arrays are yielded by default.
+	"""
+	sample_index = 0
 	while True:
-		# Create a chunk of audio samples
-		chunk = np.array([math_expr(t + n * time_step) for n in range(chunk_size)], dtype=np.float32)
-		t += chunk_size * time_step  # Increment time
-		yield chunk
+		time_range = TimeRange.from_samples(sample_index, chunk_size, samplerate)
+		yield math_expr.render(time_range, out)
+		sample_index += chunk_size
 
 
 #wave = sine(440).scale(0.25) + sine(880).scale(.75)
@@ -0,0 +1,211 @@
+import numpy as np
+from src.core.audio_source import AddNode, MulNode, ModNode, ConvNode, ConstantNode, BaseNode, graph_version
+
+# Element-wise nodes whose operands fold left to right through one ufunc
+_UFUNCS = {AddNode: np.add, MulNode: np.multiply, ModNode: np.mod}
+
+
+def node_children(node):
+	"""
+	Return the operand nodes of `node`, or an empty list for leaves.
+	"""
+	if isinstance(node, ConstantNode):
+		return []
+	if isinstance(node, (AddNode, MulNode, ConvNode)):
+		return node.nodes
+	if isinstance(node, ModNode):
+		return [node.left, node.right]
+	if isinstance(node, BaseNode):
+		return list(node.operands())
+	return []
+
+
+def graph_signature(root):
+	"""
+	Summarize the structure of the tree rooted at `root`: which nodes it
+	holds, their types and how they are connected. Any edit to the tree
+	changes the signature.
+	"""
+	signature = []
+	seen = set()
+	stack = [root]
+	while stack:
+		node = stack.pop()
+		if id(node) in seen:
+			continue
+		seen.add(id(node))
+		children = node_children(node)
+		value = id(node.value) if isinstance(node, ConstantNode) else None
+		signature.append((id(node), type(node), tuple(map(id, children)), value))
+		stack.extend(children)
+	return tuple(signature)
+
+
+class EvalPlan:
+	def __init__(self, root):
+		"""
+		Flatten the tree rooted at `root` into a list of steps in topological
+		order. Each node is evaluated once even if it appears several times.
+
+		Intermediate results live in scratch buffers. A buffer is reused as
+		soon as the last step reading it has run. The first call records
+		which buffer each step writes to; later calls whose leaves produce
+		the same shapes and dtypes replay that assignment. Evaluating
+		same-sized blocks then allocates only the result.
+
+		A plan is not reentrant; BaseNode.compile() keeps one per thread.
+		"""
+		self.root = root
+		self.version = graph_version()
+		self.signature = graph_signature(root)
+		self.steps = []  # (kind, slot, payload, input slots)
+		self._slots = {}  # id(node) -> slot
+		self.root_slot = self._compile(root)
+		self.num_slots = len(self.steps)
+		self._constants = [(slot, payload) for kind, slot, payload, _ in self.steps if kind == "const"]
+		self._leaves = [(slot, payload) for kind, slot, payload, _ in self.steps if kind == "leaf"]
+		self._ops = [step for step in self.steps if step[0] in ("ufunc", "apply", "node")]
+
+		# Free every intermediate right after the last step that reads it
+		last_use = {}
+		for index, (_, _, _, inputs) in enumerate(self._ops):
+			for slot in inputs:
+				last_use[slot] = index
+		self.releases = [[] for _ in self._ops]
+		for slot, index in last_use.items():
+			if slot != self.root_slot:
+				self.releases[index].append(slot)
+
+		# Buffer assignment recorded for the last seen leaf layouts
+		self._layout_key = None
+		self._targets = None
+		self._root_layout = None
+
+	def _compile(self, root):
+		"""
+		Append the steps for `root` and its operands (iteratively, so deep
+		trees don't hit the recursion limit) and return root's slot.
+		"""
+		stack = [(root, False)]
+		while stack:
+			node, expanded = stack.pop()
+			if id(node) in self._slots:
+				continue
+			children = node_children(node)
+			if not expanded and children:
+				stack.append((node, True))
+				stack.extend((child, False) for child in reversed(children))
+				continue
+			inputs = tuple(self._slots[id(child)] for child in children)
+			if len(inputs) == 1 and type(node) in _UFUNCS:
+				# Folding constants can leave a single operand, e.g. x + 0
+				self._slots[id(node)] = inputs[0]
+				continue
+			slot = len(self.steps)
+			if isinstance(node, ConstantNode):
+				self.steps.append(("const", slot, node.value, inputs))
+			elif type(node) in _UFUNCS:
+				self.steps.append(("ufunc", slot, _UFUNCS[type(node)], inputs))
+			elif isinstance(node, ConvNode):
+				self.steps.append(("apply", slot, node._convolve, inputs))
+			elif inputs:
+				self.steps.append(("node", slot, node.eval_operands, inputs))
+			else:
+				self.steps.append(("leaf", slot, node, inputs))
+			self._slots[id(node)] = slot
+		return self._slots[id(root)]
+
+	def is_current(self):
+		"""
+		True if the graph still has the structure the plan was built for.
+		The graph is only walked again after some node's operands changed.
+		"""
+		version = graph_version()
+		if version == self.version:
+			return True
+		if graph_signature(self.root) != self.signature:
+			return False
+		self.version = version
+		return True
+
+	def __call__(self, t, out=None):
+		"""
+		Evaluate the plan at `t` (a scalar, time array or TimeRange).
+
+		Args:
+			out (np.ndarray or None): Array to write the result into.
+
+		Returns:
+			np.ndarray: `out` if given, else the result, which is newly
+			allocated unless the root is itself a leaf or constant.
+		"""
+		values = [None] * self.num_slots
+		for slot, value in self._constants:
+			values[slot] = value
+		for slot, node in self._leaves:
+			values[slot] = node.eval(t)
+		layout_key = tuple(
+			(np.shape(values[slot]), getattr(values[slot], "dtype", type(values[slot])))
+			for slot, _ in self._leaves)
+		if layout_key == self._layout_key:
+			result = self._run_recorded(t, values, out)
+		else:
+			result = self._run_and_record(t, values, out)
+			self._layout_key = layout_key
+		if out is not None and result is not out:
+			np.copyto(out, result)
+			return out
+		return result
+
+	def _run_recorded(self, t, values, out):
+		targets = self._targets
+		for kind, slot, payload, inputs in self._ops:
+			if kind == "apply":
+				values[slot] = payload([values[i] for i in inputs])
+				continue
+			if kind == "node":
+				values[slot] = payload(t, [values[i] for i in inputs])
+				continue
+			if slot == self.root_slot:
+				target = out if out is not None else np.empty(*self._root_layout)
+			else:
+				target = targets[slot]
+			payload(values[inputs[0]], values[inputs[1]], out=target)
+			for i in inputs[2:]:
+				payload(target, values[i], out=target)
+			values[slot] = target
+		return values[self.root_slot]
+
+	def _run_and_record(self, t, values, out):
+		pool = {}  # (shape, dtype) -> free scratch buffers
+		targets = [None] * self.num_slots
+		for index, (kind, slot, payload, inputs) in enumerate(self._ops):
+			operands = [values[i] for i in inputs]
+			if kind == "apply":
+				values[slot] = payload(operands)
+			elif kind == "node":
+				values[slot] = payload(t, operands)
+			else:
+				shape, dtype = self._layout(operands)
+				if slot == self.root_slot:
+					self._root_layout = (shape, dtype)
+					target = out if out is not None else np.empty(shape, dtype=dtype)
+				else:
+					free = pool.get((shape, dtype.str))
+					target = free.pop() if free else np.empty(shape, dtype=dtype)
+					targets[slot] = target
+				payload(operands[0], operands[1], out=target)
+				for operand in operands[2:]:
+					payload(target, operand, out=target)
+				values[slot] = target
+			for released in self.releases[index]:
+				buffer = targets[released]
+				if buffer is not None:
+					pool.setdefault((buffer.shape, buffer.dtype.str), []).append(buffer)
+		self._targets = targets
+		return values[self.root_slot]
+
+	@staticmethod
+	def _layout(operands):
+		shape = np.broadcast_shapes(*(np.shape(operand) for operand in operands))
+		return shape, np.result_type(*operands)
@@ -0,0 +1,213 @@
+import numpy as np
+from src.core.math_expr import AudioConfig, MathExpr, TimeRange
+from src.core.audio_source import BaseNode
+
+
+def poly_blep(phase, increment):
+	"""
+	Polynomial band-limited step residual for a jump of -2 at phase 0, as
+	at the reset of a -1 to 1 sawtooth.
+
+	Args:
+		phase (np.ndarray): Phase in cycles, in [0, 1).
+		increment (np.ndarray): Phase advance per sample, in (0, 0.5).
+	"""
+	increment = np.broadcast_to(increment, phase.shape)
+	result = np.zeros_like(phase)
+	# Only samples within one increment of the jump need a correction
+	after = phase < increment
+	x = phase[after] / increment[after]
+	result[after] = 2 * x - x * x - 1
+	before = phase > 1 - increment
+	x = (phase[before] - 1) / increment[before]
+	result[before] = x * x + 2 * x + 1
+	return result
+
+
+def poly_blamp(phase, increment):
+	"""
+	Polynomial band-limited ramp residual for a change of slope of -2 per
+	sample at phase 0; see poly_blep().
+	"""
+	increment = np.broadcast_to(increment, phase.shape)
+	result = np.zeros_like(phase)
+	after = phase < increment
+	x = phase[after] / increment[after] - 1
+	result[after] = -x ** 3 / 3
+	before = phase > 1 - increment
+	x = (phase[before] - 1) / increment[before] + 1
+	result[before] = x ** 3 / 3
+	return result
+
+
+def _sine(phase, increment, band_limited):
+	return np.sin(2 * np.pi * phase)
+
+
+def _sawtooth(phase, increment, band_limited):
+	result = 2 * phase - 1
+	if band_limited:
+		result -= poly_blep(phase, increment)
+	return result
+
+
+def _square(phase, increment, band_limited):
+	result = np.where(phase < 0.5, 1.0, -1.0)
+	if band_limited:
+		shifted = phase + 0.5
+		shifted -= np.floor(shifted)
+		result += poly_blep(phase, increment) - poly_blep(shifted, increment)
+	return result
+
+
+def _triangle(phase, increment, band_limited):
+	result = 2 * np.abs(2 * phase - 1) - 1
+	if band_limited:
+		shifted = phase + 0.5
+		shifted -= np.floor(shifted)
+		# The slope changes by 8 per cycle, 8 * increment per sample, at each corner
+		result += 4 * increment * (poly_blamp(shifted, increment) - poly_blamp(phase, increment))
+	return result
+
+
+class Oscillator(BaseNode):
+	SHAPES = {"sine": _sine, "triangle": _triangle, "square": _square, "sawtooth": _sawtooth}
+	MAX_INCREMENT = 0.49  # Keeps PolyBLEP regions from overlapping near Nyquist
+
+	def __init__(self, shape="sine", frequency=440.0, phase=0.0, band_limited=True, sample_rate=None):
+		"""
+		Oscillator that keeps a wrapped phase accumulator per voice and
+		renders whole blocks in one vectorized call. Phase is tracked in
+		cycles in [0, 1), so precision doesn't degrade over time, and
+		discontinuous shapes are band-limited with PolyBLEP/PolyBLAMP.
+
+		As a node, evaluating consecutive TimeRanges continues the phase;
+		any other TimeRange seeks to the phase at its start, which is exact
+		for constant frequencies. A modulated oscillator only keeps its phase
+		continuous across a seek, but evaluating the range it last rendered
+		again, as a shared operand does, repeats that block instead of
+		advancing twice.
+
+		Args:
+			shape (str): One of SHAPES.
+			frequency (float, array, BaseNode or MathExpr): Frequency in Hz;
+				a sequence gives one voice per frequency, a node or MathExpr
+				modulates every voice.
+			phase (float): Initial phase in cycles.
+			band_limited (bool): Apply PolyBLEP/PolyBLAMP corrections.
+			sample_rate (int or None): Defaults to the AudioConfig rate.
+		"""
+		if shape not in self.SHAPES:
+			raise ValueError(f"Unsupported oscillator shape: {shape}")
+		self.shape = shape
+		self.band_limited = band_limited
+		self.sample_rate = sample_rate or AudioConfig.get_sample_rate()
+		if isinstance(frequency, (BaseNode, MathExpr)):
+			self.modulator = self._wrap(frequency)
+			frequency = 0.0
+		else:
+			self.modulator = None
+		self.frequency = np.atleast_1d(np.asarray(frequency, dtype=np.float64))
+		self.initial_phase = float(phase) % 1
+		self.reset()
+		super().__init__(is_constant=False, finite=False)
+
+	@property
+	def voices(self):
+		return len(self.frequency)
+
+	def reset(self):
+		"""
+		Return every voice to the initial phase.
+		"""
+		self.phase = np.full(self.voices, self.initial_phase)
+		self._next_index = 0  # Sample index that continues the phase
+		self._step = 1 / self.sample_rate
+		self._last = None  # (start index, step, phase before, result) of the last modulated block
+
+	def render(self, frames, frequency=None, step=None):
+		"""
+		Render the next `frames` samples and advance the phase.
+
+		Args:
+			frames (int): Number of samples.
+			frequency (np.ndarray or None): Instantaneous frequency in Hz,
+				(frames,) or (frames, voices), replacing the base frequency.
+			step (float or None): Seconds per sample; defaults to
+				1 / sample_rate.
+
+		Returns:
+			np.ndarray: (frames, voices) float32 samples.
+		"""
+		if frames == 0:
+			return np.zeros((0, self.voices), dtype=np.float32)
+		step = step or 1 / self.sample_rate
+		if frequency is None:
+			increment = (self.frequency * step)[np.newaxis]
+		else:
+			increment = np.asarray(frequency, dtype=np.float64).reshape(frames, -1) * step
+		# Phase before each sample: the start phase plus all earlier increments
+		total = np.cumsum(np.broadcast_to(increment, (frames, self.voices)), axis=0)
+		phase = np.empty((frames, self.voices))
+		phase[0] = self.phase
+		np.add(self.phase, total[:-1], out=phase[1:])
+		phase -= np.floor(phase)  # Much faster than % 1
+		self.phase = (self.phase + total[-1]) % 1
+		self._next_index += frames
+		magnitude = np.clip(np.abs(increment), 1e-12, self.MAX_INCREMENT)
+		return self.SHAPES[self.shape](phase, magnitude, self.band_limited).astype(np.float32)
+
+	def operands(self):
+		return [] if self.modulator is None else [self.modulator]
+
+	def set_operands(self, operands):
+		if self.modulator is not None:
+			self.modulator, = operands
+
+	def eval(self, t):
+		if isinstance(t, TimeRange):
+			modulation = None if self.modulator is None else self.modulator.eval(t)
+			return self.eval_operands(t, [modulation])
+		if self.modulator is not None:
+			raise ValueError("A modulated Oscillator can only be evaluated over TimeRanges")
+		# Arbitrary times: phase straight from time, without band-limiting
+		phase = (self.initial_phase + np.multiply.outer(np.asarray(t, dtype=np.float64), self.frequency)) % 1
+		result = self.SHAPES[self.shape](phase, np.full_like(phase, 1e-12), False)
+		return result.astype(np.float32) if isinstance(t, np.ndarray) else result
+
+	def eval_operands(self, t, values):
+		"""
+		Evaluate a TimeRange given the modulator's values over it.
+		"""
+		if not isinstance(t, TimeRange):
+			raise ValueError("A modulated Oscillator can only be evaluated over TimeRanges")
+		index = round(t.start / t.step)
+		frames = int(t.num_samples())
+		if self._last is not None and self._last[:2] == (index, t.step):
+			# The same start again: replay the block rather than advance twice
+			_, _, phase, result = self._last
+			if len(result) == frames:
+				return result
+			self.phase, self._next_index = phase.copy(), index
+		elif index != self._next_index or t.step != self._step:
+			self._seek(index, t.step)
+		phase = self.phase.copy()
+		result = self.render(frames, values[0], t.step)
+		result.flags.writeable = False  # Shared by every repeat of the block
+		self._last = (index, t.step, phase, result)
+		return result
+
+	def _seek(self, index, step):
+		if self.modulator is None:
+			self.phase = (self.initial_phase + self.frequency * (index * step)) % 1
+		self._next_index = index
+		self._step = step
+
+	@property
+	def seekable(self):
+		# A modulated phase depends on everything rendered before
+		return self.modulator is None
+
+	def local_key(self):
+		# Each oscillator carries its own phase state
+		return ("Oscillator", id(self))
@@ -0,0 +1,211 @@
+from collections import namedtuple
+import queue
+import threading
+import time
+import numpy as np
+from src.core.audio_backend import CallbackStop, get_backend
+from src.core.buffer import MultiBuffer
+
+OutputStats = namedtuple("OutputStats", ["frames_played", "underruns", "queued_blocks"])
+
+
+class OutputEngine:
+	def __init__(self, source=None, sample_rate=44100, channels=2, block_size=1024,
+			prefetch=4, consumer_id=0, gain=1.0, backend=None):
+		"""
+		Gapless playback through one persistent callback stream. A feeder
+		thread pulls chunks from `source`, or they are pushed with write(),
+		and cuts them into blocks in a prefetch queue of preallocated
+		buffers; the audio callback only copies finished blocks out. When no
+		block is ready the callback plays silence and counts an underrun.
+
+		Args:
+			source (MultiBuffer, iterable or None): Where chunks come from: a
+				MultiBuffer read as `consumer_id`, or any iterable of
+				(frames,) or (frames, channels) arrays. None to push chunks
+				with write().
+			sample_rate (int): Output sample rate.
+			channels (int): Output channels; mono chunks fill all of them.
+			block_size (int): Frames per block and per callback.
+			prefetch (int): Blocks buffered ahead of the callback.
+			consumer_id (int): Consumer id to read a MultiBuffer source as.
+			gain (float): Scale applied to every chunk.
+			backend (AudioBackend or None): Device to play on; defaults to
+				get_backend().
+		"""
+		self.source = source
+		self.sample_rate = sample_rate
+		self.channels = channels
+		self.block_size = block_size
+		self.prefetch = max(1, prefetch)
+		self.consumer_id = consumer_id
+		self.gain = gain
+		self.backend = backend
+		self._blocks = np.zeros((self.prefetch, block_size, channels), dtype=np.float32)
+		self._free = queue.Queue()  # Indices of blocks the feeder may fill
+		self._full = queue.Queue()  # Indices of filled blocks, None once the source ends
+		for index in range(self.prefetch):
+			self._free.put(index)
+		self._fill = None  # (block index, frames filled) of the block being written
+		self._play = None  # (block index, frames played) of the block being played
+		self._frames_played = 0
+		self._underruns = 0
+		self._ended = False  # The end marker was queued
+		self._running = threading.Event()
+		self._finished = threading.Event()
+		self._stream = None
+		self._feeder = None
+
+	def start(self, preroll=True):
+		"""
+		Open the output stream and start playing. With `preroll`, wait until
+		the prefetch queue is full (or the source ended) first, so playback
+		doesn't begin with an underrun.
+		"""
+		if self._stream is not None:
+			return
+		self._running.set()
+		self._finished.clear()
+		if self.source is not None:
+			self._feeder = threading.Thread(target=self._feed, daemon=True)
+			self._feeder.start()
+			if preroll:
+				while self._running.is_set() and not self._ended and self._full.qsize() < self.prefetch:
+					time.sleep(0.001)
+		backend = self.backend or get_backend()
+		self._stream = backend.open_stream(self.sample_rate, self.channels, self.block_size,
+			self._callback, self._finished.set)
+		self._stream.start()
+
+	def _feed(self):
+		"""
+		Feeder thread: copy chunks from the source into the prefetch queue.
+		"""
+		try:
+			if isinstance(self.source, MultiBuffer):
+				while self._running.is_set():
+					chunk = self.source.read(self.consumer_id, timeout=0.1)
+					if chunk is not None:
+						self.write(chunk)
+				self.source.release(self.consumer_id)
+			else:
+				for chunk in self.source:
+					if not self._running.is_set() or not self.write(chunk):
+						return
+				self.end()
+		except Exception as e:
+			print(f"Error while feeding audio: {e}!")
+			self.end()
+
+	def write(self, chunk, timeout=None):
+		"""
+		Queue `chunk` for playback, waiting for free blocks as needed.
+
+		Returns:
+			bool: False if the engine stopped, or `timeout` seconds passed
+			while waiting for a free block, before the chunk was queued.
+		"""
+		chunk = np.asarray(chunk)
+		frames = chunk.reshape(len(chunk), -1)
+		position = 0
+		while position < len(frames):
+			if self._fill is None:
+				try:
+					self._fill = (self._free.get(timeout=0.1 if timeout is None else timeout), 0)
+				except queue.Empty:
+					if timeout is not None or not self._running.is_set():
+						return False
+					continue
+			index, filled = self._fill
+			count = min(len(frames) - position, self.block_size - filled)
+			np.multiply(frames[position:position + count], self.gain,
+				out=self._blocks[index, filled:filled + count], casting="unsafe")
+			position += count
+			self._fill = (index, filled + count)
+			if filled + count == self.block_size:
+				self._full.put(index)
+				self._fill = None
+		return True
+
+	def end(self):
+		"""
+		Mark the end of the input: a partial last block is padded with
+		silence, and the stream stops once everything queued has played.
+		"""
+		if self._ended:
+			return
+		if self._fill is not None:
+			index, filled = self._fill
+			self._blocks[index, filled:] = 0
+			self._full.put(index)
+			self._fill = None
+		self._ended = True
+		self._full.put(None)
+
+	def _callback(self, outdata, frames, time, status):
+		if status.output_underflow:
+			self._underruns += 1
+		written = 0
+		while written < frames:
+			if self._play is None:
+				try:
+					index = self._full.get_nowait()
+				except queue.Empty:
+					outdata[written:] = 0
+					if self._frames_played or written:
+						# Silence before the first block is latency, not an underrun
+						self._underruns += 1
+					break
+				if index is None:
+					outdata[written:] = 0
+					self._frames_played += written
+					raise CallbackStop
+				self._play = (index, 0)
+			index, played = self._play
+			count = min(frames - written, self.block_size - played)
+			outdata[written:written + count] = self._blocks[index, played:played + count]
+			written += count
+			if played + count == self.block_size:
+				self._free.put_nowait(index)
+				self._play = None
+			else:
+				self._play = (index, played + count)
+		self._frames_played += written
+
+	def wait(self, timeout=None):
+		"""
+		Block until the source ended and everything queued has played.
+
+		Returns:
+			bool: False if `timeout` seconds passed first.
+		"""
+		return self._finished.wait(timeout)
+
+	def stop(self):
+		"""
+		Stop playback immediately and close the stream.
+		"""
+		self._running.clear()
+		if self._stream is not None:
+			self._stream.abort()
+			self._stream.close()
+			self._stream = None
+		if self._feeder is not None and self._feeder is not threading.current_thread():
+			self._feeder.join()
+			self._feeder = None
+		self._finished.set()
+
+	def stats(self):
+		"""
+		Returns:
+			OutputStats: Frames played, underruns (callbacks that found no
+			block ready, plus those the device reported) and blocks queued.
+		"""
+		return OutputStats(self._frames_played, self._underruns, self._full.qsize())
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, *exc):
+		self.stop()
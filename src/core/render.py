@@ -0,0 +1,295 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from multiprocessing import get_all_start_methods, get_context, shared_memory
+import os
+import time
+import numpy as np
+import soundfile as sf
+from src.core.math_expr import AudioConfig, MathExpr, TimeRange
+from src.core.audio_source import AddNode, BaseNode, ConvNode, ModNode, MulNode
+from src.core.node_compiler import EvalPlan, node_children
+
+RenderStats = namedtuple("RenderStats", ["frames", "duration", "elapsed", "speed"])
+
+# Subtypes soundfile writes without converting to integers
+FLOAT_SUBTYPES = ("FLOAT", "DOUBLE", "VORBIS", "OPUS", "MPEG_LAYER_III")
+PROGRESS_INTERVAL = 0.25  # Seconds between progress reports
+SEGMENTS_PER_WORKER = 4  # Smaller segments balance uneven load across workers
+
+_segment_root = None  # Graph forked render workers inherit, as lambdas can't be pickled
+
+
+def node_duration(root):
+	"""
+	Duration in seconds of a node graph: the longest of its finite leaves,
+	as constants last as long as anything else. Other nodes with operands,
+	such as processors, report their own duration(). None if a leaf never
+	ends or none has a duration().
+	"""
+	durations = []
+	stack = [root]
+	while stack:
+		node = stack.pop()
+		if getattr(node, "is_constant", False):
+			continue
+		children = node_children(node) if isinstance(node, BaseNode) else []
+		if isinstance(node, (AddNode, MulNode, ModNode, ConvNode)):
+			stack.extend(children)
+		elif callable(getattr(node, "duration", None)) and (children or getattr(node, "finite", False)):
+			duration = node.duration()
+			if duration is None:
+				return None
+			durations.append(duration)
+		else:
+			return None
+	return max(durations) if durations else None
+
+
+def print_progress(frames, total, speed):
+	"""
+	Default render progress: percent done and speed on a single line.
+	"""
+	end = "\n" if frames >= total else ""
+	print(f"\rRendering: {100 * frames / total:5.1f}% ({speed:.1f}x real time)", end=end, flush=True)
+
+
+def _total_frames(root, duration, sample_rate):
+	if duration is None:
+		duration = node_duration(root)
+		if duration is None:
+			raise ValueError("Rendering an infinite graph needs a duration")
+	return round(duration * sample_rate)
+
+
+def render_blocks(root, duration=None, sample_rate=None, block_size=TimeRange.DEFAULT_BLOCK_SIZE,
+		start=0, stop=None):
+	"""
+	Evaluate a node graph or MathExpr block by block.
+
+	Args:
+		root (BaseNode or MathExpr): Graph to render.
+		duration (float or None): Seconds to render; defaults to the
+			duration of a finite graph.
+		sample_rate (int or None): Defaults to the AudioConfig rate.
+		block_size (int): Frames per block.
+		start (int): First frame to render.
+		stop (int or None): Frame to stop at; defaults to the end of
+			`duration`.
+
+	Yields:
+		np.ndarray: (frames, channels) blocks of `block_size` frames but
+		the last. Blocks may be reused buffers; copy them to keep them.
+	"""
+	sample_rate = sample_rate or AudioConfig.get_sample_rate()
+	if stop is None:
+		stop = _total_frames(root, duration, sample_rate)
+	plan = None if isinstance(root, MathExpr) else EvalPlan(root)
+	for first in range(start, stop, block_size):
+		frames = min(block_size, stop - first)
+		time_range = TimeRange.from_samples(first, frames, sample_rate)
+		if plan is None:
+			yield root.render(time_range)[:, np.newaxis]
+			continue
+		block = np.asarray(plan(time_range))
+		block = block.reshape(len(block), -1) if block.ndim else np.full((frames, 1), block)
+		if len(block) < frames:
+			# Finite leaves end early; what follows them is silence
+			block = np.concatenate((block, np.zeros((frames - len(block), block.shape[1]), block.dtype)))
+		yield block
+
+
+def segmentable(root):
+	"""
+	True if every node of the graph is seekable, so rendering it can be
+	split into time segments that are rendered independently.
+	"""
+	stack = [root]
+	while stack:
+		node = stack.pop()
+		if not isinstance(node, BaseNode):
+			continue
+		if not node.seekable:
+			return False
+		stack.extend(node_children(node))
+	return True
+
+
+def _render_segment(task):
+	"""
+	Render worker: render frames [start, stop) of the inherited graph into
+	the shared output array.
+	"""
+	name, shape, start, stop, sample_rate, block_size = task
+	memory = shared_memory.SharedMemory(name=name)
+	try:
+		output = np.ndarray(shape, dtype=np.float32, buffer=memory.buf)
+		position = start
+		for block in render_blocks(_segment_root, sample_rate=sample_rate, block_size=block_size,
+				start=start, stop=stop):
+			np.copyto(output[position:position + len(block)], block, casting="unsafe")
+			position += len(block)
+		del output  # The buffer can't be closed while an array uses it
+	finally:
+		memory.close()
+	return stop - start
+
+
+def render_segments(root, duration=None, sample_rate=None, block_size=TimeRange.DEFAULT_BLOCK_SIZE,
+		workers=None, segment_size=None):
+	"""
+	Render a graph in time segments on a pool of worker processes, each
+	writing straight into one shared-memory output array. Segments start
+	on block boundaries of the same sample grid as render_blocks(), so
+	they join exactly as a single-process render would.
+
+	Graphs that aren't segmentable(), and platforms that can't fork (the
+	workers inherit the graph rather than unpickling it), are rendered in
+	this process instead.
+
+	Args:
+		root (BaseNode or MathExpr): Graph to render.
+		duration (float or None): Seconds to render; defaults to the
+			duration of a finite graph.
+		sample_rate (int or None): Defaults to the AudioConfig rate.
+		block_size (int): Frames per block.
+		workers (int or None): Worker processes; defaults to the CPU count.
+		segment_size (int or None): Frames per segment; defaults to an
+			even split into SEGMENTS_PER_WORKER segments per worker.
+
+	Yields:
+		np.ndarray: Consecutive (frames, channels) float32 segments, in
+		order, each as soon as it and all before it are rendered. They are
+		views of the shared array, valid until the next one is requested.
+	"""
+	global _segment_root
+	sample_rate = sample_rate or AudioConfig.get_sample_rate()
+	total = _total_frames(root, duration, sample_rate)
+	workers = workers or os.cpu_count() or 1
+	if workers < 2 or total <= block_size or not segmentable(root) \
+			or "fork" not in get_all_start_methods():
+		yield from render_blocks(root, sample_rate=sample_rate, block_size=block_size, stop=total)
+		return
+
+	if segment_size is None:
+		segment_size = -(-total // (workers * SEGMENTS_PER_WORKER))
+	segment_size = max(1, -(-segment_size // block_size)) * block_size
+	channels = next(render_blocks(root, sample_rate=sample_rate, block_size=1, stop=1)).shape[1]
+	shape = (total, channels)
+	memory = shared_memory.SharedMemory(create=True, size=max(1, total * channels * 4))
+	pool = None
+	try:
+		_segment_root = root
+		pool = ProcessPoolExecutor(workers, mp_context=get_context("fork"))
+		futures = [(start, pool.submit(_render_segment, (memory.name, shape, start,
+			min(start + segment_size, total), sample_rate, block_size)))
+			for start in range(0, total, segment_size)]
+		output = np.ndarray(shape, dtype=np.float32, buffer=memory.buf)
+		for start, future in futures:
+			yield output[start:start + future.result()]
+		del output
+	finally:
+		_segment_root = None
+		if pool is not None:
+			pool.shutdown(cancel_futures=True)
+		memory.close()
+		memory.unlink()
+
+
+def render_parallel(root, duration=None, sample_rate=None, block_size=TimeRange.DEFAULT_BLOCK_SIZE,
+		workers=None, segment_size=None):
+	"""
+	Render a graph to one (frames, channels) float32 array with
+	render_segments(), which takes the same arguments.
+	"""
+	with closing(render_segments(root, duration, sample_rate, block_size, workers, segment_size)) as segments:
+		parts = [np.array(segment, dtype=np.float32) for segment in segments]
+	if not parts:
+		return np.zeros((0, 1), dtype=np.float32)
+	channels = max(part.shape[1] for part in parts)
+	return np.concatenate([np.broadcast_to(part, (len(part), channels)) for part in parts])
+
+
+def render_to_file(root, path, duration=None, sample_rate=None, channels=None, subtype=None,
+		format=None, block_size=TimeRange.DEFAULT_BLOCK_SIZE, progress=None, workers=None):
+	"""
+	Render a node graph or MathExpr to an audio file block by block, so
+	only one block of output is ever held in memory. With `workers`, the
+	render is split across processes by render_segments() instead, and the
+	output is held in shared memory while the segments are written.
+
+	Args:
+		root (BaseNode or MathExpr): Graph to render.
+		path (str): Output file; the format follows its extension unless
+			`format` is given.
+		duration (float or None): Seconds to render; defaults to the
+			duration of a finite graph.
+		sample_rate (int or None): Defaults to the AudioConfig rate.
+		channels (int or None): Output channels; defaults to the graph's.
+			Mono graphs fill every channel.
+		subtype (str or None): soundfile subtype, e.g. "PCM_16", "PCM_24" or
+			"FLOAT"; None for the format's default. Integer subtypes are
+			clipped to [-1, 1] rather than wrapped.
+		format (str or None): soundfile format, e.g. "WAV" or "FLAC".
+		block_size (int): Frames per block.
+		progress (callable, bool or None): progress(frames, total, speed)
+			every PROGRESS_INTERVAL seconds and at the end, with speed as a
+			multiple of real time; True prints progress with print_progress().
+		workers (int or None): Worker processes; None renders in this
+			process.
+
+	Returns:
+		RenderStats: Frames and seconds rendered, wall-clock seconds and
+		speed as a multiple of real time.
+	"""
+	sample_rate = sample_rate or AudioConfig.get_sample_rate()
+	if progress is True:
+		progress = print_progress
+	total = _total_frames(root, duration, sample_rate)
+	if workers:
+		segments = render_segments(root, sample_rate=sample_rate, block_size=block_size,
+			workers=workers, duration=total / sample_rate)
+	else:
+		segments = render_blocks(root, sample_rate=sample_rate, block_size=block_size, stop=total)
+	began = time.perf_counter()
+	reported = began
+	written = 0
+	output = None
+	out = None
+	try:
+		for segment in segments:
+			if output is None:
+				channels = channels or segment.shape[1]
+				output = sf.SoundFile(path, "w", samplerate=sample_rate, channels=channels,
+					subtype=subtype, format=format)
+				clip = output.subtype not in FLOAT_SUBTYPES
+				out = np.empty((block_size, channels), dtype=np.float32)
+			if segment.shape[1] not in (1, channels):
+				raise ValueError(f"Can't write {segment.shape[1]} channels to a {channels} channel file")
+			for offset in range(0, len(segment), block_size):
+				block = segment[offset:offset + block_size]
+				target = out[:len(block)]
+				np.copyto(target, block, casting="unsafe")
+				if clip:
+					np.clip(target, -1, 1, out=target)
+				output.write(target)
+			written += len(segment)
+			now = time.perf_counter()
+			if progress and (now - reported >= PROGRESS_INTERVAL or written == total):
+				progress(written, total, _speed(written / sample_rate, now - began))
+				reported = now
+		if output is None:
+			# Nothing to render; still leave a valid, empty file
+			output = sf.SoundFile(path, "w", samplerate=sample_rate, channels=channels or 1,
+				subtype=subtype, format=format)
+	finally:
+		segments.close()
+		if output is not None:
+			output.close()
+	elapsed = time.perf_counter() - began
+	seconds = written / sample_rate
+	return RenderStats(written, seconds, elapsed, _speed(seconds, elapsed))
+
+
+def _speed(seconds, elapsed):
+	return seconds / elapsed if elapsed > 0 else float("inf")
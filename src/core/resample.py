@@ -0,0 +1,204 @@
+from functools import lru_cache
+from math import ceil, gcd
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import firwin, resample_poly
+
+DEFAULT_ZERO_CROSSINGS = 16  # Sinc lobes kept on each side of the filter peak
+DEFAULT_ROLLOFF = 0.95  # Cutoff relative to the lower of the two Nyquist rates
+DEFAULT_KAISER_BETA = 8.6
+
+
+def resample_ratio(orig_rate, target_rate):
+	"""
+	Reduce a rate conversion to coprime (up, down) factors.
+	"""
+	divisor = gcd(int(orig_rate), int(target_rate))
+	return int(target_rate) // divisor, int(orig_rate) // divisor
+
+
+def resampled_length(frames, orig_rate, target_rate):
+	"""
+	Number of samples resample() returns for `frames` input samples.
+	"""
+	up, down = resample_ratio(orig_rate, target_rate)
+	return -(-frames * up // down)
+
+
+@lru_cache(maxsize=None)
+def design_resampling_filter(up, down, zero_crossings=DEFAULT_ZERO_CROSSINGS,
+		rolloff=DEFAULT_ROLLOFF, beta=DEFAULT_KAISER_BETA):
+	"""
+	Design the Kaiser-windowed sinc low-pass filter for resampling by
+	up/down. Designs are cached per ratio. The filter's delay, (len - 1) / 2
+	upsampled samples, is a whole multiple of `down`, so it delays the
+	resampled output by a whole number of output samples.
+
+	Returns:
+		np.ndarray: Read-only filter taps with unity DC gain.
+	"""
+	max_rate = max(up, down)
+	delay = ceil(zero_crossings * max_rate / down)  # In output samples
+	taps = firwin(2 * delay * down + 1, rolloff / max_rate, window=("kaiser", beta))
+	taps.flags.writeable = False
+	return taps
+
+
+def resample(data, orig_rate, target_rate, axis=0):
+	"""
+	Resample a whole array from orig_rate to target_rate with a polyphase
+	windowed-sinc filter, compensating for the filter delay.
+
+	Args:
+		data (np.ndarray): Samples, with time along `axis`.
+		orig_rate (int): Sample rate of `data`.
+		target_rate (int): Sample rate to convert to.
+		axis (int): Time axis of `data`.
+
+	Returns:
+		np.ndarray: ceil(len * target_rate / orig_rate) resampled samples.
+	"""
+	up, down = resample_ratio(orig_rate, target_rate)
+	if up == down:
+		return data
+	taps = design_resampling_filter(up, down)
+	return resample_poly(data, up, down, axis=axis, window=taps).astype(data.dtype, copy=False)
+
+
+class StreamingResampler:
+	def __init__(self, orig_rate, target_rate):
+		"""
+		Polyphase resampler for block-by-block processing. Filter history
+		and output phase are carried between calls to process(), so feeding
+		a signal in blocks of any size yields the same samples as feeding
+		it all at once.
+
+		The output is delayed by `latency` output samples relative to
+		resample(); flush() returns the delayed tail.
+		"""
+		self.up, self.down = resample_ratio(orig_rate, target_rate)
+		taps = design_resampling_filter(self.up, self.down) * self.up
+		self.latency = (len(taps) - 1) // (2 * self.down)
+		self.taps_per_phase = ceil(len(taps) / self.up)
+		taps = np.pad(taps, (0, self.taps_per_phase * self.up - len(taps)))
+		# phases[p, k] = taps[k * up + p], reversed along k to match input windows
+		self.phases = taps.reshape(self.taps_per_phase, self.up).T[:, ::-1].copy()
+		self.reset()
+
+	def reset(self):
+		"""
+		Forget all input, as if the signal started again from silence.
+		"""
+		self._history = None  # Last taps_per_phase - 1 input frames
+		self._consumed = 0  # Input frames received so far
+		self._produced = 0  # Output frames produced so far
+
+	def process(self, block):
+		"""
+		Resample the next block of input.
+
+		Args:
+			block (np.ndarray): (frames,) or (frames, channels) input samples.
+
+		Returns:
+			np.ndarray: The output samples that the input so far determines.
+		"""
+		block = np.asarray(block)
+		mono = block.ndim == 1
+		frames = block.reshape(len(block), -1)
+		if self._history is None:
+			self._history = np.zeros((self.taps_per_phase - 1, frames.shape[1]), dtype=frames.dtype)
+		window_input = np.concatenate((self._history, frames))
+		first_input = self._consumed - (self.taps_per_phase - 1)
+		self._consumed += len(frames)
+		self._history = window_input[len(window_input) - (self.taps_per_phase - 1):]
+
+		# Output m reads input floor(m * down / up) and up to taps_per_phase - 1 before it
+		end = -(-self._consumed * self.up // self.down)
+		outputs = np.arange(self._produced, end, dtype=np.int64)
+		self._produced = end
+		position = outputs * self.down
+		index = position // self.up - first_input - (self.taps_per_phase - 1)
+		windows = sliding_window_view(window_input, self.taps_per_phase, axis=0)[index]
+		result = np.einsum("mck,mk->mc", windows, self.phases[position % self.up])
+		result = result.astype(block.dtype if block.dtype.kind == "f" else np.float64, copy=False)
+		return result[:, 0] if mono else result
+
+	def flush(self, channels=None):
+		"""
+		Feed enough silence to push the delayed tail of the signal out.
+		"""
+		if self._history is None:
+			shape = (0,) if channels is None else (0, channels)
+			return np.zeros(shape)
+		silence = np.zeros((ceil((self.latency + 1) * self.down / self.up) + 1,
+			self._history.shape[1]), dtype=self._history.dtype)
+		tail = self.process(silence)
+		return tail[:, 0] if channels is None and tail.shape[1] == 1 else tail
+
+
+class Oversampler:
+	def __init__(self, factor):
+		"""
+		Stateful integer-factor oversampling for block processing: up()
+		raises a block to `factor` times the rate and down() brings a
+		processed block back, both through the cached
+		design_resampling_filter(). Unlike StreamingResampler, only whole
+		multiples of the rate are supported, so every output phase is used
+		in every input frame: each direction is one matrix product of the
+		input windows with the polyphase taps.
+
+		A round trip through up() and down() delays the signal by `latency`
+		frames at the original rate.
+		"""
+		if int(factor) != factor or factor < 1:
+			raise ValueError(f"Oversampling factor must be a positive integer, not {factor}")
+		self.factor = int(factor)
+		taps = design_resampling_filter(self.factor, 1).astype(np.float32)
+		self._order = len(taps) - 1  # A whole multiple of factor
+		self.taps_per_phase = self._order // self.factor + 1
+		padded = np.pad(taps * self.factor, (0, self.taps_per_phase * self.factor - len(taps)))
+		# phases[k, p] = taps[k * factor + p], reversed along k to match input windows
+		self.phases = padded.reshape(self.taps_per_phase, self.factor)[::-1].copy()
+		self.taps = taps[::-1].copy()
+		self.latency = self._order // self.factor
+		self.reset()
+
+	def reset(self):
+		"""
+		Forget all input, as if the signal started again from silence.
+		"""
+		self._up_history = None  # Last taps_per_phase - 1 input frames, channels first
+		self._down_history = None  # Last `order` oversampled frames, channels first
+
+	@staticmethod
+	def _extend(history, frames, length):
+		"""
+		(channels, length + frames) array of the history and the new frames.
+		"""
+		frames = np.asarray(frames, dtype=np.float32).reshape(len(frames), -1)
+		if history is None or len(history) != frames.shape[1]:
+			history = np.zeros((frames.shape[1], length), dtype=np.float32)
+		return np.concatenate((history, frames.T), axis=1)
+
+	def up(self, block):
+		"""
+		Upsample the next (frames, channels) block to factor * frames frames.
+		"""
+		extended = self._extend(self._up_history, block, self.taps_per_phase - 1)
+		self._up_history = extended[:, len(block):]
+		channels = len(extended)
+		windows = sliding_window_view(extended, self.taps_per_phase, axis=1).reshape(-1, self.taps_per_phase)
+		return (windows @ self.phases).reshape(channels, -1).T
+
+	def down(self, block):
+		"""
+		Filter and decimate the next (factor * frames, channels) block.
+		"""
+		if len(block) % self.factor:
+			raise ValueError(f"Oversampled blocks must be a multiple of {self.factor} frames")
+		extended = self._extend(self._down_history, block, self._order)
+		self._down_history = extended[:, len(block):]
+		channels = len(extended)
+		windows = sliding_window_view(extended, len(self.taps), axis=1)[:, ::self.factor]
+		return (windows.reshape(-1, len(self.taps)) @ self.taps).reshape(channels, -1).T
@@ -3,8 +3,12 @@ from scipy.io.wavfile import read, write
 import soundfile as sf
 import numpy as np
 import asyncio
-import sounddevice as sd
 from src.core.custom_types import infer_type
+from src.core.convolution import convolve_full
+from src.core.equalizer import Equalizer, design_low_pass
+from src.core.output_engine import OutputEngine
+from src.core.audio_backend import get_backend
+from src.core.audio_buffer import AudioBuffer
 
 def dtype_info(dtype_str=None, np_dtype=None, max_value=None):
 	intmax16 = 2**15-1
@@ -84,15 +88,25 @@ def scale_dtype(power, s=None, n=None, v=None):
 
 
 def load_audio(filepath, dtype='float32'):
-	data, rate = sf.read(filepath, dtype=dtype)
-	buf = ensure_stereo(data)
-	return rate, buf
+	# Stereo files are returned as read; mono ones are duplicated once
+	buffer = ensure_stereo(AudioBuffer.read(filepath, dtype=dtype))
+	return buffer.sample_rate, buffer.writable()
 
 def save_audio(filepath, rate, data):
 	buf = ensure_stereo(data)
 	sf.write(filepath, buf, samplerate=rate)
 
 def ensure_stereo(buffer):
+	"""
+	Present mono audio as two channels. Arrays come back writable, mono
+	ones as a stacked copy; an AudioBuffer comes back as a read-only
+	broadcast view of its one channel, without copying.
+
+	Args:
+		buffer (np.ndarray or AudioBuffer): Mono or multi-channel samples.
+	"""
+	if isinstance(buffer, AudioBuffer):
+		return buffer.with_channels(2) if buffer.channels == 1 else buffer
 	if len(buffer.shape) == 1:
 		buffer = np.stack((buffer, buffer), axis=-1)
 	return buffer
@@ -103,17 +117,18 @@ def gain(data, db=None):
 	return data * (10 ** (db/20))
 
 def low_pass(data, cutoff=1000, rate=44100, order=5):
-	nyquist = 0.5 * rate
-	normal = cutoff/nyquist
-	b,a = butter(order, cutoff, btype="low", analog=False)
-	return lfilter(b, a, data)
+	return Equalizer(design_low_pass(cutoff, rate, order)).process(data)
 	#fft_data = np.fft.rfft(data)
 	#freqs = np.fft.rfftfreq(len(data), d=1/rate)
 	#fft_data[freqs>cutoff] = 0
 	#return np.fft.irfft(fft_data)
 
 def reverb(data, impulse_response):
-	return np.convolve(data, impulse_response, mode='full')[:len(data)]
+	"""
+	Convolve `data` with an impulse response, keeping len(data) frames.
+	For streaming, use a PartitionedConvolver instead.
+	"""
+	return convolve_full(data, impulse_response)[:len(data)]
 
 async def audio_buffer_manager(bufsize, src, sink):
 	buffer = np.zeros(bufsize)
@@ -126,46 +141,25 @@ async def audio_buffer_manager(bufsize, src, sink):
 def play_audio_from_file(filepath, start=0, stop=-1, dtype='float32'):
 	#rate,data = read(filepath)
 	rate,data = load_audio(filepath, dtype=dtype)
-	data = ensure_stereo(data)
-	data = data.astype(np.float32) / 32768
 	sample0 = int(start*rate)
 	sample1 = int(stop*rate) if stop>0 else len(data)
-	sd.play(data[sample0:sample1], samplerate=rate)
-	sd.wait()
-
-def play_audio_from_stream(g: Generator[np.ndarray, Any, None], rate=44100):
-	for buffer in g:
-		try:
-			def audio_callback(outdata, frames, time, status):
-				if status:
-					print("Stream status:", status)
-				try:
-					chunk = next(g)
-					if len(chunk.shape) == 1:
-						#chunk = np.column_stack((chunk, chunk))
-						#chunk = chunk.reshape(-1,1)
-						chunk = ensure_stereo(chunk)
-					chunk_frames = chunk.shape[0]
-					if chunk_frames < frames:
-						outdata[:chunk_frames] = chunk
-						outdata[chunk_frames:] = 0
-					else:
-						before = chunk[:frames]
-						if len(before.shape) == 1:
-							#before = np.column_stack((before, before))
-							before = ensure_stereo(before)
-						outdata[:] = before
-				except StopIteration:
-					raise sd.CallbackStop
-			with sd.OutputStream(
-				samplerate=rate,
-				#channels=1 if len(first_chunk.shape) == 1 else 2,
-				channels=2,
-				dtype='float32',
-				blocksize=1024,
-				callback=audio_callback,
-			):
-				sd.sleep(1000)
-		except Exception as e:
-			print(f"Error while playing audio: {e}!")
+	# Only the played frames are converted to float
+	buffer = AudioBuffer(data, rate)[sample0:sample1].as_float()
+	get_backend().play(buffer.data, rate)
+
+def play_audio_from_stream(g: Generator[np.ndarray, Any, None], rate=44100, backend=None):
+	"""
+	Play every chunk of `g` gaplessly through one persistent output stream,
+	returning once the last chunk has played.
+	"""
+	engine = OutputEngine(g, sample_rate=rate, channels=2, block_size=1024, backend=backend)
+	try:
+		engine.start()
+		engine.wait()
+		if engine.stats().underruns:
+			print(f"Stream status: {engine.stats().underruns} underruns")
+	except Exception as e:
+		print(f"Error while playing audio: {e}!")
+	finally:
+		engine.stop()
 
@@ -0,0 +1,141 @@
+from functools import lru_cache
+import numpy as np
+from src.core.resample import Oversampler
+from src.core.dynamics import DynamicsNode
+
+DEFAULT_TABLE_SIZE = 4097
+DEFAULT_DOMAIN = 8.0  # Inputs beyond +-domain read the table's end points
+OVERSAMPLING = (1, 2, 4, 8)
+
+
+def _cubic(x):
+	"""
+	Cubic soft clipper, reaching +-1 with zero slope at +-1.
+	"""
+	x = np.clip(x, -1, 1)
+	return 1.5 * x - 0.5 * x ** 3
+
+
+CURVES = {
+	"tanh": np.tanh,
+	"atan": lambda x: 2 / np.pi * np.arctan(x),
+	"cubic": _cubic,
+	"hard": lambda x: np.clip(x, -1, 1),
+}
+
+
+@lru_cache(maxsize=64)
+def transfer_table(curve, size=DEFAULT_TABLE_SIZE, domain=DEFAULT_DOMAIN):
+	"""
+	Sample a transfer curve on `size` evenly spaced points of
+	[-domain, domain]. Tables are cached per curve.
+
+	Args:
+		curve (str or callable): Name in CURVES, or a vectorized function.
+
+	Returns:
+		tuple: Read-only float32 arrays of the table values and of the
+		slopes between consecutive values, for linear interpolation.
+	"""
+	function = CURVES[curve] if isinstance(curve, str) else curve
+	grid = np.linspace(-domain, domain, size)
+	values = np.asarray(function(grid), dtype=np.float64)
+	slopes = np.append(np.diff(values), 0)  # The last point is only read at the domain's end
+	values, slopes = values.astype(np.float32), slopes.astype(np.float32)
+	values.flags.writeable = slopes.flags.writeable = False
+	return values, slopes
+
+
+class Waveshaper:
+	def __init__(self, curve="tanh", drive=1.0, oversample=1, table_size=DEFAULT_TABLE_SIZE,
+			domain=DEFAULT_DOMAIN):
+		"""
+		Memoryless distortion, output = curve(drive * input), evaluated
+		through a precomputed lookup table with linear interpolation rather
+		than calling the curve for every sample.
+
+		Distortion adds harmonics above Nyquist, which fold back as
+		aliasing. With `oversample`, blocks are shaped at a multiple of the
+		rate by an Oversampler, whose filter also removes the harmonics
+		before decimation. Its state carries across calls to process(), at
+		a latency of `latency` frames.
+
+		Args:
+			curve (str or callable): A name in CURVES, or a vectorized
+				function; its table is cached, so pass the same function
+				object to share it.
+			drive (float): Input gain before the curve.
+			oversample (int): One of OVERSAMPLING.
+			table_size (int): Table points across [-domain, domain].
+			domain (float): Driven input range the table covers; the curve
+				is taken as flat beyond it.
+		"""
+		if curve not in CURVES and not callable(curve):
+			raise ValueError(f"Unsupported waveshaper curve: {curve}")
+		if oversample not in OVERSAMPLING:
+			raise ValueError(f"Unsupported oversampling factor: {oversample}")
+		self.curve = curve
+		self.drive = drive
+		self.oversample = oversample
+		self.domain = domain
+		self.values, self.slopes = transfer_table(curve, table_size, domain)
+		self._scale = (table_size - 1) / (2 * domain)  # Table positions per unit of input
+		self._last = table_size - 1
+		self._oversampler = Oversampler(oversample) if oversample > 1 else None
+		self.latency = self._oversampler.latency if self._oversampler else 0
+
+	def reset(self):
+		"""
+		Forget all input, as if the signal started again from silence.
+		"""
+		if self._oversampler is not None:
+			self._oversampler.reset()
+
+	def shape(self, samples):
+		"""
+		Apply the transfer curve to samples, without oversampling. NaN
+		samples are shaped as silence.
+		"""
+		center = np.float32(self.domain * self._scale)  # Table position of 0
+		position = np.asarray(samples, dtype=np.float32) * np.float32(self.drive * self._scale)
+		position += center
+		np.nan_to_num(position, copy=False, nan=center)
+		np.clip(position, 0, self._last, out=position)
+		index = position.astype(np.intp)
+		position -= index  # Fraction between table points
+		position *= self.slopes[index]
+		position += self.values[index]
+		return position
+
+	def process(self, block):
+		"""
+		Shape the next block of input.
+
+		Args:
+			block (np.ndarray): (frames,) or (frames, channels) samples.
+
+		Returns:
+			np.ndarray: float32 samples in the block's shape, delayed by
+			`latency` frames when oversampling.
+		"""
+		block = np.asarray(block, dtype=np.float32)
+		if self._oversampler is None:
+			return self.shape(block)
+		shaped = self.shape(self._oversampler.up(block))
+		return self._oversampler.down(shaped).reshape(block.shape)
+
+
+class WaveshaperNode(DynamicsNode):
+	def __init__(self, source, waveshaper):
+		"""
+		Node applying a Waveshaper to another node; see DynamicsNode.
+		"""
+		super().__init__(source, waveshaper)
+
+	@property
+	def seekable(self):
+		# Without oversampling the shaper has no state
+		return self.processor.oversample == 1
+
+	def local_key(self):
+		return ("WaveshaperNode", id(self))
@@ -1,6 +1,28 @@
 from pathlib import Path
 import numpy as np
 from src.core.audio_source import *
+from src.core.resample import StreamingResampler, resampled_length
+from src.core.cse import intern_graph
+from src.core.convolution import *
+from src.core.oscillator import Oscillator
+import threading
+import time
+from src.core.buffer import MultiBuffer, MathExprProducer, ConsumerDetached
+from src.core.output_engine import OutputEngine
+from src.core.audio_backend import CallbackStop, NullBackend, get_backend, set_backend
+from src.core.render import render_blocks, render_parallel, render_to_file, segmentable
+from src.core.audio_buffer import AudioBuffer
+from src.core.dynamics import Compressor, DynamicsNode
+import src.core.audio_info as audio_info
+import src.core.audio_backend as audio_backend
+from src.core.audio_cache import PCMCache
+import os
+import json
+from src.core.sound_manager import ensure_stereo, load_audio
+import tempfile
+import contextlib
+import io
+import soundfile as sf
 
 
 def test_audio_source(root, indent="", verbose=False, *args, **kwargs):
@@ -22,6 +44,11 @@ def test_audio_source(root, indent="", verbose=False, *args, **kwargs):
 	if not test_file.exists():
 		raise FileNotFoundError(f"Test file not found: {test_file}")
 
+	# Keep decoded PCM out of the user's cache directory
+	pcm_directory = tempfile.TemporaryDirectory()
+	previous_pcm_cache = os.environ.get("PYMUSE_PCM_CACHE")
+	os.environ["PYMUSE_PCM_CACHE"] = pcm_directory.name
+
 	sample_rate = AudioConfig.get_sample_rate()
 	report("Starting AudioSource and Node tests...", indent, verbose)
 
@@ -29,9 +56,35 @@ def test_audio_source(root, indent="", verbose=False, *args, **kwargs):
 	results = [
 		test_audio_source_node(test_file, sample_rate, indent, verbose),
 		test_node_tree_evaluation(indent, verbose),
-		test_time_range_clipping(test_file, sample_rate, indent, verbose)
+		test_time_range_clipping(test_file, sample_rate, indent, verbose),
+		test_time_range_grid(sample_rate, indent, verbose),
+		test_audio_source_slicing(test_file, sample_rate, indent, verbose),
+		test_audio_buffer(test_file, sample_rate, indent, verbose),
+		test_audio_source_streaming(test_file, indent, verbose),
+		test_audio_info(indent, verbose),
+		test_decoded_audio_cache(test_file, indent, verbose),
+		test_pcm_cache(test_file, indent, verbose),
+		test_audio_source_resampling(test_file, indent, verbose),
+		test_compiled_node_evaluation(test_file, indent, verbose),
+		test_common_subexpressions(test_file, indent, verbose),
+		test_fft_convolution(test_file, indent, verbose),
+		test_partitioned_convolution(test_file, indent, verbose),
+		test_oscillators(sample_rate, indent, verbose),
+		test_math_expr_producer(sample_rate, indent, verbose),
+		test_multi_buffer_ring(indent, verbose),
+		test_multi_buffer_backpressure(indent, verbose),
+		test_output_engine(indent, verbose),
+		test_null_backend(sample_rate, indent, verbose),
+		test_offline_render(test_file, sample_rate, indent, verbose),
+		test_segmented_render(test_file, indent, verbose)
 	]
 
+	if previous_pcm_cache is None:
+		del os.environ["PYMUSE_PCM_CACHE"]
+	else:
+		os.environ["PYMUSE_PCM_CACHE"] = previous_pcm_cache
+	pcm_directory.cleanup()
+
 	all_passed = all(results)
 	report("All tests completed." + (" Success!" if all_passed else " Failure!"), indent, verbose)
 	return all_passed
@@ -114,12 +167,929 @@ def test_time_range_clipping(test_file, sample_rate, indent, verbose):
 		report("Playing full buffer...", indent + "\t", verbose)
 		play_buffer(full_output, sample_rate=sample_rate)
 
+		# Clamping to the file's length leaves the caller's TimeRange alone
+		requested = TimeRange(-1, float("inf"))
+		source = AudioSource(filename=str(test_file), time_range=requested)
+		assert requested.end == float("inf"), "AudioSource modified the caller's TimeRange"
+		assert source.time_range is not requested and source.time_range.end == source.duration()
+
 		return True
 	except Exception as e:
 		report(f"TimeRange clipping test failed: {e}", indent, verbose)
 		return False
 
 
+def test_time_range_grid(sample_rate, indent, verbose):
+	"""
+	Test that TimeRange time points come from an exact sample-index grid.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	try:
+		report("Testing TimeRange sample grid...", indent, verbose)
+
+		# An hour-long range must not drift or hit an iteration limit
+		time_range = TimeRange(0, 3600.0, 1/sample_rate)
+		count = time_range.num_samples()
+		assert count == 3600 * sample_rate, f"Sample count {count} != {3600 * sample_rate}"
+		last = time_range.times(count - 1)[-1]
+		assert last == (count - 1) / sample_rate, f"Last time point {last} drifted"
+
+		# Blocks and chunks must cover the same grid as the materialized range
+		time_range = TimeRange(0.25, 1.25, 1/sample_rate)
+		blocks = np.concatenate(list(time_range.blocks(1000)))
+		assert np.array_equal(blocks, time_range.times()), "Blocks do not match times()"
+		chunks = sum(len(chunk) for chunk in time_range.chunks(1000))
+		assert chunks == len(time_range), f"Chunks cover {chunks} != {len(time_range)} samples"
+
+		return True
+	except Exception as e:
+		report(f"TimeRange grid test failed: {e}", indent, verbose)
+		return False
+
+
+def test_audio_source_slicing(test_file, sample_rate, indent, verbose):
+	"""
+	Test that AudioSource evaluates ranges as views, gathers and interpolations.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	try:
+		report("Testing AudioSource slicing...", indent, verbose)
+		source = AudioSource(filename=str(test_file))
+		first = sample_rate // 2
+
+		# A range on the source's sample grid is a read-only view of its data
+		output = source.eval(TimeRange(0.5, 1.5, 1/sample_rate))
+		assert np.shares_memory(output, source.data), "Expected a view of the source data"
+		assert not output.flags.writeable, "Views of source data must be read-only"
+		assert np.array_equal(output, source.data[first:first + sample_rate])
+
+		# Any other step gathers the samples instead
+		output = source.eval(TimeRange(0.5, 1.5, 2/sample_rate))
+		assert np.array_equal(output, source.data[first:first + sample_rate:2])
+
+		# Linear interpolation lands halfway between neighbouring samples
+		source.interpolation = "linear"
+		output = source.eval(TimeRange(0.5, 0.5 + 1000/sample_rate, 0.5/sample_rate))
+		expected = (source.data[first:first + 999] + source.data[first + 1:first + 1000]) / 2
+		assert np.allclose(output[1:-1:2], expected), "Linear interpolation mismatch"
+
+		return True
+	except Exception as e:
+		report(f"AudioSource slicing test failed: {e}", indent, verbose)
+		return False
+
+
+def test_audio_buffer(test_file, sample_rate, indent, verbose):
+	"""
+	Test that AudioBuffers slice and present channels without copying, and
+	copy only when written to.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	try:
+		report("Testing AudioBuffer views...", indent, verbose)
+		source = AudioSource(filename=str(test_file), time_range=TimeRange(0.5, 1.5))
+		buffer = source.buffer
+		assert buffer.offset == sample_rate // 2 and buffer.sample_rate == sample_rate
+		clip = buffer[100:200, -1]
+		assert np.shares_memory(clip.data, source.data), "Slicing copied the samples"
+		assert clip.offset == buffer.offset + 100 and clip.layout == "mono"
+		assert np.array_equal(clip.data[:, 0], source.data[100:200, -1])
+		assert not clip.data.flags.writeable, "Views of shared samples must be read-only"
+
+		# Writing copies once, leaving the source untouched
+		samples = clip.writable()
+		samples[:] = 0
+		assert clip.writable() is samples, "A buffer copied twice"
+		assert not np.shares_memory(samples, source.data) and np.any(source.data[100:200, -1])
+
+		# Mono arrays become writable stereo copies; AudioBuffers broadcast
+		mono = np.arange(10, dtype=np.int16)
+		stereo = ensure_stereo(mono)
+		stereo[:, 0] = 0
+		assert stereo.shape == (10, 2) and np.array_equal(stereo[:, 1], mono) and mono[1] == 1
+		wide = ensure_stereo(AudioBuffer(mono, 8000))
+		assert wide.layout == "stereo" and np.shares_memory(wide.data, mono), "ensure_stereo copied"
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, "mono.wav")
+			sf.write(path, mono, 8000)
+			rate, loaded = load_audio(path, dtype="int16")
+			loaded[:, 0] = 0  # Callers may modify loaded audio in place
+			assert rate == 8000 and np.array_equal(loaded[:, 1], mono), "Mono file not loaded as stereo"
+		scaled = wide.as_float()
+		assert scaled.dtype == np.float32 and np.isclose(scaled.data[9, 1], 9 / 32768)
+		assert scaled.as_float() is scaled, "Converting to the same dtype copied"
+		return True
+	except Exception as e:
+		report(f"AudioBuffer test failed: {e}", indent, verbose)
+		return False
+
+
+def test_audio_source_streaming(test_file, indent, verbose):
+	"""
+	Test that a streaming AudioSource matches one loaded up front.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	try:
+		report("Testing streaming AudioSource...", indent, verbose)
+		loaded = AudioSource(filename=str(test_file), time_range=TimeRange(1.0, 4.0))
+		streamed = AudioSource(filename=str(test_file), time_range=TimeRange(1.0, 4.0),
+			streaming=True, block_size=4096)
+
+		# Sequential blocks, a backwards seek and a range past the end
+		ranges = list(TimeRange(0, 1.0).chunks(1024))
+		ranges += [TimeRange(0.25, 0.5), TimeRange(2.5, 3.5)]
+		for time_range in ranges:
+			expected = loaded.eval(time_range)
+			output = streamed.eval(time_range)
+			# MP3 decoding rounds differently when read block by block
+			assert np.allclose(output, expected, atol=1e-6), "Streamed samples differ"
+		streamed.close()
+		try:
+			streamed.eval(TimeRange(0, 0.1))
+			assert False, "Read from a closed stream didn't raise"
+		except ValueError:
+			pass
+
+		# A decoding error in the read-ahead thread surfaces in read()
+		with AudioStreamReader(str(test_file), dtype="complex64") as reader:
+			try:
+				reader.read(0, 1024)
+				assert False, "Decoding error not raised"
+			except ValueError:
+				pass
+
+		return True
+	except Exception as e:
+		report(f"Streaming AudioSource test failed: {e}", indent, verbose)
+		return False
+
+
+def test_audio_info(indent, verbose):
+	"""
+	Test that audio metadata is read with soundfile or ffprobe, cached until
+	the file changes, and persisted to the index in one write.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	read_audio_info, mediainfo = audio_info._read_audio_info, audio_info.mediainfo
+	probes = []
+	def counting_read(path):
+		probes.append(path)
+		return read_audio_info(path)
+	try:
+		report("Testing audio metadata cache...", indent, verbose)
+		audio_info._read_audio_info = counting_read
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, "tone.wav")
+			sf.write(path, np.zeros((8000, 2), dtype=np.float32), 8000)
+			info = audio_info.get_audio_info(path)
+			assert info == audio_info.AudioInfo(1.0, 8000, 2, 8000), f"Wrong metadata: {info}"
+			audio_info.get_audio_info(path)
+			assert len(probes) == 1, "Unchanged file probed again"
+
+			# A new size or mtime invalidates the entry
+			sf.write(path, np.zeros(4000, dtype=np.float32), 8000)
+			assert audio_info.get_audio_info(path).frames == 4000 and len(probes) == 2
+			stat = os.stat(path)
+			os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+			audio_info.get_audio_info(path)
+			assert len(probes) == 3, "Touched file not probed again"
+
+			# Formats libsndfile can't open go through ffprobe
+			other = os.path.join(directory, "clip.xyz")
+			with open(other, "wb") as file:
+				file.write(b"not audio")
+			audio_info.mediainfo = lambda path: {"duration": "2.5", "sample_rate": "48000", "channels": "1"}
+			info = audio_info.get_audio_info(other)
+			assert info == audio_info.AudioInfo(2.5, 120000, 1, 48000), f"Wrong ffprobe metadata: {info}"
+
+			# The index is written once when saved, then reloaded without probing
+			index = os.path.join(directory, "index.json")
+			audio_info.set_metadata_index(index)
+			audio_info.save_metadata_index()
+			with open(index) as file:
+				indexed = json.load(file)
+			assert os.path.abspath(path) in indexed and os.path.abspath(other) in indexed, \
+				"Probed files missing from the index"
+			assert not [name for name in os.listdir(directory) if name.endswith(".tmp")], \
+				"Temporary index left behind"
+			audio_info.set_metadata_index(None)
+			audio_info.clear_metadata_cache()
+			audio_info.set_metadata_index(index)
+			probed = len(probes)
+			audio_info.get_audio_info(path)
+			assert len(probes) == probed, "Indexed metadata not reused"
+			audio_info.set_metadata_index(None)
+		return True
+	except Exception as e:
+		report(f"Audio metadata cache test failed: {e}", indent, verbose)
+		return False
+	finally:
+		audio_info._read_audio_info, audio_info.mediainfo = read_audio_info, mediainfo
+		audio_info.set_metadata_index(None)
+
+
+def test_decoded_audio_cache(test_file, indent, verbose):
+	"""
+	Test that clips of the same file share one decoded array.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	try:
+		report("Testing decoded audio cache...", indent, verbose)
+		first = AudioSource(filename=str(test_file), time_range=TimeRange(0.0, 1.0))
+		second = AudioSource(filename=str(test_file), time_range=TimeRange(2.0, 3.0))
+		assert first.data.base is second.data.base, "Clips do not share decoded data"
+		assert not first.data.flags.writeable, "Shared decoded data must be read-only"
+		return True
+	except Exception as e:
+		report(f"Decoded audio cache test failed: {e}", indent, verbose)
+		return False
+
+
+def test_pcm_cache(test_file, indent, verbose):
+	"""
+	Test that compressed files are decoded once into memory-mapped PCM
+	entries under $PYMUSE_PCM_CACHE, rebuilt when the source changes.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	try:
+		report("Testing on-disk PCM cache...", indent, verbose)
+		with tempfile.TemporaryDirectory() as directory:
+			previous = os.environ.get("PYMUSE_PCM_CACHE")
+			os.environ["PYMUSE_PCM_CACHE"] = os.path.join(directory, "pcm")
+			try:
+				cache = PCMCache()
+				source = os.path.join(directory, "clip.flac")
+				samples = np.round(np.random.default_rng(0).uniform(-0.5, 0.5, (10000, 2)) * 32768) / 32768
+				sf.write(source, samples, 22050)
+				assert cache.is_compressed(source), "FLAC not treated as compressed"
+				data, rate = cache.load(source)
+				entry = cache.entry_path(source)
+				assert os.path.dirname(entry) == os.path.join(directory, "pcm"), "Cache ignored PYMUSE_PCM_CACHE"
+				assert os.path.getsize(entry) == PCMCache.HEADER_SIZE + samples.size * 4, "Unexpected entry layout"
+				built = os.stat(entry).st_mtime_ns
+				del data
+
+				data, rate = cache.load(source)
+				assert isinstance(data, np.memmap), "Cached entry not memory-mapped"
+				assert os.stat(entry).st_mtime_ns == built, "Valid entry decoded again"
+				assert rate == 22050 and np.array_equal(data, samples), "Cached samples differ"
+				del data
+
+				# Touching the source rebuilds the entry
+				stat = os.stat(source)
+				os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+				cache.load(source)
+				assert cache._read_header(entry)[0] == os.stat(source).st_mtime_ns, "Touched source not re-decoded"
+
+				# So does resizing it
+				sf.write(source, samples[:4000], 22050)
+				data, _ = cache.load(source)
+				assert np.array_equal(data, samples[:4000]), "Resized source not re-decoded"
+				del data
+			finally:
+				if previous is None:
+					del os.environ["PYMUSE_PCM_CACHE"]
+				else:
+					os.environ["PYMUSE_PCM_CACHE"] = previous
+		return True
+	except Exception as e:
+		report(f"PCM cache test failed: {e}", indent, verbose)
+		return False
+
+
+def test_audio_source_resampling(test_file, indent, verbose):
+	"""
+	Test that sources are resampled to the AudioConfig rate, and that the
+	streaming resampler matches whole-array resampling block by block.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	original_rate = AudioConfig.get_sample_rate()
+	try:
+		report("Testing AudioSource resampling...", indent, verbose)
+		native = AudioSource(filename=str(test_file))
+		AudioConfig.set_sample_rate(48000)
+		source = AudioSource(filename=str(test_file))
+		expected = resampled_length(native.num_frames, native.sample_rate, 48000)
+		assert source.sample_rate == 48000, f"Rate {source.sample_rate} != 48000"
+		assert source.num_frames == expected, f"Frames {source.num_frames} != {expected}"
+
+		# Blocks of uneven size through the streaming resampler
+		resampler = StreamingResampler(native.sample_rate, 48000)
+		blocks = [resampler.process(native.data[i:i + 1000]) for i in range(0, native.num_frames, 1000)]
+		streamed = np.concatenate(blocks + [resampler.flush(native.channels)])
+		streamed = streamed[resampler.latency:resampler.latency + expected]
+		assert np.allclose(streamed, source.data, atol=1e-6), "Streaming resampler mismatch"
+
+		return True
+	except Exception as e:
+		report(f"AudioSource resampling test failed: {e}", indent, verbose)
+		return False
+	finally:
+		AudioConfig.set_sample_rate(original_rate)
+
+
+def test_compiled_node_evaluation(test_file, indent, verbose):
+	"""
+	Test that compiled node plans match recursive evaluation and are rebuilt
+	when the tree changes.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	try:
+		report("Testing compiled Node evaluation...", indent, verbose)
+		first = AudioSource(filename=str(test_file), time_range=TimeRange(0.0, 2.0))
+		second = AudioSource(filename=str(test_file), time_range=TimeRange(1.0, 3.0))
+		tree = (first * 0.5 + second * first) % 0.3 + first * second * 2 + (first + 0)
+
+		# Same-sized blocks replay the recorded buffer assignment
+		for time_range in TimeRange(0, 1.0).chunks(4096):
+			expected = tree.eval(time_range)
+			assert np.allclose(tree.eval_compiled(time_range), expected), "Compiled result differs"
+		out = np.empty_like(expected)
+		assert tree.eval_compiled(time_range, out=out) is out, "Result not written to out"
+
+		plan = tree.compile()
+		assert tree.compile() is plan, "Plan rebuilt for an unchanged tree"
+		tree.nodes.append(ConstantNode(0.25))
+		assert tree.compile() is not plan, "Plan not rebuilt after the tree changed"
+		time_range = TimeRange(0, 0.5)
+		assert np.allclose(tree.eval_compiled(time_range), tree.eval(time_range))
+		plan = tree.compile()
+		tree.nodes[0].left = second
+		assert tree.compile() is not plan, "Plan not rebuilt after an operand was replaced"
+
+		# Each thread gets its own plan
+		plans = []
+		worker = threading.Thread(target=lambda: plans.append(tree.compile()))
+		worker.start()
+		worker.join()
+		assert plans[0] is not tree.compile(), "Plan shared between threads"
+
+		# Processor nodes are steps of the plan, fed by their compiled source
+		processed = DynamicsNode(first * 0.5, Compressor(-20, 4, sample_rate=first.sample_rate)) + second
+		reference = DynamicsNode(first * 0.5, Compressor(-20, 4, sample_rate=first.sample_rate)) + second
+		assert "node" in [kind for kind, *_ in processed.compile().steps], "Processor compiled as a leaf"
+		for time_range in TimeRange(0, 0.5).chunks(4096):
+			assert np.allclose(processed.eval_compiled(time_range), reference.eval(time_range)), \
+				"Compiled processor differs"
+
+		return True
+	except Exception as e:
+		report(f"Compiled Node evaluation test failed: {e}", indent, verbose)
+		return False
+
+
+def test_common_subexpressions(test_file, indent, verbose):
+	"""
+	Test that interning merges structurally identical sub-expressions and
+	sub-trees without changing the result.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	try:
+		report("Testing common subexpression elimination...", indent, verbose)
+		time_range = TimeRange(0, 0.25)
+		expr = sine(440) * 0.5 + sine(440) * sine(440) + sine(220)
+		expected = expr(time_range)
+		expr = intern_graph(expr)
+		sines = {id(arg) for product in expr.args[0].args for arg in product.args
+			if isinstance(arg, MathExpr) and arg.name == "sine" and arg.params == [440, 0]}
+		assert len(sines) == 1, "Identical sine expressions not merged"
+		assert np.allclose(expr(time_range), expected), "Interned expression differs"
+
+		first = AudioSource(filename=str(test_file), time_range=TimeRange(0.0, 2.0))
+		second = AudioSource(filename=str(test_file), time_range=TimeRange(0.0, 2.0))
+		tree = first * MathExprNode(sine(440)) + second * MathExprNode(sine(440)) + first * 0.5
+		expected = tree.eval(time_range)
+		tree = intern_graph(tree)
+		assert tree.nodes[0] is tree.nodes[1], "Identical sub-trees not merged"
+		assert tree.nodes[2].nodes[0] is tree.nodes[0].nodes[0], "Identical sources not merged"
+		assert np.allclose(tree.eval_compiled(time_range), expected), "Interned tree differs"
+
+		# Operands of processor nodes are interned too
+		processed = DynamicsNode(AudioSource(filename=str(test_file), time_range=TimeRange(0.0, 2.0)),
+			Compressor(sample_rate=first.sample_rate))
+		tree = intern_graph(processed + first)
+		assert tree.nodes[0].source is tree.nodes[1], "Processor operand not merged"
+
+		# Constant-folded nodes keep stale operands that must be left alone
+		for tree in (ModNode(MathExprNode(sine(440)), AddNode(2, 3)),
+				ConvNode(MathExprNode(sine(440)), MulNode(ConstantNode(2), 3))):
+			expected = tree.eval(time_range)
+			assert np.allclose(intern_graph(tree).eval(time_range), expected), "Folded tree differs"
+
+		return True
+	except Exception as e:
+		report(f"Common subexpression test failed: {e}", indent, verbose)
+		return False
+
+
+def test_fft_convolution(test_file, indent, verbose):
+	"""
+	Test that ConvNode matches direct convolution for every method and
+	caches the spectrum of a constant impulse response.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	try:
+		report("Testing FFT convolution...", indent, verbose)
+		rng = np.random.default_rng(0)
+		for length, taps in [(1000, 5), (1000, 700), (20000, 300)]:
+			signal, kernel = rng.standard_normal(length), rng.standard_normal(taps)
+			expected = np.convolve(signal, kernel, mode='same')
+			for method in ("direct", "fft", "overlap_add"):
+				result = convolve_same(signal, kernel, method)
+				assert np.allclose(result, expected), f"{method} convolution differs"
+
+		source = AudioSource(filename=str(test_file), time_range=TimeRange(0.0, 1.0))
+		impulse_response = np.exp(-np.arange(2000) / 300.0) * rng.standard_normal(2000)
+		node = ConvNode(source, ConstantNode(impulse_response))
+		time_range = TimeRange(0, 0.5)
+		data = source.eval(time_range)
+		expected = np.stack([np.convolve(data[:, c], impulse_response, mode='same')
+			for c in range(data.shape[1])], axis=1)
+		assert np.allclose(node.eval(time_range), expected, atol=1e-4), "ConvNode result differs"
+		assert len(node._spectra) == 1, "Impulse response spectrum not cached"
+		assert np.allclose(node.eval_compiled(time_range), expected, atol=1e-4), "Compiled ConvNode differs"
+		assert len(node._spectra) == 1, "Impulse response spectrum recomputed"
+
+		return True
+	except Exception as e:
+		report(f"FFT convolution test failed: {e}", indent, verbose)
+		return False
+
+
+def test_partitioned_convolution(test_file, indent, verbose):
+	"""
+	Test that block-wise partitioned convolution, uniform and non-uniform,
+	matches convolving the whole signal at once.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	try:
+		report("Testing partitioned convolution...", indent, verbose)
+		impulse_response = AudioSource(filename=str(test_file), time_range=TimeRange(0.0, 0.25))
+		response = impulse_response.eval(TimeRange.from_samples(0, impulse_response.num_frames))
+		signal = np.random.default_rng(0).standard_normal((256 * 100, response.shape[1]))
+		expected = convolve_full(signal, response)[:len(signal)]
+		for partitions in (None, partition_layout(len(response), 256)):
+			convolver = PartitionedConvolver(impulse_response, block_size=256, partitions=partitions)
+			result = np.concatenate([convolver.process(signal[start:start + 256])
+				for start in range(0, len(signal), 256)])
+			assert np.allclose(result, expected, atol=1e-6), f"Partitioned result differs for {partitions}"
+		assert convolver.latency == 256, "Unexpected latency"
+
+		return True
+	except Exception as e:
+		report(f"Partitioned convolution test failed: {e}", indent, verbose)
+		return False
+
+
+def test_oscillators(sample_rate, indent, verbose):
+	"""
+	Test that oscillators continue their phase across blocks, seek on
+	jumps, accept frequency modulation and reduce aliasing when band-limited.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	try:
+		report("Testing oscillators...", indent, verbose)
+		oscillator = Oscillator("sine", 1000.0)
+		blocks = np.concatenate([oscillator.eval(time_range)
+			for time_range in TimeRange(0, 1.0).chunks(4096)])
+		indices = np.arange(len(blocks))
+		assert np.allclose(blocks[:, 0], np.sin(2 * np.pi * 1000 * indices / sample_rate),
+			atol=1e-6), "Block-wise phase drifted"
+		jump = oscillator.eval(TimeRange.from_samples(sample_rate * 1000, 256))
+		expected = np.sin(2 * np.pi * ((1000 * (indices[:256] + sample_rate * 1000) / sample_rate) % 1))
+		assert np.allclose(jump[:, 0], expected, atol=1e-6), "Seek missed the phase"
+
+		voices = Oscillator("square", [440, 660.5])
+		whole = voices.render(10000)
+		voices.reset()
+		parts = np.concatenate([voices.render(256) for _ in range(40)])[:10000]
+		assert whole.shape == (10000, 2) and np.allclose(whole, parts), "Voices differ across blocks"
+
+		# Empty renders and ranges give no frames and leave the phase alone
+		assert voices.render(0).shape == (0, 2), "Empty render failed"
+		empty = TimeRange.from_samples(256, 0, sample_rate)
+		fm = Oscillator("sine", sine(5) * 100 + 440)
+		assert Oscillator().eval(empty).shape == (0, 1) and fm.eval(empty).shape == (0, 1), \
+			"Empty TimeRange failed"
+		assert np.allclose(fm.eval(TimeRange.from_samples(0, 64, sample_rate)),
+			Oscillator("sine", sine(5) * 100 + 440).eval(TimeRange.from_samples(0, 64, sample_rate))), \
+			"Empty range moved the phase"
+
+		# Integrating a constant FM input gives the same phase as a fixed frequency
+		modulated = Oscillator("sawtooth", sine(0) + 220)
+		assert np.allclose(modulated.eval(TimeRange(0, 0.1)), Oscillator("sawtooth", 220.0).render(
+			TimeRange(0, 0.1).num_samples()), atol=1e-6), "Frequency modulation differs"
+
+		# A shared modulated oscillator evaluated twice per block advances once
+		shared = Oscillator("sine", sine(5) * 100 + 440)
+		single = Oscillator("sine", sine(5) * 100 + 440)
+		doubled = shared + shared
+		for time_range in TimeRange(0, 0.5).chunks(4096):
+			assert np.allclose(doubled.eval(time_range), 2 * single.eval(time_range), atol=1e-6), \
+				"Modulated phase advanced twice"
+
+		def aliasing(band_limited, frequency=3101.0):
+			samples = Oscillator("sawtooth", frequency, band_limited=band_limited).render(8192)[:, 0]
+			spectrum = np.abs(np.fft.rfft(samples * np.blackman(len(samples)))) ** 2
+			frequencies = np.fft.rfftfreq(len(samples), 1 / sample_rate)
+			harmonics = np.abs((frequencies + frequency / 2) % frequency - frequency / 2) < 40
+			return spectrum[~harmonics].sum() / spectrum.sum()
+		assert aliasing(True) < aliasing(False) / 10, "PolyBLEP didn't reduce aliasing"
+
+		return True
+	except Exception as e:
+		report(f"Oscillator test failed: {e}", indent, verbose)
+		return False
+
+
+def test_math_expr_producer(sample_rate, indent, verbose):
+	"""
+	Test that block-rendering producers match per-sample evaluation and
+	write into a caller-supplied buffer.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	try:
+		report("Testing MathExpr producers...", indent, verbose)
+		signal = sine(440) * 0.25 + sawtooth(110) * 0.1 + triangle(330) * 0.2
+		expected = np.array([signal(n / sample_rate) for n in range(3000)], dtype=np.float32)
+
+		producer = MathExprProducer(signal, MultiBuffer(4, 1024, 1), samplerate=sample_rate)
+		producer.running_event.set()
+		chunks = producer.produce()
+		result = np.concatenate([next(chunks).copy() for _ in range(3)])
+		assert np.allclose(result[:3000], expected, atol=1e-6), "Producer output differs"
+		assert producer.sample_index == 3072, "Sample counter not advanced"
+
+		out = np.empty(1024, dtype=np.float32)
+		generator = math_expr_producer(None, 0, signal, samplerate=sample_rate, out=out)
+		assert next(generator) is out and np.allclose(out, expected[:1024], atol=1e-6), \
+			"Chunk not written into out"
+		assert np.allclose(next(generator), expected[1024:2048], atol=1e-6), "Second chunk differs"
+
+		# A paused blocking consumer makes the threaded producer wait quietly
+		ring = MultiBuffer(2, 256, 1)
+		ring.set_policy(0, MultiBuffer.BLOCK)
+		producer = MathExprProducer(signal, ring, samplerate=sample_rate)
+		producer.BLOCK_TIMEOUT = 0.02
+		output = io.StringIO()
+		with contextlib.redirect_stdout(output):
+			producer.start()
+			deadline = time.monotonic() + 5
+			while producer.blocked < 3 and time.monotonic() < deadline:
+				time.sleep(0.01)
+			first = ring.read(0, timeout=5).copy()
+			producer.stop()
+		assert producer.blocked >= 3, "Waits on the blocking consumer not counted"
+		assert not output.getvalue(), "Producer printed while blocked"
+		assert np.allclose(first[:, 0], expected[:256], atol=1e-6), "Chunks lost while blocked"
+
+		return True
+	except Exception as e:
+		report(f"MathExpr producer test failed: {e}", indent, verbose)
+		return False
+
+
+def test_multi_buffer_ring(indent, verbose):
+	"""
+	Test that the MultiBuffer ring hands every consumer every chunk in order
+	as read-only views of its preallocated storage.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	try:
+		report("Testing MultiBuffer ring...", indent, verbose)
+		ring = MultiBuffer(4, 256, 2, channels=2)
+		received = [[], []]
+		errors = []
+
+		def consume(consumer_id):
+			try:
+				for _ in range(100):
+					chunk = ring.read(consumer_id, timeout=5)
+					assert not chunk.flags.writeable, "Chunk is writable"
+					assert np.shares_memory(chunk, ring.data), "Chunk was copied"
+					received[consumer_id].append(chunk[0, 0])
+				ring.release(consumer_id)
+			except Exception as e:
+				errors.append(e)
+
+		consumers = [threading.Thread(target=consume, args=(i,)) for i in range(2)]
+		for consumer in consumers:
+			consumer.start()
+		for written in range(100):
+			slot = ring.reserve(timeout=5)  # Waits while a consumer holds the slot
+			slot[:] = written
+			ring.commit()
+		for consumer in consumers:
+			consumer.join()
+		assert not errors, errors
+		assert received == [list(range(100))] * 2, "Chunks lost or reordered"
+
+		# Chunks longer than a slot are split across consecutive slots
+		ring = MultiBuffer(4, 256, 1, channels=2)
+		long_chunk = np.arange(640, dtype=np.float32)
+		ring.write(long_chunk)
+		chunks = [ring.read(0, timeout=0).copy() for _ in range(3)]
+		assert ring.read(0, timeout=0) is None, "Too many slots written"
+		frames = np.concatenate(chunks)
+		assert np.array_equal(frames[:640, 1], long_chunk), "Frames of a long chunk lost"
+		assert not frames[640:].any(), "Last slot not padded with silence"
+
+		return True
+	except Exception as e:
+		report(f"MultiBuffer ring test failed: {e}", indent, verbose)
+		return False
+
+
+def test_multi_buffer_backpressure(indent, verbose):
+	"""
+	Test that a blocking player receives every chunk while a slow analyzer
+	drops chunks and a stalled recorder is detached.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	try:
+		report("Testing MultiBuffer backpressure...", indent, verbose)
+		player, analyzer, recorder = range(3)
+		ring = MultiBuffer(4, 64, 3)
+		ring.set_policy(analyzer, MultiBuffer.DROP_OLDEST, timeout=0.5)
+		ring.set_policy(recorder, MultiBuffer.DETACH, timeout=0.5)
+		played, analyzed = [], []
+
+		def play():
+			for _ in range(50):
+				played.append(ring.read(player, timeout=5)[0, 0])
+			ring.release(player)
+
+		def analyze():
+			while True:
+				chunk = ring.read(analyzer, timeout=0.2)
+				if chunk is None:
+					break
+				analyzed.append(chunk[0, 0])
+				ring.release(analyzer)  # Don't hold the slot during slow work
+				time.sleep(0.005)  # Slower than the producer
+			ring.release(analyzer)
+
+		threads = [threading.Thread(target=play), threading.Thread(target=analyze)]
+		for thread in threads:
+			thread.start()
+		for index in range(50):
+			ring.write(np.full(64, index), timeout=5)
+		for thread in threads:
+			thread.join()
+
+		assert played == list(range(50)), "Player missed chunks"
+		assert analyzed == sorted(analyzed) and len(analyzed) < 50, "Analyzer didn't drop chunks"
+		stats = ring.stats(analyzer)
+		assert stats.dropped == 50 - len(analyzed) and stats.high_water == 4, f"Unexpected {stats}"
+		assert ring.stats(recorder).detached, "Stalled recorder not detached"
+		try:
+			ring.read(recorder)
+			raise AssertionError("Detached recorder could still read")
+		except ConsumerDetached:
+			pass
+		assert ring.stats(player).dropped == 0, "Player dropped chunks"
+
+		return True
+	except Exception as e:
+		report(f"MultiBuffer backpressure test failed: {e}", indent, verbose)
+		return False
+
+
+def test_output_engine(indent, verbose):
+	"""
+	Test that the output engine re-blocks chunks of any size gaplessly,
+	pads the last block with silence, counts underruns and stops at the end.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	try:
+		report("Testing output engine...", indent, verbose)
+
+		class Status:
+			output_underflow = False
+
+		engine = OutputEngine(channels=2, block_size=256, prefetch=8)
+		engine._running.set()
+		chunks = [np.random.rand(size).astype(np.float32) for size in (100, 300, 5, 700)]
+		out = np.full((256, 2), np.nan, dtype=np.float32)
+		engine._callback(out, 256, None, Status())
+		assert engine.stats().underruns == 0, "Silence before the first block counted as an underrun"
+		for chunk in chunks[:2]:
+			assert engine.write(chunk), "Write failed"
+		played = []
+		for _ in range(2):
+			engine._callback(out, 256, None, Status())
+			played.append(out.copy())
+		assert engine.stats().underruns == 1, f"Expected one underrun, got {engine.stats()}"
+		assert np.all(played.pop() == 0), "Underrun not filled with silence"
+		for chunk in chunks[2:]:
+			engine.write(chunk)
+		engine.end()
+		try:
+			while True:
+				engine._callback(out, 256, None, Status())
+				played.append(out.copy())
+		except CallbackStop:
+			played.append(out.copy())
+
+		expected = np.concatenate(chunks)
+		played = np.concatenate(played)
+		assert np.array_equal(played[:len(expected)], np.repeat(expected[:, np.newaxis], 2, axis=1)), \
+			"Output not gapless"
+		assert not np.any(played[len(expected):]), "Last block not padded with silence"
+		assert engine.stats().frames_played == 5 * 256, f"Unexpected {engine.stats()}"
+
+		return True
+	except Exception as e:
+		report(f"Output engine test failed: {e}", indent, verbose)
+		return False
+
+
+def test_null_backend(sample_rate, indent, verbose):
+	"""
+	Test playback on the null backend: recording, real-time pacing with a
+	simulated duration, and underruns from slow callbacks.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	try:
+		report("Testing null audio backend...", indent, verbose)
+		chunks = [np.random.rand(size, 2).astype(np.float32) for size in (1000, 3000, 17)]
+		backend = NullBackend()
+		# Preroll everything: an unpaced stream outruns any feeder thread
+		engine = OutputEngine(iter(chunks), sample_rate=sample_rate, block_size=512, prefetch=16, backend=backend)
+		engine.start()
+		assert engine.wait(5), "Playback didn't finish"
+		engine.stop()
+		expected = np.concatenate(chunks)
+		recording = backend.streams[-1].recording()
+		assert np.array_equal(recording[:len(expected)], expected), "Recording doesn't match the input"
+		assert not np.any(recording[len(expected):]), "Last block not padded with silence"
+		assert engine.stats().underruns == 0, f"Unexpected {engine.stats()}"
+
+		# An endless source, paced to real time and cut off after 0.1 s
+		def endless():
+			while True:
+				yield np.zeros(441, dtype=np.float32)
+		backend = NullBackend(realtime=True, record=False, duration=0.1)
+		began = time.perf_counter()
+		engine = OutputEngine(endless(), sample_rate=44100, block_size=441, backend=backend)
+		engine.start()
+		assert engine.wait(5), "Paced playback didn't stop"
+		engine.stop()
+		elapsed = time.perf_counter() - began
+		stats = backend.streams[-1].stats()
+		assert stats.frames == 4410 and stats.blocks == 10, f"Unexpected {stats}"
+		assert elapsed >= 0.08, f"Playback not paced: {elapsed:.3f} s"
+
+		# Callbacks slower than their block are underruns, reported to the next callback
+		flags = []
+		def slow(outdata, frames, time_info, status):
+			flags.append(status.output_underflow)
+			time.sleep(2 * frames / 44100)
+			if len(flags) == 3:
+				raise CallbackStop
+		stream = NullBackend().open_stream(44100, 1, 64, slow)
+		stream.start()
+		stream._thread.join(5)
+		assert stream.stats().underruns == 3 and flags == [False, True, True], \
+			f"Unexpected {stream.stats()}, {flags}"
+
+		# Blocking playback through the current backend
+		previous = audio_backend._current_backend  # get_backend() would open sounddevice
+		set_backend(NullBackend())
+		try:
+			tone = np.sin(np.linspace(0, 100, 3000)).astype(np.float32)
+			play_buffer(tone, sample_rate=sample_rate)
+			recording = get_backend().streams[-1].recording()
+			assert np.array_equal(recording[:len(tone), 0], tone), "play_buffer output doesn't match"
+		finally:
+			set_backend(previous)
+
+		return True
+	except Exception as e:
+		report(f"Null backend test failed: {e}", indent, verbose)
+		return False
+
+
+def test_offline_render(test_file, sample_rate, indent, verbose):
+	"""
+	Test rendering node graphs and MathExprs to WAV and FLAC files block by
+	block.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	try:
+		report("Testing offline render...", indent, verbose)
+		with tempfile.TemporaryDirectory() as directory:
+			# A finite graph renders for its own duration
+			source = AudioSource(str(test_file))
+			path = os.path.join(directory, "source.wav")
+			stats = render_to_file(source * 0.5, path, subtype="FLOAT", block_size=1000)
+			data, rate = sf.read(path, dtype="float32", always_2d=True)
+			assert rate == sample_rate and stats.frames == len(data) == source.num_frames, \
+				f"Unexpected length {stats}"
+			assert np.allclose(data, 0.5 * np.asarray(source.data), atol=1e-7), "Rendered samples differ"
+
+			# Mono expressions fill every channel; integer subtypes are clipped
+			updates = []
+			path = os.path.join(directory, "tone.flac")
+			tone = sine(440) * 1.5
+			stats = render_to_file(tone, path, duration=0.5, sample_rate=sample_rate, channels=2,
+				subtype="PCM_16", progress=lambda *update: updates.append(update))
+			data, rate = sf.read(path, dtype="float32", always_2d=True)
+			expected = np.clip(tone(np.arange(len(data)) / sample_rate), -1, 1)
+			assert sf.info(path).subtype == "PCM_16" and data.shape == (sample_rate // 2, 2), \
+				f"Unexpected file {sf.info(path)}"
+			assert np.allclose(data, expected[:, np.newaxis], atol=2 / 32768), "Rendered tone differs"
+			assert updates and updates[-1][:2] == (stats.frames, stats.frames), f"Unexpected progress {updates}"
+			assert stats.speed > 1, f"Slower than real time: {stats}"
+
+			try:
+				render_to_file(ConstantNode(1) + Oscillator(), os.path.join(directory, "endless.wav"))
+				raise AssertionError("Rendered an infinite graph without a duration")
+			except ValueError:
+				pass
+
+		return True
+	except Exception as e:
+		report(f"Offline render test failed: {e}", indent, verbose)
+		return False
+
+
+def test_segmented_render(test_file, indent, verbose):
+	"""
+	Test that rendering in segments on worker processes matches a
+	single-process render, and that unseekable graphs fall back to one.
+
+	Returns:
+		bool: True if the test passes, False otherwise.
+	"""
+	try:
+		report("Testing segmented render...", indent, verbose)
+		source = AudioSource(str(test_file))
+		graph = source * 0.5 + Oscillator("square", [110, 330])
+		duration = source.duration()
+		serial = np.concatenate([block.copy() for block in render_blocks(graph, duration, block_size=1000)])
+		parallel = render_parallel(graph, duration, block_size=1000, workers=3, segment_size=5000)
+		assert parallel.shape == serial.shape, f"Shape {parallel.shape} != {serial.shape}"
+		assert np.allclose(parallel, serial, atol=1e-6), "Segments don't join like a serial render"
+
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, "segmented.wav")
+			stats = render_to_file(graph, path, duration, subtype="FLOAT", block_size=1000, workers=2)
+			data, _ = sf.read(path, dtype="float32", always_2d=True)
+			assert stats.frames == len(serial) and np.allclose(data, serial, atol=1e-6), \
+				"Segmented file differs"
+
+		modulated = Oscillator(frequency=MathExprNode(lambda t: 220 + 20 * np.sin(t)))
+		assert segmentable(graph) and not segmentable(modulated), "Wrong segmentability"
+		parallel = render_parallel(modulated, duration=0.2, workers=3)
+		modulated.reset()
+		serial = np.concatenate([block.copy() for block in render_blocks(modulated, duration=0.2)])
+		assert np.array_equal(parallel, serial), "Unseekable graph not rendered serially"
+
+		return True
+	except Exception as e:
+		report(f"Segmented render test failed: {e}", indent, verbose)
+		return False
+
+
 def report(msg, indent, verbose):
 	"""
 	Helper function to print verbose test information.
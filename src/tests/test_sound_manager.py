@@ -3,8 +3,17 @@ import numpy as np
 import src.core.sound_manager as sound_manager
 from src.core.sound_manager import dtype_info, scale_dtype
 from src.core.sound_manager import load_audio, save_audio
-import sounddevice as sd
 from src.core.custom_types import infer_type
+from src.core.equalizer import *
+from src.core.batch import parse_chain, process_tree
+from src.core.dynamics import Compressor, DynamicsNode, Limiter
+from src.core.waveshaper import Waveshaper, WaveshaperNode
+from src.core.math_expr import TimeRange, sine
+from src.core.audio_source import AddNode
+from src.core.oscillator import Oscillator
+from src.core.render import segmentable
+import tempfile
+import soundfile as sf
 
 def test_dtype_info(indent, verbose):
 	if verbose:
@@ -111,6 +120,204 @@ def test_scale_dtype(indent, verbose):
 			return False
 	return passing
 
+def test_equalizer(indent, verbose):
+	if verbose:
+		print(f"{indent}Testing equalizer...")
+	rate = 44100
+	equalizer = Equalizer(design_low_shelf(200, 6, rate), design_high_shelf(5000, -6, rate),
+		design_peaking(1000, 3, 1, rate), design_band_pass(20, 20000, rate))
+	levels = 20 * np.log10(np.abs(equalizer.response([50, 1000, 15000], rate)))
+	expected = [6, 3, -6]
+	if not np.allclose(levels, expected, atol=0.25):
+		if verbose:
+			print(f"{indent}Response {levels} dB != {expected} dB")
+		return False
+
+	# Block-wise processing carries filter state across block boundaries
+	data = np.random.default_rng(0).standard_normal((10000, 2)).astype(np.float32)
+	whole = equalizer.process(data)
+	equalizer.reset()
+	blocks = np.concatenate([equalizer.process(data[i:i + 256]) for i in range(0, len(data), 256)])
+	if not np.allclose(whole, blocks, atol=1e-5):
+		if verbose:
+			print(f"{indent}Block-wise result differs by {np.max(np.abs(whole - blocks))}")
+		return False
+	if design_low_pass(1000, rate) is not design_low_pass(1000.0, rate):
+		if verbose:
+			print(f"{indent}Filter design not memoized")
+		return False
+	if sound_manager.low_pass(data, 1000, rate).shape != data.shape:
+		if verbose:
+			print(f"{indent}low_pass changed the data shape")
+		return False
+	return True
+
+def test_dynamics(indent, verbose):
+	if verbose:
+		print(f"{indent}Testing dynamics...")
+	rate = 44100
+	t = np.arange(rate * 2) / rate
+	tone = (10 ** (-6 / 20) * np.sin(2 * np.pi * 1000 * t)).astype(np.float32)
+	compressor = Compressor(-20, 4, knee_db=0, attack=0.001, release=0.05, sample_rate=rate)
+	output = compressor.process(tone)
+	level = 20 * np.log10(np.max(np.abs(output[rate:])))
+	if not np.isclose(level, -20 + 14 / 4, atol=0.2):
+		if verbose:
+			print(f"{indent}Compressed level {level} dB != {-20 + 14 / 4} dB")
+		return False
+
+	# Block-wise processing carries the envelope and lookahead across blocks
+	data = np.random.default_rng(0).standard_normal((20000, 2)).astype(np.float32)
+	data *= np.repeat(np.geomspace(0.01, 2, 20), 1000)[:, np.newaxis]
+	compressor = Compressor(-24, 3, knee_db=6, lookahead=0.002, makeup_db=3, sample_rate=rate)
+	whole = compressor.process(data)
+	compressor.reset()
+	blocks = np.concatenate([compressor.process(data[i:i + 256]) for i in range(0, len(data), 256)])
+	if not np.allclose(whole, blocks, atol=1e-6):
+		if verbose:
+			print(f"{indent}Block-wise result differs by {np.max(np.abs(whole - blocks))}")
+		return False
+	# As a node, consecutive ranges continue the state
+	node = DynamicsNode(sine(1000) * 0.5, Compressor(-20, 4, sample_rate=rate))
+	expected = Compressor(-20, 4, sample_rate=rate).process((0.5 * np.sin(2 * np.pi * 1000 * t[:8192])))
+	evaluated = np.concatenate([node.eval(TimeRange.from_samples(i, 4096, rate)) for i in (0, 4096)])
+	if not np.allclose(evaluated[:, 0], expected, atol=1e-5):
+		if verbose:
+			print(f"{indent}DynamicsNode result differs")
+		return False
+	limited = Limiter(-1, sample_rate=rate).process(data * 4)
+	if np.max(np.abs(limited)) > 10 ** (-1 / 20) + 1e-6:
+		if verbose:
+			print(f"{indent}Limiter exceeded its ceiling: {np.max(np.abs(limited))}")
+		return False
+	return True
+
+def test_waveshaper(indent, verbose):
+	if verbose:
+		print(f"{indent}Testing waveshaping...")
+	rate = 44100
+	t = np.arange(rate * 2) / rate
+	tone = (0.9 * np.sin(2 * np.pi * 3000 * t)).astype(np.float32)
+	shaped = Waveshaper("tanh", drive=4).process(tone)
+	if not np.allclose(shaped, np.tanh(4 * tone), atol=1e-5):
+		if verbose:
+			print(f"{indent}Lookup table differs from tanh by {np.max(np.abs(shaped - np.tanh(4 * tone)))}")
+		return False
+	custom = Waveshaper(np.sin, drive=2).process(tone)
+	if not np.allclose(custom, np.sin(2 * tone), atol=1e-5):
+		if verbose:
+			print(f"{indent}Custom curve not applied")
+		return False
+
+	# Oversampling keeps more of the spectrum on the tone's harmonics
+	def aliasing(output):
+		spectrum = np.abs(np.fft.rfft(output * np.hanning(len(output)))) ** 2
+		bins = np.arange(len(spectrum)) % 3000
+		harmonic = (bins < 3) | (bins > 2997)
+		return 10 * np.log10(spectrum[~harmonic].sum() / spectrum.sum())
+	plain = aliasing(Waveshaper("hard", drive=4).process(tone)[:rate])
+	oversampled = aliasing(Waveshaper("hard", drive=4, oversample=4).process(tone)[rate // 2:rate // 2 + rate])
+	if oversampled > plain - 20:
+		if verbose:
+			print(f"{indent}Oversampled aliasing {oversampled} dB not below {plain} dB")
+		return False
+
+	# Block-wise processing carries the oversampling filters across blocks
+	data = np.stack((tone, -tone), axis=1)
+	shaper = Waveshaper("cubic", drive=2, oversample=2)
+	whole = shaper.process(data)
+	shaper.reset()
+	blocks = np.concatenate([shaper.process(data[i:i + 256]) for i in range(0, len(data), 256)])
+	if not np.allclose(whole, blocks, atol=1e-5):
+		if verbose:
+			print(f"{indent}Block-wise result differs by {np.max(np.abs(whole - blocks))}")
+		return False
+	# The oversampled output is the band-limited shaped signal, `latency` frames late
+	plain = Waveshaper("cubic", drive=2).process(data)
+	if not np.allclose(whole[shaper.latency:], plain[:len(plain) - shaper.latency], atol=0.1):
+		if verbose:
+			print(f"{indent}Oversampled output not aligned to {shaper.latency} frames of latency")
+		return False
+	silent = Waveshaper("tanh", drive=4).shape(np.array([np.nan, 0.5, np.nan], dtype=np.float32))
+	if not np.array_equal(silent[[0, 2]], [0, 0]) or not np.isclose(silent[1], np.tanh(2), atol=1e-5):
+		if verbose:
+			print(f"{indent}NaN input not shaped as silence: {silent}")
+		return False
+	modulated = Oscillator("sine", sine(5) * 100 + 1000)
+	if not segmentable(WaveshaperNode(sine(1000), Waveshaper())) \
+			or segmentable(WaveshaperNode(sine(1000), Waveshaper(oversample=2))) \
+			or segmentable(WaveshaperNode(AddNode(modulated, sine(500)), Waveshaper())):
+		if verbose:
+			print(f"{indent}WaveshaperNode seekability wrong")
+		return False
+	return True
+
+def test_batch_processing(indent, verbose):
+	if verbose:
+		print(f"{indent}Testing batch processing...")
+	rate = 44100
+	noise = np.random.default_rng(0).standard_normal((rate, 2)).astype(np.float32) * 0.1
+	with tempfile.TemporaryDirectory() as directory:
+		inputs, outputs = os.path.join(directory, "in"), os.path.join(directory, "out")
+		os.makedirs(os.path.join(inputs, "nested"))
+		sf.write(os.path.join(inputs, "a.wav"), noise, rate, subtype="FLOAT")
+		sf.write(os.path.join(inputs, "nested", "b.wav"), noise[:, :1] * 2, rate, subtype="FLOAT")
+
+		stages = parse_chain("gain:-6")
+		results = process_tree(inputs, outputs, stages, "flac", jobs=2, block_size=1000, report=None)
+		if sorted(result.status for result in results) != ["processed"] * 2:
+			if verbose:
+				print(f"{indent}Batch run failed: {results}")
+			return False
+		data, _ = sf.read(os.path.join(outputs, "a.flac"), dtype="float32")
+		if not np.allclose(data, noise * 10 ** (-6 / 20), atol=2 / 32768):
+			if verbose:
+				print(f"{indent}Gain not applied")
+			return False
+
+		# Unchanged inputs are skipped until they or the chain change
+		sf.write(os.path.join(inputs, "a.wav"), noise * 0.5, rate, subtype="FLOAT")
+		results = process_tree(inputs, outputs, stages, "flac", jobs=2, report=None)
+		statuses = {os.path.basename(result.source): result.status for result in results}
+		if statuses != {"a.wav": "processed", "b.wav": "skipped"}:
+			if verbose:
+				print(f"{indent}Unexpected statuses {statuses}")
+			return False
+		stages = parse_chain("high_pass:20,peak:1000:3:2,compress:-30:2,limit:-6:20,normalize:-3")
+		process_tree(inputs, outputs, stages, "wav", "FLOAT", jobs=2, block_size=1000, report=None)
+		data, _ = sf.read(os.path.join(outputs, "nested", "b.wav"), dtype="float32")
+		if len(data) != rate:
+			if verbose:
+				print(f"{indent}Lookahead changed the length to {len(data)}")
+			return False
+		if not np.isclose(np.max(np.abs(data)), 10 ** (-3 / 20), atol=1e-6):
+			if verbose:
+				print(f"{indent}Normalized peak {np.max(np.abs(data))} != -3 dBFS")
+			return False
+
+		# Inputs that would share an output fail instead of overwriting it
+		sf.write(os.path.join(inputs, "a.flac"), noise, rate)
+		aiff = os.path.join(directory, "aiff")
+		results = process_tree(inputs, aiff, parse_chain("gain:-6"), "aif", jobs=2, report=None)
+		statuses = {os.path.relpath(result.source, inputs): result.status for result in results}
+		expected = {"a.wav": "failed", "a.flac": "failed", os.path.join("nested", "b.wav"): "processed"}
+		if statuses != expected or sf.info(os.path.join(aiff, "nested", "b.aif")).format != "AIFF":
+			if verbose:
+				print(f"{indent}Unexpected statuses {statuses} for a clashing AIFF run")
+			return False
+		if os.path.exists(os.path.join(aiff, "a.aif")):
+			if verbose:
+				print(f"{indent}Clashing inputs written")
+			return False
+	try:
+		parse_chain("normalize:-1,gain:3")
+		if verbose:
+			print(f"{indent}Misplaced normalize accepted")
+		return False
+	except ValueError:
+		pass
+	return True
+
 def test_audio_load_and_save(origfile, newfile):
 	rate,data = load_audio(origfile)
 	assert data.dtype == np.float32, f"Data type {data.dtype} != np.float32"
@@ -128,6 +335,18 @@ def test_sound_manager(root, indent, verbose, *kargs, **kwargs):
 	# Test data type and max value handling
 	if not test_scale_dtype(indent+"\t", verbose):
 		return False
+	# Test block-wise filtering
+	if not test_equalizer(indent+"\t", verbose):
+		return False
+	# Test block-wise compression
+	if not test_dynamics(indent+"\t", verbose):
+		return False
+	# Test lookup-table waveshaping
+	if not test_waveshaper(indent+"\t", verbose):
+		return False
+	# Test processing directory trees
+	if not test_batch_processing(indent+"\t", verbose):
+		return False
 	# File paths for testing
 	buffer_file = os.path.join(root, "audio", "buffer.wav")
 	original = os.path.join(root, "audio", "original.wav")